@@ -0,0 +1,158 @@
+"""
+Build benchmark on a synthetic notebook corpus.
+
+Measures a cold build, a no-op rebuild and a rebuild after editing one
+notebook, each as a fresh ``src/build.py`` process. Wall time, peak RSS
+and output size go to a JSON file; pass ``--compare`` an earlier file to
+see the change.
+
+    python benchmarks/bench_build.py --notebooks 50 --output results.json
+    python benchmarks/bench_build.py --output new.json --compare results.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+from corpus import generate_corpus, add_corpus_arguments, corpus_options
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUILD_SCRIPT = os.path.join(REPO_DIR, 'src', 'build.py')
+RESULT_VERSION = 1
+
+
+def run_process(cmd, cwd):
+    """Run ``cmd`` and return (seconds, peak RSS in bytes or None)."""
+    started = time.perf_counter()
+    process = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if hasattr(os, 'wait4'):
+        _, status, usage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - started
+        returncode = os.waitstatus_to_exitcode(status)
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        peak_rss = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+        process.returncode = returncode
+        stderr = process.stderr.read()
+    else:
+        _, stderr = process.communicate()
+        elapsed = time.perf_counter() - started
+        returncode, peak_rss = process.returncode, None
+    process.stderr.close()
+    if returncode != 0:
+        raise RuntimeError(f"{' '.join(cmd)} failed:\n{stderr.decode(errors='replace')}")
+    return elapsed, peak_rss
+
+
+def output_bytes(build_dir):
+    """Size of the published site, hidden files excluded."""
+    total = 0
+    for root, dirs, files in os.walk(build_dir):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files if not f.startswith('.'))
+    return total
+
+
+def edit_notebook(path):
+    """Append a sentence to the last markdown cell, a typical author edit."""
+    with open(path, 'r', encoding='utf-8') as f:
+        nb = json.load(f)
+    cell = next(c for c in reversed(nb['cells']) if c['cell_type'] == 'markdown')
+    cell['source'].append(f"\n\nEdited at {time.time()}.")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(nb, f, indent=1, sort_keys=True)
+
+
+def measure(name, cmd, site_dir, repeat=1, before=None):
+    runs = []
+    for _ in range(repeat):
+        if before:
+            before()
+        runs.append(run_process(cmd, site_dir))
+    seconds = [elapsed for elapsed, _ in runs]
+    peaks = [peak for _, peak in runs if peak is not None]
+    result = {
+        'seconds': min(seconds),
+        'median_seconds': statistics.median(seconds),
+        'runs': len(runs),
+        'peak_rss_bytes': max(peaks) if peaks else None,
+        'output_bytes': output_bytes(os.path.join(site_dir, 'build')),
+    }
+    print(f"  {name:<8} {result['seconds'] * 1000:9.0f} ms  (median {result['median_seconds'] * 1000:.0f} ms)")
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(site_dir, cfg):
+    shutil.copytree(os.path.join(REPO_DIR, 'resources'), os.path.join(site_dir, 'resources'))
+    paths = generate_corpus(os.path.join(site_dir, 'notebooks'), **corpus_options(cfg))
+    cmd = [sys.executable, BUILD_SCRIPT, '--jobs', str(cfg.jobs)]
+    print(f"Benchmarking {len(paths)} notebooks in {site_dir}")
+
+    scenarios = {
+        'cold': measure('cold', cmd, site_dir),
+        'noop': measure('noop', cmd, site_dir, cfg.repeat),
+        'edit': measure('edit', cmd, site_dir, cfg.repeat, before=lambda: edit_notebook(paths[0])),
+    }
+    return {
+        'version': RESULT_VERSION,
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'jobs': cfg.jobs,
+        'corpus': corpus_options(cfg),
+        'scenarios': scenarios,
+    }
+
+
+def compare(result, baseline):
+    print(f"Compared with {baseline.get('commit') or 'baseline'}:")
+    for name, scenario in result['scenarios'].items():
+        old = baseline['scenarios'].get(name)
+        if not old:
+            continue
+        for metric in ('seconds', 'peak_rss_bytes', 'output_bytes'):
+            if scenario[metric] is None or not old[metric]:
+                continue
+            change = (scenario[metric] - old[metric]) / old[metric] * 100
+            print(f"  {name:<8} {metric:<16} {change:+7.1f}%")
+    if baseline.get('corpus') != result['corpus']:
+        print("⚠️ The corpora differ, the comparison is not like for like")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_corpus_arguments(parser)
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='passed on to build.py')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of the no-op and edit rebuilds')
+    parser.add_argument('--output', default='benchmark.json', help='where to write the results')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--keep', action='store_true', help="don't delete the generated site")
+    cfg = parser.parse_args()
+
+    site_dir = tempfile.mkdtemp(prefix='nb-bench-')
+    try:
+        result = run_benchmark(site_dir, cfg)
+    finally:
+        if not cfg.keep:
+            shutil.rmtree(site_dir, ignore_errors=True)
+
+    with open(cfg.output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=1, sort_keys=True)
+    print(f"Results written to {cfg.output}")
+
+    if cfg.compare:
+        with open(cfg.compare, 'r', encoding='utf-8') as f:
+            compare(result, json.load(f))
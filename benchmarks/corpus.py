@@ -0,0 +1,181 @@
+"""
+Synthetic notebook trees for benchmarking the build.
+
+Every notebook gets a valid POST_SETTINGS cell with a hero image, and a
+configurable mix of markdown cells, markdown images and code cells with
+base64 PNG figure outputs. Output is deterministic for a given seed.
+
+    python benchmarks/corpus.py OUT_DIR --notebooks 50 --categories 5
+"""
+import os
+import json
+import zlib
+import struct
+import random
+import argparse
+import base64
+
+LOREM = (
+    "entropy measures the average information content of a source and bounds "
+    "how far any lossless code can compress it while cross entropy compares "
+    "two distributions and appears as the loss of most classifiers"
+).split()
+
+
+def png_bytes(width, height, seed):
+    """A small gradient PNG, written with the standard library only."""
+    rng = random.Random(seed)
+    r0, g0, b0 = (rng.randrange(256) for _ in range(3))
+    rows = []
+    for y in range(height):
+        row = bytearray([0])  # filter type: none
+        for x in range(width):
+            row += bytes(((r0 + x) % 256, (g0 + y) % 256, (b0 + x + y) % 256))
+        rows.append(bytes(row))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header)
+            + chunk(b'IDAT', zlib.compress(b''.join(rows), 6)) + chunk(b'IEND', b''))
+
+
+def sentence(rng, words=20):
+    return ' '.join(rng.choice(LOREM) for _ in range(words)).capitalize() + '.'
+
+
+def source_lines(text):
+    lines = text.split('\n')
+    return [line + '\n' for line in lines[:-1]] + [lines[-1]]
+
+
+def settings_cell(title, category, image):
+    settings = {
+        'image': image,
+        'title': title,
+        'description': f'Synthetic benchmark post {title}',
+        'category': category,
+        'tags': ['Benchmark'],
+    }
+    return {
+        'cell_type': 'code', 'execution_count': None, 'metadata': {}, 'outputs': [],
+        'source': source_lines(f"POST_SETTINGS = {json.dumps(settings, indent=4)}"),
+    }
+
+
+def markdown_cell(text):
+    return {'cell_type': 'markdown', 'metadata': {}, 'source': source_lines(text)}
+
+
+def figure_cell(rng, index, figure_size):
+    png = base64.b64encode(png_bytes(figure_size, figure_size * 3 // 4, rng.random())).decode('ascii')
+    return {
+        'cell_type': 'code', 'execution_count': index, 'metadata': {},
+        'source': source_lines(f"plt.plot(x, y{index})\nplt.show()"),
+        'outputs': [{
+            'output_type': 'display_data', 'metadata': {},
+            'data': {'image/png': png, 'text/plain': ['<Figure size 640x480 with 1 Axes>']},
+        }],
+    }
+
+
+def code_cell(rng, index):
+    return {
+        'cell_type': 'code', 'execution_count': index, 'metadata': {},
+        'source': source_lines(f"values = [i * {rng.randint(2, 9)} for i in range(100)]\nsum(values)"),
+        'outputs': [{
+            'output_type': 'execute_result', 'execution_count': index, 'metadata': {},
+            'data': {'text/plain': [str(rng.randint(1000, 99999))]},
+        }],
+    }
+
+
+def notebook(cells):
+    return {
+        'cells': cells,
+        'metadata': {
+            'kernelspec': {'display_name': 'Python 3', 'language': 'python', 'name': 'python3'},
+            'language_info': {'name': 'python'},
+        },
+        'nbformat': 4,
+        'nbformat_minor': 2,
+    }
+
+
+def write_notebook(path, nb):
+    # Sorted keys and one-space indent, like nbformat writes them
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(nb, f, indent=1, sort_keys=True, ensure_ascii=False)
+        f.write('\n')
+
+
+def generate_corpus(root, notebooks=20, categories=3, cells=30, markdown_images=2,
+                    figures=3, image_size=640, figure_size=320, seed=0):
+    """
+    Write a synthetic notebook tree below ``root``.
+
+    Notebooks are spread evenly over ``categories`` directories. Each has
+    ``cells`` cells in total, of which ``markdown_images`` reference local
+    images and ``figures`` carry a base64 PNG output. Returns the notebook
+    paths.
+    """
+    rng = random.Random(seed)
+    paths = []
+    for n in range(notebooks):
+        category = f"category_{n % categories}"
+        nb_dir = os.path.join(root, category)
+        img_dir = os.path.join(nb_dir, 'img')
+        os.makedirs(img_dir, exist_ok=True)
+
+        name = f"post_{n:04d}"
+        hero = f"img/{name}_hero.png"
+        with open(os.path.join(nb_dir, hero), 'wb') as f:
+            f.write(png_bytes(image_size, image_size * 9 // 16, rng.random()))
+
+        body = []
+        for i in range(markdown_images):
+            image = f"img/{name}_{i}.png"
+            with open(os.path.join(nb_dir, image), 'wb') as f:
+                f.write(png_bytes(image_size, image_size * 3 // 4, rng.random()))
+            body.append(markdown_cell(f"{sentence(rng)}\n\n![figure {i}]({image})"))
+        for i in range(figures):
+            body.append(figure_cell(rng, i + 1, figure_size))
+        remaining = max(cells - 1 - len(body), 0)
+        for i in range(remaining):
+            body.append(markdown_cell(f"## Section {i}\n\n{sentence(rng, 60)}") if i % 2 == 0 else code_cell(rng, i))
+        rng.shuffle(body)
+
+        path = os.path.join(nb_dir, f"{name}.ipynb")
+        write_notebook(path, notebook([settings_cell(f"Post {n}", category, hero)] + body))
+        paths.append(path)
+    return paths
+
+
+def add_corpus_arguments(parser):
+    parser.add_argument('--notebooks', type=int, default=20, help='number of notebooks')
+    parser.add_argument('--categories', type=int, default=3, help='number of category directories')
+    parser.add_argument('--cells', type=int, default=30, help='cells per notebook')
+    parser.add_argument('--markdown-images', type=int, default=2, help='local images referenced per notebook')
+    parser.add_argument('--figures', type=int, default=3, help='base64 PNG figure outputs per notebook')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def corpus_options(cfg):
+    return {
+        'notebooks': cfg.notebooks,
+        'categories': cfg.categories,
+        'cells': cfg.cells,
+        'markdown_images': cfg.markdown_images,
+        'figures': cfg.figures,
+        'seed': cfg.seed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('out_dir', help='directory to write the notebook tree to')
+    add_corpus_arguments(parser)
+    cfg = parser.parse_args()
+    paths = generate_corpus(cfg.out_dir, **corpus_options(cfg))
+    print(f"Wrote {len(paths)} notebooks to {cfg.out_dir}")
@@ -0,0 +1,59 @@
+// Loads notebook outputs the build moved out of the page because they were
+// over the output budget (see LargeOutputPreprocessor in src/nb_processors.py).
+// Each placeholder is fetched shortly before it scrolls into view, or when
+// its button is clicked.
+
+async function loadLazyOutput(placeholder) {
+  if (placeholder.dataset.state) {
+    return;
+  }
+  placeholder.dataset.state = 'loading';
+  try {
+    const response = await fetch(placeholder.dataset.src);
+    if (!response.ok) {
+      throw new Error(`${response.status} ${response.statusText}`);
+    }
+    const output = document.createElement('div');
+    output.innerHTML = await response.text();
+    // Scripts inserted through innerHTML never run, recreate them so they do
+    output.querySelectorAll('script').forEach(original => {
+      const script = document.createElement('script');
+      [...original.attributes].forEach(attr => script.setAttribute(attr.name, attr.value));
+      script.textContent = original.textContent;
+      original.replaceWith(script);
+    });
+    placeholder.replaceWith(...output.childNodes);
+  } catch (error) {
+    delete placeholder.dataset.state;
+    console.error(`Could not load output ${placeholder.dataset.src}:`, error);
+  }
+}
+
+function initLazyOutputs() {
+  const placeholders = document.querySelectorAll('.lazy-output');
+  if (placeholders.length === 0) {
+    return;
+  }
+
+  placeholders.forEach(placeholder => {
+    placeholder.querySelector('.lazy-output-load')
+      ?.addEventListener('click', () => loadLazyOutput(placeholder));
+  });
+
+  if (!('IntersectionObserver' in window)) {
+    return;
+  }
+  const observer = new IntersectionObserver(entries => {
+    entries.filter(entry => entry.isIntersecting).forEach(entry => {
+      observer.unobserve(entry.target);
+      loadLazyOutput(entry.target);
+    });
+  }, { rootMargin: '600px 0px' });
+  placeholders.forEach(placeholder => observer.observe(placeholder));
+}
+
+if (document.readyState === 'loading') {
+  document.addEventListener('DOMContentLoaded', initLazyOutputs);
+} else {
+  initLazyOutputs();
+}
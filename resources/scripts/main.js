@@ -87,21 +87,48 @@ function init() {
   const initialTheme = getInitialTheme();
   applyTheme(initialTheme);
 
-  const socket = new WebSocket("ws://localhost:8765");
-  socket.onmessage = (event) => {
-    console.log("Project changed, reloading...");
-    location.reload()
-  };
+  connectLiveReload();
+}
 
-  socket.addEventListener("open", (event) => {
-    socket.send("Hello Server!");
-  });
 
-  // Listen for messages
+// Swap a stylesheet for a cache-busted copy, removing the old one once loaded
+function reloadStylesheet(link) {
+  const url = new URL(link.href);
+  url.searchParams.set('v', Date.now());
+
+  const newLink = link.cloneNode();
+  newLink.href = url.href;
+  newLink.addEventListener('load', () => link.remove());
+  newLink.addEventListener('error', () => link.remove());
+  link.after(newLink);
+}
+
+// Live reload from the --watch dev server (only when served locally)
+function connectLiveReload() {
+  if (!['localhost', '127.0.0.1'].includes(location.hostname)) {
+    return;
+  }
+
+  const socket = new WebSocket("ws://localhost:8765");
   socket.addEventListener("message", (event) => {
-    console.log("Message from server ", event.data);
+    const message = JSON.parse(event.data);
+
+    if (message.type === 'css') {
+      // Only swap the stylesheets that changed, keeping scroll and page state
+      const links = document.querySelectorAll('link[rel="stylesheet"]');
+      links.forEach(link => {
+        const path = new URL(link.href).pathname;
+        if (message.paths.some(changed => path.endsWith('/' + changed))) {
+          reloadStylesheet(link);
+        }
+      });
+      console.log("Stylesheets changed: ", message.paths);
+      return;
+    }
+
+    console.log("Project changed, reloading...");
+    location.reload();
   });
-  console.log(socket);
 }
 
 
@@ -0,0 +1,143 @@
+// Client-side search over the index the build writes to search/.
+// index.json lists the posts and the shard versions; each shard holds the
+// tokens sharing a prefix, so a query only downloads the shards it touches.
+
+const SEARCH_STOPWORDS = new Set(`a an and are as at be but by for from has have if in into is it its of on or
+  that the their then there these this to was we were which will with you your`.split(/\s+/));
+const SEARCH_MAX_RESULTS = 20;
+
+const searchState = {
+  index: null,
+  base: '',
+  shards: new Map(),
+};
+
+// Same rules as tokenize() in src/search.py
+function searchTokens(text) {
+  return (text.toLowerCase().match(/[\p{L}\p{N}_]+/gu) || [])
+    .filter(token => token.length >= 2 && !SEARCH_STOPWORDS.has(token) && !/^\d+$/.test(token));
+}
+
+async function loadSearchIndex(url) {
+  if (!searchState.index) {
+    const response = await fetch(url, { cache: 'no-cache' });
+    searchState.index = await response.json();
+    searchState.base = url.slice(0, url.lastIndexOf('/') + 1);
+  }
+  return searchState.index;
+}
+
+function loadShard(prefix) {
+  const version = searchState.index.shards[prefix];
+  if (!version) {
+    return Promise.resolve({});
+  }
+  if (!searchState.shards.has(prefix)) {
+    const url = `${searchState.base}${encodeURIComponent(prefix)}.json?v=${version}`;
+    searchState.shards.set(prefix, fetch(url).then(response => response.json()));
+  }
+  return searchState.shards.get(prefix);
+}
+
+// [[post, first, delta, ...], ...] -> Map(post -> [positions])
+function decodePostings(entries, into = new Map()) {
+  for (const [post, ...deltas] of entries) {
+    let position = 0;
+    const positions = into.get(post) || [];
+    deltas.forEach(delta => positions.push(position += delta));
+    into.set(post, positions);
+  }
+  return into;
+}
+
+async function termPostings(term, asPrefix) {
+  const shard = await loadShard(term.slice(0, searchState.index.prefix_length));
+  const matches = new Map();
+  for (const [token, entries] of Object.entries(shard)) {
+    if (token === term || (asPrefix && token.startsWith(term))) {
+      decodePostings(entries, matches);
+    }
+  }
+  matches.forEach(positions => positions.sort((a, b) => a - b));
+  return matches;
+}
+
+function followsInPhrase(previous, positions) {
+  return positions.some(position => previous.includes(position - 1));
+}
+
+async function searchPosts(query) {
+  const terms = searchTokens(query);
+  if (!terms.length) {
+    return [];
+  }
+
+  // The word being typed matches as a prefix, the others must be complete
+  const typing = !/\s$/.test(query);
+  const postings = await Promise.all(
+    terms.map((term, i) => termPostings(term, typing && i === terms.length - 1))
+  );
+
+  const results = [];
+  for (const post of postings[0].keys()) {
+    if (!postings.every(matches => matches.has(post))) {
+      continue;
+    }
+    const doc = searchState.index.docs[post];
+    const titleLength = searchTokens(doc.title).length;
+    let score = 0;
+    postings.forEach((matches, i) => {
+      const positions = matches.get(post);
+      score += Math.log(1 + positions.length);
+      if (positions[0] < titleLength) {
+        score += 2;
+      }
+      if (i > 0 && followsInPhrase(postings[i - 1].get(post), positions)) {
+        score += 1;
+      }
+    });
+    results.push({ doc, score });
+  }
+  return results.sort((a, b) => b.score - a.score).slice(0, SEARCH_MAX_RESULTS);
+}
+
+function renderSearchResults(list, results, root) {
+  list.replaceChildren(...results.map(({ doc }) => {
+    const item = document.createElement('li');
+    const link = document.createElement('a');
+    link.href = root + doc.url;
+    link.textContent = doc.title;
+    const description = document.createElement('p');
+    description.textContent = doc.description;
+    item.append(link, description);
+    return item;
+  }));
+}
+
+function initSearch() {
+  const input = document.getElementById('site-search');
+  const list = document.getElementById('site-search-results');
+  if (!input || !list) {
+    return;
+  }
+
+  let pending = null;
+  input.addEventListener('input', () => {
+    clearTimeout(pending);
+    pending = setTimeout(async () => {
+      const query = input.value;
+      await loadSearchIndex(input.dataset.searchIndex);
+      const results = await searchPosts(query);
+      // Drop results of a query the reader has already typed past
+      if (input.value === query) {
+        renderSearchResults(list, results, input.dataset.searchRoot);
+      }
+    }, 150);
+  });
+}
+
+if (document.readyState === 'loading') {
+  document.addEventListener('DOMContentLoaded', initSearch);
+} else {
+  initSearch();
+}
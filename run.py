@@ -1,21 +1,83 @@
 import os
-import time
-import subprocess
-import hashlib
+import sys
+import asyncio
+import argparse
 
 # Configuration
-BUILD_SCRIPT_PATH = os.path.join('src', 'build.py')
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src')
+sys.path.insert(0, SRC_DIR)
 
+from daemon import BuildDaemon, daemon_supported, request_build, send_request, ping
+from execution import DEFAULT_EXECUTE_TIMEOUT
+from core import DEFAULT_OUTPUT_BUDGET
+from images import FIGURE_MAX_WIDTH, FIGURE_PIXEL_RATIO
 
-def run_build():
-    cmd = ['python', BUILD_SCRIPT_PATH]
+
+def run_build(files=None, force=False, jobs=1, trace=None, precompress=False, execute=False,
+              execute_timeout=DEFAULT_EXECUTE_TIMEOUT, output_budget=DEFAULT_OUTPUT_BUDGET // 1024,
+              prerender_math=False, figure_width=FIGURE_MAX_WIDTH, pixel_ratio=FIGURE_PIXEL_RATIO):
+    """Build through the daemon when one is running, in this process otherwise."""
+    result = request_build(files, force=force, jobs=jobs, trace=trace, precompress=precompress,
+                           execute=execute, execute_timeout=execute_timeout, output_budget=output_budget,
+                           prerender_math=prerender_math, figure_width=figure_width, pixel_ratio=pixel_ratio)
+    where = 'daemon' if result['daemon'] else 'in-process'
+    if result['ok']:
+        print(f"✅ Build completed successfully ({where}, {result['elapsed_ms']:.0f} ms, "
+              f"{len(result['written'])} file(s) written)\n")
+    else:
+        print(f"❌ Build failed ({where}): {result['error']}\n")
+        if result.get('traceback'):
+            print(result['traceback'])
+    return result
+
+
+def start_daemon():
+    if not daemon_supported():
+        print("❌ The build daemon needs Unix sockets, use plain builds on this platform")
+        return
     try:
-        subprocess.run(cmd, check=True)
-        print("✅ Build completed successfully\n")
-    except subprocess.CalledProcessError:
-        print("❌ Build failed\n")
-    except FileNotFoundError:
-        print(f"❌ Build script not found at {BUILD_SCRIPT_PATH}\n")
+        asyncio.run(BuildDaemon().serve())
+    except KeyboardInterrupt:
+        pass
+
+
+def stop_daemon():
+    if not ping():
+        print("No build daemon is running")
+        return
+    send_request({'command': 'stop'})
+    print("✅ Build daemon stopped")
+
 
 if __name__ == "__main__":
-    run_build()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='*', help='changed files; only what depends on them is rebuilt')
+    parser.add_argument('--daemon', action='store_true', help='run a build daemon that keeps the pipeline warm')
+    parser.add_argument('--stop', action='store_true', help='stop a running build daemon')
+    parser.add_argument('--force', action='store_true', help='ignore the build manifest and rebuild everything')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='convert notebooks in N processes (0 = one per CPU core)')
+    parser.add_argument('--precompress', action='store_true', help='write .gz/.br siblings of compressible outputs')
+    parser.add_argument('--output-budget', type=int, default=DEFAULT_OUTPUT_BUDGET // 1024, metavar='KB',
+                        help='lazy-load notebook outputs bigger than this (0 keeps every output inline)')
+    parser.add_argument('--prerender-math', action='store_true',
+                        help='render markdown math to SVG at build time, MathJax only where that fails')
+    parser.add_argument('--figure-width', type=int, default=FIGURE_MAX_WIDTH, metavar='PX',
+                        help='widest CSS size output figures are shown at')
+    parser.add_argument('--pixel-ratio', type=float, default=FIGURE_PIXEL_RATIO,
+                        help='device pixels per CSS pixel output figures keep')
+    parser.add_argument('--trace', metavar='OUT.json', help='write a Chrome/Perfetto trace of every build stage')
+    parser.add_argument('--execute', action='store_true', help='run notebooks before rendering them (outputs are cached per cell)')
+    parser.add_argument('--execute-timeout', type=int, default=DEFAULT_EXECUTE_TIMEOUT, metavar='SECONDS',
+                        help='time limit for executing one notebook')
+    cfg = parser.parse_args()
+
+    if cfg.daemon:
+        start_daemon()
+    elif cfg.stop:
+        stop_daemon()
+    else:
+        result = run_build(cfg.files, force=cfg.force, jobs=cfg.jobs, trace=cfg.trace,
+                           precompress=cfg.precompress, execute=cfg.execute, execute_timeout=cfg.execute_timeout,
+                           output_budget=cfg.output_budget, prerender_math=cfg.prerender_math,
+                           figure_width=cfg.figure_width, pixel_ratio=cfg.pixel_ratio)
+        sys.exit(0 if result['ok'] else 1)
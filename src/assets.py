@@ -0,0 +1,104 @@
+import os
+import re
+import sys
+import shutil
+import hashlib
+
+from pathlib import Path
+from tracing import span
+from output import replace_from_temp
+from core import *
+
+ASSET_HASH_LENGTH = 20
+ASSET_NAME_PATTERN = re.compile(rf'^[0-9a-f]{{{ASSET_HASH_LENGTH}}}(\.[A-Za-z0-9]+)?$')
+FICLONE = 0x40049409  # ioctl number for a copy-on-write clone on Linux
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def reflink(src_path, dest_path):
+    """Copy-on-write clone (btrfs, xfs, ...). Raises OSError when unsupported."""
+    if not sys.platform.startswith('linux'):
+        raise OSError('reflinks are only attempted on Linux')
+    import fcntl
+    with open(src_path, 'rb') as src, open(dest_path, 'wb') as dest:
+        fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+
+
+def reflink_or_copy(src_path, dest_path):
+    """
+    Place ``src_path`` at ``dest_path`` as a copy-on-write clone where the
+    filesystem supports it, as a plain copy otherwise. Never a hardlink: the
+    published file would share its inode with the source, so editing the
+    source in place would change an asset that is named by its old content.
+    """
+    def clone_or_copy(tmp_path):
+        try:
+            reflink(src_path, tmp_path)
+        except OSError:
+            shutil.copyfile(src_path, tmp_path)
+
+    replace_from_temp(f"{dest_path}.{os.getpid()}.tmp", dest_path, clone_or_copy)
+
+
+class AssetStore:
+    """
+    Content-addressed store for images published under ``static/img``.
+
+    Files are named by the hash of their content, so unchanged images keep
+    their URL across builds (and in browser/CDN caches), identical images are
+    stored once and a file that is already present is never written again.
+    Sources are reflinked into the store when the filesystem allows it and
+    copied otherwise.
+    """
+
+    def __init__(self, root=OUTPUT_IMG_DIR, url_base='static/img'):
+        self.root = Path(root)
+        self.url_base = url_base
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def name_for(self, digest, ext):
+        return f"{digest[:ASSET_HASH_LENGTH]}{ext.lower()}"
+
+    def add_file(self, src_path):
+        """Publish a file and return its store name."""
+        src_path = Path(src_path)
+        name = self.name_for(hash_file(src_path), src_path.suffix)
+        dest_path = self.root / name
+        if not dest_path.exists():
+            with span('publish asset', 'assets', path=str(src_path)):
+                reflink_or_copy(src_path, dest_path)
+        return name
+
+    def add_bytes(self, data, ext):
+        """Publish in-memory content and return its store name."""
+        name = self.name_for(hashlib.sha256(data).hexdigest(), ext)
+        dest_path = self.root / name
+        if not dest_path.exists():
+            tmp_path = f"{dest_path}.{os.getpid()}.tmp"
+            with span('publish asset', 'assets', asset=name), open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, dest_path)
+        return name
+
+    def path(self, name):
+        return self.root / name
+
+    def url(self, name, prefix=''):
+        return f"{prefix}{self.url_base}/{name}"
+
+    def gc(self, keep):
+        """Delete content-addressed files that no output references any more."""
+        keep = {os.path.basename(str(path)) for path in keep}
+        removed = 0
+        for entry in os.scandir(self.root):
+            if entry.is_file() and ASSET_NAME_PATTERN.match(entry.name) and entry.name not in keep:
+                os.remove(entry.path)
+                removed += 1
+        return removed
@@ -1,16 +1,39 @@
-import os
-import uuid
 import time
-import shutil
-import hashlib
+IMPORTS_STARTED = time.perf_counter()
+
+import os
+import json
 import asyncio
+import functools
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 from notebooks import *
+from manifest import *
+from watcher import *
+from depgraph import *
+from nb_index import *
+from server import *
+from tracing import *
+from output import *
+from static_assets import *
+from compress import *
+from search import *
+from listing import *
 from core import *
 
-WATCH_INTERVAL = 1  # seconds
-EXTENSIONS_TO_WATCH = ['.py', '.html', '.css', '.js', '.ipynb']
-IGNORED_DIRECTORIES = ['./.git', str(OUTPUT_DIR)]
+STARTUP_TIMINGS['import build modules'] = time.perf_counter() - IMPORTS_STARTED
+
+EXTENSIONS_TO_WATCH = ['.py', '.html', '.css', '.js', '.ipynb', '.png', '.jpg', '.jpeg', '.webp', '.svg']
+IGNORED_DIRECTORIES = ['./.git', str(OUTPUT_DIR), str(CACHE_DIR)]
+
+# Site pages rendered from TEMPLATES_DIR and the template each one starts from
+SITE_PAGES = {
+    'about.html': 'about.html',
+    FEED_PAGE: FEED_TEMPLATE,
+}
+# Manifest key of the homepage/category/tag listings as a whole
+LISTING_KEY = 'listing:pages'
 
 SAMPLE_PUBLICATIONS = [
     {
@@ -51,42 +74,98 @@ SAMPLE_PROJECTS = [
 ]
 
 
-def generate_website(nb_by_category, nb_page_settings):
-    """Generate homepage with featured posts using Jinja template."""
+def template_digest(manifest, name):
+    """Hash of a site template and everything it extends or includes."""
+    return hash_json([
+        manifest.file_digest(TEMPLATES_DIR / template)
+        for template in sorted(template_closure(env, name))
+    ])
+
+
+def wanted(targets, key):
+    """True if ``key`` is part of this build (``targets`` None means everything)."""
+    return targets is None or key in targets
+
+
+def render_page(manifest, report, key, path, template_name, depth, context, targets=None):
+    """Render one site page unless the page, its template chain and its context are unchanged."""
+    if not wanted(targets, key):
+        return
+    inputs = None
+    if manifest is not None:
+        inputs = {
+            'templates': template_digest(manifest, template_name),
+            'static': hash_json(env.static_manifest),
+            'context': hash_json(context),
+        }
+        if manifest.is_fresh(key, inputs):
+            return
+
+    env.set_page_depth(depth)
+    with span('render page', 'render', page=str(path)):
+        html = env.get_template(template_name).render(**context)
+    with span('write page', 'io'):
+        report.write_text(path, html)
+    if manifest is not None:
+        manifest.record(key, inputs, [path])
+
+
+def generate_website(post_index, manifest=None, targets=None, report=None):
+    """
+    Generate the paginated homepage, category and tag listings and the Atom
+    feed from the post index.
+
+    Each listing page is its own manifest entry keyed on the slice of posts
+    it shows, so an edit to one post only re-renders the pages listing it.
+    """
+    report = report or OutputReport()
+
+    if wanted(targets, LISTING_KEY):
+        pages = list(post_index.pages())
+        for page in pages:
+            render_page(manifest, report, page.key, OUTPUT_DIR / page.path, page.template, page.depth, page.context)
+
+        # Listings (or pages of them) that no longer exist, e.g. a tag nobody uses
+        if manifest is not None:
+            paths = [page.path for page in pages]
+            for path in set(manifest.get_data(LISTING_KEY) or ()) - set(paths):
+                manifest.entries.pop(f'page:{path}', None)
+                report.remove(OUTPUT_DIR / path)
+            manifest.record(LISTING_KEY, {}, [], data=paths)
+
+    render_page(manifest, report, f'page:{FEED_PAGE}', OUTPUT_DIR / FEED_PAGE, FEED_TEMPLATE, 0,
+                post_index.feed_context(), targets)
 
-    # Set page depth for homepage (root level)
-    env.set_page_depth(0)
-    
-    # Prepare featured posts data
-    featured_posts = []
-
-    for nb_settings in nb_page_settings:
-        featured_posts.append(nb_settings)
-    # Render homepage
-    template = env.get_template('homepage.html')
-    index_html = template.render(
-        post_settings = featured_posts,
-        active_page='home'
-    )
-    
-    with open(os.path.join(OUTPUT_DIR, 'index.html'), 'w', encoding='utf-8') as f:
-        f.write(index_html)
-    
     # Generate other main pages
-    generate_about_page(OUTPUT_DIR)
+    if wanted(targets, 'page:about.html'):
+        generate_about_page(OUTPUT_DIR, manifest, report)
     # generate_publications_page(output_dir)
     # generate_portfolio_page(output_dir)
     
     print(f"Site successfully built at {OUTPUT_DIR}/index.html")
 
-def generate_about_page(output_dir):
+def generate_about_page(output_dir, manifest=None, report=None):
     """Generate the about page using Jinja template."""
+    report = report or OutputReport()
+    about_path = os.path.join(output_dir, 'about.html')
+    inputs = None
+    if manifest is not None:
+        inputs = {
+            'templates': template_digest(manifest, SITE_PAGES['about.html']),
+            'static': hash_json(env.static_manifest),
+        }
+        if manifest.is_fresh('page:about.html', inputs):
+            return
+
     env.set_page_depth(0)  # Root level page
-    template = env.get_template('about.html')
-    about_html = template.render(active_page='about')
+    with span('render about page', 'render'):
+        template = env.get_template('about.html')
+        about_html = template.render(active_page='about')
     
-    with open(os.path.join(output_dir, 'about.html'), 'w', encoding='utf-8') as f:
-        f.write(about_html)
+    with span('write page', 'io'):
+        report.write_text(about_path, about_html)
+    if manifest is not None:
+        manifest.record('page:about.html', inputs, [about_path])
 
 def generate_publications_page(output_dir):
     """Generate the publications page using Jinja template."""
@@ -97,8 +176,7 @@ def generate_publications_page(output_dir):
         publications=SAMPLE_PUBLICATIONS
     )
     
-    with open(os.path.join(output_dir, 'publications.html'), 'w', encoding='utf-8') as f:
-        f.write(publications_html)
+    write_text(os.path.join(output_dir, 'publications.html'), publications_html)
 
 def generate_portfolio_page(output_dir):
     """Generate the portfolio page using Jinja template."""
@@ -109,13 +187,365 @@ def generate_portfolio_page(output_dir):
         projects=SAMPLE_PROJECTS
     )
     
-    with open(os.path.join(output_dir, 'portfolio.html'), 'w', encoding='utf-8') as f:
-        f.write(portfolio_html)
+    write_text(os.path.join(output_dir, 'portfolio.html'), portfolio_html)
+
+
+def resource_destination(filename):
+    """
+    Where a file from RESOURCES_DIR is copied to, or None if it isn't copied.
+    CSS and JS go through ``publish_static_assets`` instead.
+    """
+    if filename.endswith(( ".svg", ".png", ".jpg" )):
+        return OUTPUT_IMG_DIR / filename
+    return None
+
+
+def publish_static_assets(manifest, report, targets=None, fingerprint=True):
+    """
+    Build every CSS/JS asset and bundle, and return the static manifest
+    (logical name -> published path) that ``url_static`` resolves through.
+
+    With ``fingerprint`` the assets are minified and published under
+    content-hashed names that can be cached forever. Without it (the
+    ``--watch`` default) they keep their logical names so stylesheets can be
+    hot-swapped.
+    """
+    static_manifest = {}
+    for logical, sources in static_sources().items():
+        key = f'static:{logical}'
+        if not wanted(targets, key) and key in manifest.entries:
+            manifest.touched.add(key)
+            static_manifest[logical] = manifest.get_data(key)
+            continue
+
+        inputs = {
+            'sources': [manifest.file_digest(RESOURCES_DIR / source) for source in sources],
+            'fingerprint': fingerprint,
+            'pipeline': manifest.file_digest(STATIC_ASSETS_SOURCE),
+        }
+        if manifest.is_fresh(key, inputs):
+            static_manifest[logical] = manifest.get_data(key)
+            continue
+
+        with span('build static asset', 'assets', asset=logical):
+            text = build_static_asset(logical, sources, minified=fingerprint)
+        published = fingerprinted_name(logical, hash_text(text)) if fingerprint else logical
+        dest_path = OUTPUT_DIR / published
+        report.write_text(dest_path, text)
+
+        # The previous fingerprint of this asset is no longer linked from anywhere
+        previous = manifest.entries.get(key)
+        for output in (previous['outputs'] if previous else []):
+            if output != str(dest_path):
+                report.remove(output)
+        manifest.record(key, inputs, [dest_path], data=published)
+        static_manifest[logical] = published
+
+    report.write_text(STATIC_MANIFEST_FILE, json.dumps(static_manifest, indent=1, sort_keys=True))
+    return static_manifest
+
+
+def precompress_outputs(manifest, report, workers=None):
+    """
+    Write .gz (and .br with brotli installed) siblings of every compressible
+    output, in parallel. An output whose bytes haven't changed since it was
+    last compressed is skipped. Builds without --precompress leave these
+    entries untouched, so a full build prunes the siblings instead of
+    leaving stale ones for the host to serve. Runs after ``prune_orphans``,
+    which deletes the siblings of the outputs it removes.
+    """
+    formats = compression_formats()
+    stale = []
+    for path in compressible_outputs():
+        key = f'compress:{path}'
+        inputs = {'source': manifest.file_digest(path), 'formats': formats}
+        if not manifest.is_fresh(key, inputs):
+            stale.append((key, inputs, path))
+
+    # zlib and brotli release the GIL, so threads compress in parallel
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        results = list(pool.map(lambda item: compress_output(item[2], formats), stale))
+
+    for (key, inputs, path), siblings in zip(stale, results):
+        for sibling, changed in siblings:
+            report.record(sibling, changed)
+        manifest.record(key, inputs, [sibling for sibling, _ in siblings])
+    return len(stale)
+
+
+def build_search_index(manifest, report, posts, cards, targets=None):
+    """
+    Write the client-side search index: ``search/index.json`` with the post
+    list and shard versions, plus one shard per token prefix.
+
+    Postings are extracted while converting and kept in each notebook's
+    manifest entry, so an edit to one notebook only re-inverts the stored
+    postings. Shards whose bytes don't change are not rewritten, so their
+    versioned URLs stay cached in browsers.
+    """
+    key = 'search:index'
+    if not wanted(targets, key) and key in manifest.entries:
+        manifest.touched.add(key)
+        return
+
+    docs, doc_postings, sources = [], [], []
+    for (nb_path, nb_file, settings), card in zip(posts, cards):
+        entry = manifest.entries.get(f'notebook:{nb_file}')
+        if not entry or not entry['data'] or 'search' not in entry['data']:
+            continue
+        docs.append({field: card.get(field, '') for field in ('title', 'url', 'description', 'category')})
+        doc_postings.append(entry['data']['search'])
+        sources.append(entry['inputs'])
+
+    # The notebooks' own inputs determine their postings, no need to hash those
+    inputs = {'docs': hash_json(docs), 'notebooks': hash_json(sources)}
+    if manifest.is_fresh(key, inputs):
+        return
+
+    outputs, versions = [], {}
+    for prefix, tokens in build_shards(doc_postings).items():
+        text = compact_json(tokens)
+        path = SEARCH_DIR / f"{prefix}.json"
+        report.write_text(path, text)
+        versions[prefix] = hash_text(text)[:10]
+        outputs.append(path)
+    report.write_text(SEARCH_INDEX_FILE, compact_json({
+        'prefix_length': SHARD_PREFIX_LENGTH,
+        'docs': docs,
+        'shards': versions,
+    }))
+    outputs.append(SEARCH_INDEX_FILE)
+
+    # Shards for prefixes no post uses any more
+    previous = manifest.entries.get(key)
+    for output in (previous['outputs'] if previous else []):
+        if output not in {str(path) for path in outputs}:
+            report.remove(output)
+    manifest.record(key, inputs, outputs)
+
+
+def hero_image_path(nb_path, settings):
+    return os.path.join(NOTEBOOK_DIR, nb_path, Path(settings['image']))
+
+
+def finish_card(manifest, asset_store, responsive, key, inputs, nb_path, nb_file, settings, variants=None):
+    """
+    Publish a post's hero image and record its homepage card.
+
+    ``variants`` are the responsive versions of the hero image, generated for
+    all stale cards in one batch by the caller.
+    """
+    card = dict(settings, url=post_url(settings, nb_file))
+
+    src_path = hero_image_path(nb_path, settings)
+    img_name = asset_store.add_file(src_path)
+    outputs = [asset_store.path(img_name)]
+    card['image'] = asset_store.url(img_name)
+
+    if variants:
+        outputs += responsive.outputs(variants)
+        card['image'] = default_variant(asset_store, variants)
+        card['image_srcset'] = srcset(asset_store, variants['fallback'])
+        card['image_webp_srcset'] = srcset(asset_store, variants['webp'])
+        card['image_sizes'] = CARD_SIZES
+        card['image_width'] = variants['width']
+        card['image_height'] = variants['height']
+
+    manifest.record(key, inputs, outputs, data=card)
+    return card
+
+
+def build_cards(manifest, asset_store, responsive, posts, targets=None):
+    """
+    Homepage card data for every post, built from the notebook index.
+
+    Cards only need POST_SETTINGS and the hero image, so they never wait for
+    (or trigger) a notebook conversion.
+    """
+    cards = {}
+    stale = []
+    for nb_path, nb_file, settings in posts:
+        key = f'card:{nb_file}'
+        if not wanted(targets, key) and key in manifest.entries:
+            cards[key] = manifest.get_data(key)
+            continue
+        inputs = {
+            'settings': hash_json(settings),
+            'hero': manifest.file_digest(hero_image_path(nb_path, settings)),
+        }
+        if manifest.is_fresh(key, inputs):
+            cards[key] = manifest.get_data(key)
+        else:
+            stale.append((key, inputs, nb_path, nb_file, settings))
+
+    # Resize the hero images of every stale card in one parallel batch
+    hero_images = [hero_image_path(nb_path, settings) for _, _, nb_path, _, settings in stale]
+    hero_variants = responsive.process_many(hero_images) if hero_images else {}
+
+    for key, inputs, nb_path, nb_file, settings in stale:
+        variants = hero_variants.get(str(hero_image_path(nb_path, settings)))
+        cards[key] = finish_card(manifest, asset_store, responsive, key, inputs, nb_path, nb_file, settings, variants)
+
+    return [cards[f'card:{nb_file}'] for _, nb_file, _ in posts]
+
+
+def resolve_jobs(jobs):
+    """``--jobs 0`` means one worker per CPU core."""
+    if not jobs:
+        return os.cpu_count() or 1
+    return jobs
+
+
+def print_figure_report(page, figure_report):
+    """What the figure optimizer saved on one converted page."""
+    if not figure_report:
+        return
+    original, optimized = figure_report['original_bytes'], figure_report['bytes']
+    saved = 100 * (original - optimized) / original if original else 0
+    print(f"🖼️ {page}: {figure_report['figures']} figure(s), "
+          f"{original / 1024:.0f} KB -> {optimized / 1024:.0f} KB ({saved:.0f}% saved)")
+
+
+def convert_notebooks(nb_files, jobs=1, execute=False, execute_timeout=DEFAULT_EXECUTE_TIMEOUT,
+                      output_budget=DEFAULT_OUTPUT_BUDGET, prerender_math=False,
+                      figure_width=FIGURE_MAX_WIDTH, pixel_ratio=FIGURE_PIXEL_RATIO):
+    """
+    Convert notebooks serially or in a process pool with one exporter per worker.
+
+    Results come back in the order of ``nb_files`` either way, so a parallel
+    build merges into exactly the same site as a serial one. With
+    ``execute`` each worker also runs its notebooks, each in its own kernel,
+    so independent notebooks execute in parallel.
+    """
+    convert = functools.partial(
+        convert_notebook, execute=execute, execute_timeout=execute_timeout, output_budget=output_budget,
+        prerender_math=prerender_math, figure_width=figure_width, pixel_ratio=pixel_ratio,
+    )
+    if jobs <= 1 or len(nb_files) <= 1:
+        return [convert(nb_file) for nb_file in nb_files]
+
+    workers = min(jobs, len(nb_files))
+    print(f"Converting {len(nb_files)} notebooks with {workers} workers")
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(tracer.enabled,)) as pool:
+        return list(pool.map(convert, nb_files))
+
+
+def prune_orphans(manifest, stale_entries, report):
+    """
+    Delete the outputs of build steps that no longer exist, e.g. the page of
+    a removed notebook, and the outputs steps stopped producing, e.g. the old
+    page of a notebook whose category changed. Their precompressed siblings
+    go with them. Content-addressed assets are left to ``AssetStore.gc``.
+    """
+    still_used = {output for entry in manifest.entries.values() for output in entry['outputs']}
+    gone = [output for entry in stale_entries.values() for output in entry['outputs']] + manifest.dropped
+    for output in dict.fromkeys(gone):
+        if output not in still_used and not ASSET_NAME_PATTERN.match(os.path.basename(output)):
+            report.remove(output)
+            for sibling in compressed_siblings(output):
+                report.remove(sibling)
+
+
+def build_dependency_graph(manifest, posts, fingerprint=False):
+    """
+    Work out which build targets every input file feeds into.
+
+    Notebooks feed their own page, their card, the listings and the feed, hero images
+    feed the card and listings, images recorded in the manifest feed the page that uses
+    them, site templates feed the pages whose template chain includes them,
+    and notebook templates or pipeline sources feed every notebook page.
+    CSS/JS feed the assets built from them and, when fingerprinted, every
+    page linking to them.
+    """
+    graph = DependencyGraph()
+    notebook_keys = []
+
+    for nb_path, nb_file, settings in posts:
+        key = f'notebook:{nb_file}'
+        notebook_keys.append(key)
+        graph.add(nb_file, key, f'card:{nb_file}', LISTING_KEY, f'page:{FEED_PAGE}', 'search:index')
+        graph.add(hero_image_path(nb_path, settings), f'card:{nb_file}', LISTING_KEY)
+        entry = manifest.entries.get(key)
+        for dep in (entry['deps'] if entry else ()):
+            graph.add(dep, key)
+
+    for root, _, files in os.walk(NB_TEMPLATES_DIR):
+        for filename in files:
+            graph.add(Path(root) / filename, *notebook_keys)
+    for source in PIPELINE_SOURCES:
+        graph.add(source, *notebook_keys)
+
+    for page, template in SITE_PAGES.items():
+        for name in template_closure(env, template):
+            graph.add(TEMPLATES_DIR / name, f'page:{page}')
+    for template in set(LISTING_TEMPLATES.values()):
+        for name in template_closure(env, template):
+            graph.add(TEMPLATES_DIR / name, LISTING_KEY)
+
+    for root, _, files in os.walk(RESOURCES_DIR):
+        for filename in files:
+            if resource_destination(filename) is not None:
+                src_path = Path(root) / filename
+                graph.add(src_path, f'resource:{src_path}')
+
+    page_keys = notebook_keys + [f'page:{page}' for page in SITE_PAGES] + [LISTING_KEY] if fingerprint else []
+    static_keys = []
+    for logical, sources in static_sources().items():
+        static_keys.append(f'static:{logical}')
+        for source in sources:
+            graph.add(RESOURCES_DIR / source, f'static:{logical}', *page_keys)
+    graph.add(STATIC_ASSETS_SOURCE, *static_keys, *page_keys)
+
+    return graph
+
+
+notebook_index = None
+
+
+def get_notebook_index():
+    """The POST_SETTINGS index, loaded once per process and kept warm after that."""
+    global notebook_index
+    if notebook_index is None:
+        notebook_index = NotebookIndex().load()
+    return notebook_index
 
 
-def run_build(files_to_build=None):
-    print(files_to_build)
+def run_build(files_to_build=None, cfg=None):
+    """
+    Build the site and return the site-relative paths it wrote.
 
+    With ``cfg.trace`` set, every stage of this build is traced and the
+    Chrome trace is written to that path once the build is done.
+    """
+    trace_path = getattr(cfg, 'trace', None)
+    if not trace_path:
+        return build_site(files_to_build, cfg)
+    # Long-lived processes (--watch, the daemon) only trace this one build
+    tracer.enable()
+    try:
+        with span('build', changed=len(files_to_build or [])):
+            written = build_site(files_to_build, cfg)
+        tracer.save(trace_path)
+    finally:
+        tracer.disable()
+    return written
+
+
+def build_site(files_to_build=None, cfg=None):
+    started = time.perf_counter()
+    report = OutputReport()
+
+    # Fingerprinting is for deploys; --watch keeps stable names for CSS hot-swap
+    fingerprint = getattr(cfg, 'fingerprint', None)
+    if fingerprint is None:
+        fingerprint = not getattr(cfg, 'watch', False)
+
+    # A forced build starts from an empty manifest, so every step is stale
+    manifest = BuildManifest()
+    if not getattr(cfg, 'force', False):
+        manifest.load()
+    asset_store = AssetStore()
+    responsive = ResponsiveImages(asset_store)
 
     if not OUTPUT_DIR.exists():
         OUTPUT_DIR.mkdir(parents=True)
@@ -131,156 +561,249 @@ def run_build(files_to_build=None):
     if not OUTPUT_SCRIPTS_DIR.exists():
         OUTPUT_SCRIPTS_DIR.mkdir(parents=True)
 
+    with span('scan notebooks', 'io'):
+        nb_sources = search_notebooks(NOTEBOOK_DIR)
+
+        # POST_SETTINGS come from the metadata index, not from converting notebooks
+        nb_index = get_notebook_index()
+        posts = []
+        for nb_path, nb_files in nb_sources.items():
+            for nb_file in nb_files:
+                settings = nb_index.get(nb_file)
+                if not isinstance(settings, dict):
+                    print(f"ERROR: {nb_file} doesn't have valid POST_SETTINGS dict")
+                    continue
+                posts.append((nb_path, nb_file, settings))
+
+    # With a list of changed files, only rebuild what depends on them
+    targets = None
+    if files_to_build:
+        targets = build_dependency_graph(manifest, posts, fingerprint).targets_for(files_to_build)
+        if targets is None:
+            print("Changes outside the dependency graph, running a full build")
+        else:
+            print(f"Rebuilding {len(targets)} target(s): {', '.join(sorted(targets))}")
+
+    copied = 0
     for root, _, files in os.walk(RESOURCES_DIR):
         for filename  in files:
             src_path = Path(root) / filename
-            if filename.endswith(".css"): 
-                dest_path = os.path.join(OUTPUT_STYLES_DIR, filename)
-                shutil.copy2(src_path, dest_path) 
-            elif filename.endswith(".js"): 
-                dest_path = os.path.join(OUTPUT_SCRIPTS_DIR, filename)
-                shutil.copy2(src_path, dest_path) 
-            elif filename.endswith(( ".svg", ".png", ".jpg" )) :
-                dest_path = os.path.join(OUTPUT_IMG_DIR, filename)
-                shutil.copy2(src_path, dest_path) 
-
-    
-    nb_sources = search_notebooks(NOTEBOOK_DIR)
-
-    nb_page_settings = []
-    for nb_path, nb_file in nb_sources.items():
-        for nb_file in nb_file:
-            _, settings = generate_notebook_page(nb_file)
-
-            img_id = str(uuid.uuid4())
-            src_path = os.path.join(NOTEBOOK_DIR,nb_path, Path(settings['image']))
-            dest_path = os.path.join(OUTPUT_IMG_DIR, img_id)
-            shutil.copy2(src_path, dest_path) 
-            settings['image'] = f'static/img/{img_id}'
-            nb_page_settings.append(settings)
-
-    # Generate homepage and other pages
-    generate_website(nb_sources, nb_page_settings)
-
-def get_file_hashes(directory='.', extensions=None):
-    """Get hash of all files in directory with specified extensions"""
-    file_hashes = {}
-    for root, _, files in os.walk(directory):
-        # Skip ignored directories
-        if any(ignored_dir in root for ignored_dir in IGNORED_DIRECTORIES):
-            continue
-            
-        for file in files:
-            # Skip hidden files
-            if file.startswith('.'):
+            dest_path = resource_destination(filename)
+            if dest_path is None:
                 continue
-                
-            # Filter by extension if specified
-            if extensions and not any(file.endswith(ext) for ext in extensions):
+
+            key = f'resource:{src_path}'
+            if not wanted(targets, key):
                 continue
-                
-            filepath = os.path.join(root, file)
-            try:
-                with open(filepath, 'rb') as f:
-                    file_hash = hashlib.md5(f.read()).hexdigest()
-                    file_hashes[filepath] = file_hash
-            except (IOError, PermissionError):
+            inputs = {'source': manifest.file_digest(src_path)}
+            if manifest.is_fresh(key, inputs):
                 continue
-    return file_hashes
+            with span('copy resource', 'assets', path=str(src_path)):
+                copied += report.copy_file(src_path, dest_path)
+            manifest.record(key, inputs, [dest_path])
+
+    with span('publish static assets', 'assets'):
+        env.static_manifest = publish_static_assets(manifest, report, targets, fingerprint)
+
+    # Anything that changes how notebooks are rendered invalidates every page
+    execute = getattr(cfg, 'execute', False)
+    output_budget = getattr(cfg, 'output_budget', DEFAULT_OUTPUT_BUDGET // 1024) * 1024
+    prerender_math = getattr(cfg, 'prerender_math', False)
+    figure_width = getattr(cfg, 'figure_width', FIGURE_MAX_WIDTH)
+    pixel_ratio = getattr(cfg, 'pixel_ratio', FIGURE_PIXEL_RATIO)
+    shared_inputs = {
+        'execute': execute,
+        'output_budget': output_budget,
+        'prerender_math': prerender_math,
+        'figures': [figure_width, pixel_ratio],
+        'templates': manifest.dir_digest(NB_TEMPLATES_DIR),
+        'static': hash_json(env.static_manifest),
+        'pipeline': hash_json([pipeline_config()] + [manifest.file_digest(p) for p in PIPELINE_SOURCES]),
+    }
 
-async def watch_for_changes():
+    # Work out which pages are stale before converting anything. Notebooks
+    # outside the targets are trusted and left alone.
+    stale_pages = []
+    for nb_path, nb_file, settings in posts:
+        key = f'notebook:{nb_file}'
+        if not wanted(targets, key) and key in manifest.entries:
+            manifest.touched.add(key)
+            continue
+        inputs = dict(shared_inputs, source=manifest.file_digest(nb_file))
+        if not manifest.is_fresh(key, inputs):
+            stale_pages.append((key, inputs, nb_file))
+
+    with span('convert notebooks', notebooks=len(stale_pages)):
+        results = convert_notebooks(
+            [nb_file for _, _, nb_file in stale_pages], resolve_jobs(getattr(cfg, 'jobs', 1)),
+            execute, getattr(cfg, 'execute_timeout', DEFAULT_EXECUTE_TIMEOUT), output_budget, prerender_math,
+            figure_width, pixel_ratio,
+        )
+    for (key, inputs, nb_file), result in zip(stale_pages, results):
+        tracer.extend(result['trace_events'])
+        if result['output_path'] is None:
+            continue
+        report.record(result['output_path'], result['output_changed'])
+        print_figure_report(result['output_path'], result['figure_report'])
+        if result['execution_failed']:
+            # The page shows the saved outputs and still owns its assets, but
+            # inputs no build computes keep it stale, so the next one runs it again
+            inputs = dict(inputs, execution_failed=True)
+        manifest.record(
+            key, inputs,
+            outputs=[result['output_path']] + result['asset_outputs'],
+            deps=result['asset_sources'],
+            data={'search': result['search_postings']},
+        )
+    converted = len(stale_pages)
+
+    with span('build cards'):
+        nb_page_settings = build_cards(manifest, asset_store, responsive, posts, targets)
+
+    with span('build search index'):
+        build_search_index(manifest, report, posts, nb_page_settings, targets)
+
+    # Generate the listings, the feed and other pages
+    with span('generate site pages'):
+        commit_time = functools.partial(nb_index.commit_time, head=git_head())
+        generate_website(PostIndex(posts, nb_page_settings, commit_time), manifest, targets, report)
+    nb_index.save(keep=[nb_file for nb_files in nb_sources.values() for nb_file in nb_files])
+
+    # Only a full build has looked at every entry, so only it may prune
+    # entries; outputs a re-recorded entry dropped can go in any build.
+    # Pruning comes first so removed pages aren't compressed again.
+    precompress = getattr(cfg, 'precompress', False)
+    keep = ('compress:',) if precompress else ()
+    prune_orphans(manifest, manifest.prune(keep) if targets is None else {}, report)
+
+    if precompress:
+        with span('precompress outputs', 'io'):
+            compressed = precompress_outputs(manifest, report)
+        print(f"🗜️ Compressed {compressed} output(s)")
+        # Compress entries of outputs that are gone now weren't looked at
+        if targets is None:
+            prune_orphans(manifest, manifest.prune(), report)
+
+    # Content-addressed images and files nobody references any more
+    referenced = [output for entry in manifest.entries.values() for output in entry['outputs']]
+    with span('collect garbage', 'assets'):
+        removed = sum(store.gc(referenced) for store in (
+            asset_store,
+            AssetStore(OUTPUT_FILES_DIR, 'static/files'),
+            AssetStore(OUTPUT_FRAGMENTS_DIR, 'static/fragments'),
+        ))
+        # Encodings behind those assets, found by the hash they publish under
+        cached = sum(gc_cache(cache_dir, asset_store, referenced, manifest)
+                     for cache_dir in (DERIVATIVE_CACHE_DIR, FIGURE_CACHE_DIR))
+    # After the garbage collection, which caches the digests of the encodings
+    manifest.save()
+    if removed:
+        print(f"🧹 Removed {removed} unreferenced asset(s)")
+    if cached:
+        print(f"🧹 Removed {cached} unused cached image encoding(s)")
+
+    elapsed = (time.perf_counter() - started) * 1000
+    print(f"Build finished in {elapsed:.0f} ms: {converted} notebook(s) converted, "
+          f"{copied} resource(s) copied, outputs: {report.summary()}")
+
+    # Site-relative paths of everything this build changed, for live reload
+    changed = (set(manifest.written) - set(report.unchanged)) | set(report.deleted)
+    return sorted({
+        Path(os.path.relpath(path, OUTPUT_DIR)).as_posix() for path in changed
+    })
+
+async def watch_for_changes(cfg=None):
     """Watch for file changes and run build.py when detected"""
-    # Initial build
+    watcher = create_watcher('.', EXTENSIONS_TO_WATCH, IGNORED_DIRECTORIES)
+
+    # Builds run one at a time off the event loop, so the watcher keeps
+    # collecting events and the sockets stay responsive while they run
+    loop = asyncio.get_running_loop()
+    build_executor = ThreadPoolExecutor(max_workers=1)
     
     print(f"🔍 Watching for changes to files with extensions: {', '.join(EXTENSIONS_TO_WATCH)}")
-    print(f"⏱️ Checking every {WATCH_INTERVAL} second(s)")
+    print(f"⏱️ Using the {type(watcher).__name__} backend")
     print("📝 Press Ctrl+C to stop")
     
-    # Get initial file hashes
-    last_file_hashes = get_file_hashes(extensions=EXTENSIONS_TO_WATCH)
-
-   
-    
     try:
-        while True:
-            time.sleep(WATCH_INTERVAL)
-            current_file_hashes = get_file_hashes(extensions=EXTENSIONS_TO_WATCH)
+        async for changed_files in watcher.changes():
+            changed_files = sorted(changed_files)
+            
+            # Print changed files (limit to 5 to avoid clutter)
+            print(f"🔄 Changes detected in {len(changed_files)} file(s):")
+            for file in changed_files[:5]:
+                deleted = '' if os.path.exists(file) else ' (deleted)'
+                print(f"  - {file}{deleted}")
+            if len(changed_files) > 5:
+                print(f"  - ...and {len(changed_files) - 5} more")
             
-            # Check for changes
-            if current_file_hashes != last_file_hashes:
-                # Find changed files
-                changed_files = []
-                for file, hash_value in current_file_hashes.items():
-                    if file not in last_file_hashes or last_file_hashes[file] != hash_value:
-                        changed_files.append(file)
-                
-                for file in last_file_hashes:
-                    if file not in current_file_hashes:
-                        changed_files.append(f"{file} (deleted)")
-                
-                # Check if any special directories were modified
-                special_dirs_changed = []
-                # for file in changed_files:
-                #     for special_dir in SPECIAL_WATCH_DIRECTORIES:
-                #         if file.startswith(special_dir):
-                #             if special_dir not in special_dirs_changed:
-                #                 special_dirs_changed.append(special_dir)
-                
-                # Print changed files (limit to 5 to avoid clutter)
-                if changed_files:
-                    print(f"🔄 Changes detected in {len(changed_files)} file(s):")
-                    for file in changed_files[:5]:
-                        print(f"  - {file}")
-                    if len(changed_files) > 5:
-                        print(f"  - ...and {len(changed_files) - 5} more")
-                    
-                    if special_dirs_changed:
-                        print(f"🔔 Special directories changed: {', '.join(special_dirs_changed)}")
-                    
-                    # Run build with configuration
-                    run_build(special_dirs_changed)
-                    
-                # Update hashes
-                last_file_hashes = current_file_hashes
-                await notify_clients()
-
-    except KeyboardInterrupt:
+            # Run build with configuration
+            try:
+                written = await loop.run_in_executor(build_executor, run_build, changed_files, cfg)
+            except Exception as e:
+                print(f"❌ Build failed: {e}")
+                continue
+            if written:
+                await notify_clients(written)
+
+    except asyncio.CancelledError:
         print("\n👋 File watcher stopped")
+    finally:
+        build_executor.shutdown(wait=False)
 
-clients = set()  # Store connected WebSocket clients
-async def websocket_handler(websocket, path):
-    """ Handle WebSocket connections """
-    print("Client connected")
-    clients.add(websocket)
+async def start_watcher(cfg=None):
+    """ Start the file watcher, HTTP server and WebSocket server on one event loop """
+    http_server = await start_http_server(getattr(cfg, 'port', HTTP_PORT))
+    ws_server = await start_websocket_server()
     try:
-        async for message in websocket:
-            pass  # Keep connection open
+        await watch_for_changes(cfg)
     finally:
-        clients.remove(websocket)
-        print("Client disconnected")
+        http_server.close()
+        ws_server.close()
 
-async def notify_clients(file_types=None):
-    """ Notify all connected clients to reload specific file types """
-
-    print(clients)
-    for client in clients:
-        client.send("reload")
+    
 
-async def start_watcher():
-    """ Start the file watcher and WebSocket server properly """
-    asyncio.create_task(watch_for_changes())
+def print_startup_profile():
+    """Report one-off startup costs measured in this process (not in --jobs workers)."""
+    print("⏱️ Startup profile:")
+    for label, seconds in sorted(STARTUP_TIMINGS.items(), key=lambda item: -item[1]):
+        print(f"  {seconds * 1000:8.1f} ms  {label}")
+    print(f"  {sum(STARTUP_TIMINGS.values()) * 1000:8.1f} ms  total")
 
-    
 
 def main(cfg):
-    run_build(cfg)
+    run_build(cfg=cfg)
+    if cfg.startup_profile:
+        print_startup_profile()
     if cfg.watch:
-        asyncio.run(start_watcher())
+        try:
+            asyncio.run(start_watcher(cfg))
+        except KeyboardInterrupt:
+            print("\n👋 File watcher stopped")
         
 import argparse
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--watch', action=argparse.BooleanOptionalAction, help='watch for changes in files')
+    parser.add_argument('--force', action='store_true', help='ignore the build manifest and rebuild everything')
+    parser.add_argument('--port', type=int, default=HTTP_PORT, help='port of the --watch dev server')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='convert notebooks in N processes (0 = one per CPU core)')
+    parser.add_argument('--fingerprint', action=argparse.BooleanOptionalAction, default=None,
+                        help='minify CSS/JS and publish it under content-hashed names (default: on, off with --watch)')
+    parser.add_argument('--precompress', action='store_true', help='write .gz/.br siblings of compressible outputs')
+    parser.add_argument('--execute', action='store_true', help='run notebooks before rendering them (outputs are cached per cell)')
+    parser.add_argument('--execute-timeout', type=int, default=DEFAULT_EXECUTE_TIMEOUT, metavar='SECONDS',
+                        help='time limit for executing one notebook')
+    parser.add_argument('--output-budget', type=int, default=DEFAULT_OUTPUT_BUDGET // 1024, metavar='KB',
+                        help='lazy-load notebook outputs bigger than this (0 keeps every output inline)')
+    parser.add_argument('--prerender-math', action='store_true',
+                        help='render markdown math to SVG at build time, MathJax only where that fails')
+    parser.add_argument('--figure-width', type=int, default=FIGURE_MAX_WIDTH, metavar='PX',
+                        help='widest CSS size output figures are shown at')
+    parser.add_argument('--pixel-ratio', type=float, default=FIGURE_PIXEL_RATIO,
+                        help='device pixels per CSS pixel output figures keep')
+    parser.add_argument('--trace', metavar='OUT.json', help='write a Chrome/Perfetto trace of every build stage')
+    parser.add_argument('--startup-profile', action='store_true', help='report time spent on imports and template compilation')
     parser.set_defaults()
     cfg = parser.parse_args()
     main(cfg)
\ No newline at end of file
@@ -0,0 +1,61 @@
+import os
+import gzip
+
+from output import write_bytes
+from core import *
+
+COMPRESSIBLE_EXTENSIONS = ('.html', '.css', '.js', '.svg', '.json', '.xml', '.txt')
+MIN_COMPRESS_SIZE = 1024  # below this the headers eat the saving
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+COMPRESSED_FORMATS = ('gz', 'br')
+
+
+def load_brotli():
+    """brotli is optional: without it only .gz files are written."""
+    try:
+        import brotli
+    except ImportError:
+        try:
+            import brotlicffi as brotli
+        except ImportError:
+            return None
+    return brotli
+
+
+def compression_formats():
+    return list(COMPRESSED_FORMATS) if load_brotli() is not None else ['gz']
+
+
+def compressed_siblings(path):
+    """Every ``.gz`` / ``.br`` file precompression may have written for ``path``."""
+    return [f"{path}.{fmt}" for fmt in COMPRESSED_FORMATS]
+
+
+def compress_bytes(data, fmt):
+    if fmt == 'gz':
+        # mtime=0 keeps the output identical for identical input
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    return load_brotli().compress(data, quality=BROTLI_QUALITY)
+
+
+def compressible_outputs(root=OUTPUT_DIR, min_size=MIN_COMPRESS_SIZE):
+    """Published text files worth compressing; hidden files and caches are skipped."""
+    for directory, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for filename in sorted(files):
+            if filename.startswith('.') or not filename.endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+            path = os.path.join(directory, filename)
+            if os.path.getsize(path) >= min_size:
+                yield path
+
+
+def compress_output(path, formats):
+    """Write ``path.gz`` / ``path.br``, returning ``(sibling, changed)`` pairs."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    return [
+        (f"{path}.{fmt}", write_bytes(f"{path}.{fmt}", compress_bytes(data, fmt)))
+        for fmt in formats
+    ]
@@ -1,19 +1,56 @@
+import time
 import jinja2
+from contextlib import contextmanager
 from pathlib import Path
 
 OUTPUT_DIR = Path('./build')  # Directory to store the generated blog posts
+CACHE_DIR = Path('./.cache')  # Build caches and manifests, kept out of the published OUTPUT_DIR
 NOTEBOOK_DIR = Path('./notebooks')  # The root directory to search for notebooks
 RESOURCES_DIR = Path('./resources')  # Path to the custom nbconvert template
 TEMPLATES_DIR= Path('./resources/templates')  # Path to the CSS file
 STYLE_DIR = Path('./resources/styles')  # Path to the CSS file
 SCRIPTS_DIR = Path('./resources/scripts')  # Path to the CSS file
 OUTPUT_IMG_DIR = OUTPUT_DIR / 'static/img'
+OUTPUT_FILES_DIR = OUTPUT_DIR / 'static/files'
+OUTPUT_FRAGMENTS_DIR = OUTPUT_DIR / 'static/fragments'
+JINJA_CACHE_DIR = CACHE_DIR / 'jinja'
+DEFAULT_OUTPUT_BUDGET = 64 * 1024  # Bytes of HTML a notebook output may put inline before it is lazy-loaded
+SITE_URL = ''  # Absolute URL the site is served from, e.g. https://example.com/ (used by the Atom feed)
+
+# Seconds spent on one-off startup work, reported by --startup-profile
+STARTUP_TIMINGS = {}
+
+
+@contextmanager
+def startup_timer(label):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP_TIMINGS[label] = STARTUP_TIMINGS.get(label, 0) + time.perf_counter() - started
+
+
+def bytecode_cache():
+    """
+    Jinja bytecode cache shared by the site and nbconvert environments.
+
+    Compiled templates are kept across processes and only recompiled when
+    their source changes.
+    """
+    JINJA_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    return jinja2.FileSystemBytecodeCache(str(JINJA_CACHE_DIR))
+
+
+def page_prefix(category):
+    """Relative path from a page in ``category`` back to the site root."""
+    return '../' * len(Path(category or '').parts)
 
 # Custom Jinja2 environment with path utilities
 class PathAwareEnvironment(jinja2.Environment):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.current_page_depth = 0
+        self.static_manifest = {}  # logical name -> published (fingerprinted) path
         
     def set_page_depth(self, depth):
         self.current_page_depth = depth
@@ -23,10 +60,15 @@ class PathAwareEnvironment(jinja2.Environment):
         template.globals['url_static'] = self.url_static
         template.globals['url_page'] = self.url_page
         return template
+
+    def compile(self, *args, **kwargs):
+        # Only reached on a bytecode cache miss
+        with startup_timer('compile site templates'):
+            return super().compile(*args, **kwargs)
         
     def url_static(self, path):
         prefix = '../' * self.current_page_depth
-        return f"{prefix}{path}"
+        return f"{prefix}{self.static_manifest.get(path, path)}"
         
     def url_page(self, path):
         prefix = '../' * self.current_page_depth
@@ -35,7 +77,8 @@ class PathAwareEnvironment(jinja2.Environment):
 # Set up Jinja2 environment
 env = PathAwareEnvironment(
     loader=jinja2.FileSystemLoader(TEMPLATES_DIR),
-    autoescape=jinja2.select_autoescape(['html', 'xml'])
+    autoescape=jinja2.select_autoescape(['html', 'xml']),
+    bytecode_cache=bytecode_cache()
 )
 
 
@@ -0,0 +1,211 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import socket
+import asyncio
+import traceback
+
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from execution import DEFAULT_EXECUTE_TIMEOUT
+from images import FIGURE_MAX_WIDTH, FIGURE_PIXEL_RATIO
+from core import *
+
+SOCKET_PATH = CACHE_DIR / 'build.sock'
+
+
+def daemon_supported():
+    return hasattr(socket, 'AF_UNIX') and hasattr(asyncio, 'start_unix_server')
+
+
+def source_digest():
+    """
+    Hash of the build's Python sources (PIPELINE_SOURCES among them). A
+    running daemon has already imported them, so edits only take effect
+    after a restart.
+    """
+    digest = hashlib.sha256()
+    for path in sorted(Path(__file__).parent.glob('*.py')):
+        digest.update(path.name.encode('utf-8'))
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def build_config(request):
+    """Options of a build request, in the shape ``run_build`` reads."""
+    return SimpleNamespace(
+        force=bool(request.get('force', False)),
+        jobs=int(request.get('jobs', 1)),
+        trace=request.get('trace'),
+        precompress=bool(request.get('precompress', False)),
+        execute=bool(request.get('execute', False)),
+        execute_timeout=int(request.get('execute_timeout', DEFAULT_EXECUTE_TIMEOUT)),
+        output_budget=int(request.get('output_budget', DEFAULT_OUTPUT_BUDGET // 1024)),
+        prerender_math=bool(request.get('prerender_math', False)),
+        figure_width=int(request.get('figure_width', FIGURE_MAX_WIDTH)),
+        pixel_ratio=float(request.get('pixel_ratio', FIGURE_PIXEL_RATIO)),
+    )
+
+
+def execute_build(request):
+    """
+    Run one build in this process and describe the outcome.
+
+    Returns a JSON-serialisable dict with the pages written, the wall time
+    and, if the build raised, the error and its traceback.
+    """
+    from build import run_build
+
+    started = time.perf_counter()
+    result = {'ok': True, 'written': [], 'error': None}
+    try:
+        result['written'] = run_build(request.get('files'), build_config(request))
+    except Exception as e:
+        result.update(ok=False, error=f"{type(e).__name__}: {e}", traceback=traceback.format_exc())
+    result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+
+class BuildDaemon:
+    """
+    Long-lived build process listening on a Unix socket.
+
+    The exporter, both Jinja environments and the notebook index stay warm in
+    memory between builds, so a request only pays for the work that is stale.
+    Each request is one line of JSON (``{"files": [...], "force": false}``)
+    and gets one line of JSON back. Builds run one at a time on a single
+    worker thread.
+
+    ``get_exporter`` recreates the exporter after a template edit. An edit
+    to the Python sources needs fresh code, so the daemon answers that
+    request with ``'restarting'`` (the client builds in-process) and
+    re-executes itself.
+    """
+
+    def __init__(self, path=SOCKET_PATH):
+        self.path = Path(path)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.server = None
+        self.sources = source_digest()
+        self.restart = False
+
+    async def handle(self, reader, writer):
+        try:
+            line = await reader.readline()
+            if not line:
+                return  # a ping
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = {'ok': False, 'error': 'malformed request'}
+            else:
+                if request.get('command') == 'stop':
+                    response = {'ok': True}
+                    self.server.close()
+                elif source_digest() != self.sources:
+                    response = {'ok': False, 'restarting': True, 'error': 'build sources changed, daemon restarting'}
+                    self.restart = True
+                    self.server.close()
+                else:
+                    loop = asyncio.get_running_loop()
+                    response = await loop.run_in_executor(self.executor, execute_build, request)
+            writer.write(json.dumps(response).encode('utf-8') + b'\n')
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def remove_stale_socket(self):
+        """Remove a socket file left behind by a daemon that didn't shut down cleanly."""
+        if not self.path.exists():
+            return
+        if ping(self.path):
+            raise RuntimeError(f"a build daemon is already listening on {self.path}")
+        self.path.unlink()
+
+    async def serve(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.remove_stale_socket()
+
+        # Warm everything up front so the first request is as fast as the rest
+        from build import get_notebook_index
+        from notebooks import get_exporter
+        get_exporter()
+        get_notebook_index()
+
+        self.server = await asyncio.start_unix_server(self.handle, path=str(self.path))
+        print(f"🔥 Build daemon listening on {self.path}")
+        try:
+            async with self.server:
+                await self.server.wait_closed()
+        finally:
+            if self.path.exists():
+                self.path.unlink()
+            self.executor.shutdown()
+            if self.restart:
+                print("🔁 Build sources changed, restarting the build daemon")
+                os.execv(sys.executable, [sys.executable] + sys.argv)
+            print("👋 Build daemon stopped")
+
+
+def send_request(request, path=SOCKET_PATH, timeout=None):
+    """Send one request to a running daemon and return its response."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(str(path))
+        client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        with client.makefile('rb') as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError('build daemon closed the connection')
+    return json.loads(line)
+
+
+def ping(path=SOCKET_PATH):
+    """True if a daemon accepts connections on ``path``."""
+    if not daemon_supported() or not os.path.exists(path):
+        return False
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(str(path))
+        except OSError:
+            return False
+    return True
+
+
+def request_build(files=None, force=False, jobs=1, trace=None, precompress=False, execute=False,
+                  execute_timeout=DEFAULT_EXECUTE_TIMEOUT, output_budget=DEFAULT_OUTPUT_BUDGET // 1024,
+                  prerender_math=False, figure_width=FIGURE_MAX_WIDTH, pixel_ratio=FIGURE_PIXEL_RATIO,
+                  path=SOCKET_PATH):
+    """
+    Build through the daemon if one is running, in this process otherwise.
+
+    Either way the result has the shape of ``execute_build``'s, plus
+    ``'daemon'`` telling which path was taken.
+    """
+    request = {
+        'files': [str(f) for f in files] if files else None,
+        'force': force,
+        'jobs': jobs,
+        'trace': trace,
+        'precompress': precompress,
+        'execute': execute,
+        'execute_timeout': execute_timeout,
+        'output_budget': output_budget,
+        'prerender_math': prerender_math,
+        'figure_width': figure_width,
+        'pixel_ratio': pixel_ratio,
+    }
+    if ping(path):
+        try:
+            response = send_request(request, path)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Build daemon unavailable ({e}), building in-process")
+        else:
+            if not response.get('restarting'):
+                return dict(response, daemon=True)
+            print("🔁 Build daemon is restarting on changed sources, building in-process")
+    return dict(execute_build(request), daemon=False)
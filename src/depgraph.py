@@ -0,0 +1,47 @@
+import os
+import jinja2.meta
+
+from collections import defaultdict
+
+
+def normalize_path(path):
+    """Watcher, manifest and os.walk spell paths differently; compare them normalized."""
+    return os.path.normpath(str(path))
+
+
+class DependencyGraph:
+    """
+    Maps each input file to the build targets (manifest keys) it affects.
+
+    ``targets_for`` answers "what do I have to rebuild for these changed
+    files?". A file the graph knows nothing about (a build script, a new
+    directory ...) makes it return None, which means a full build.
+    """
+
+    def __init__(self):
+        self.edges = defaultdict(set)
+
+    def add(self, source, *targets):
+        self.edges[normalize_path(source)].update(targets)
+
+    def targets_for(self, paths):
+        targets = set()
+        for path in paths:
+            path = normalize_path(path)
+            if path not in self.edges:
+                return None
+            targets |= self.edges[path]
+        return targets
+
+
+def template_closure(env, name, seen=None):
+    """All templates ``name`` extends, includes or imports, including itself."""
+    seen = set() if seen is None else seen
+    if name in seen:
+        return seen
+    seen.add(name)
+    source, _, _ = env.loader.get_source(env, name)
+    for referenced in jinja2.meta.find_referenced_templates(env.parse(source)):
+        if referenced:
+            template_closure(env, referenced, seen)
+    return seen
@@ -0,0 +1,82 @@
+import json
+import hashlib
+
+from pathlib import Path
+from output import write_text
+from core import *
+
+EXECUTION_CACHE_DIR = CACHE_DIR / 'execution'
+DEFAULT_EXECUTE_TIMEOUT = 600  # seconds per notebook
+
+
+def kernel_spec(nb):
+    return dict(nb.get('metadata', {}).get('kernelspec', {}))
+
+
+def cell_source(cell):
+    source = cell.get('source', '')
+    return source if isinstance(source, str) else ''.join(source)
+
+
+def cell_keys(nb):
+    """
+    Cache key of every code cell (None for other cells).
+
+    A key hashes the kernel spec, the cell's source and the source of every
+    code cell before it, so editing a cell invalidates it and everything
+    after it. Markdown cells don't take part: editing prose never
+    invalidates an output.
+    """
+    chain = hashlib.sha256(json.dumps(kernel_spec(nb), sort_keys=True).encode('utf-8'))
+    keys = []
+    for cell in nb.cells:
+        if cell.cell_type != 'code':
+            keys.append(None)
+            continue
+        source = cell_source(cell).encode('utf-8')
+        chain.update(len(source).to_bytes(8, 'little') + source)
+        keys.append(chain.copy().hexdigest())
+    return keys
+
+
+class ExecutionCache:
+    """
+    Outputs of a notebook's code cells from its last execution, keyed by
+    ``cell_keys``. One JSON file per notebook under EXECUTION_CACHE_DIR.
+    """
+
+    def __init__(self, nb_file, root=EXECUTION_CACHE_DIR):
+        name = hashlib.sha256(Path(nb_file).as_posix().encode('utf-8')).hexdigest()[:20]
+        self.path = Path(root) / f"{name}.json"
+        self.cells = {}
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.cells = json.load(f)
+        except (IOError, ValueError):
+            self.cells = {}
+        return self
+
+    def save(self, keep):
+        """Write the cache, keeping only the cells of the current notebook."""
+        keep = set(keep)
+        self.cells = {key: value for key, value in self.cells.items() if key in keep}
+        write_text(self.path, json.dumps(self.cells, sort_keys=True))
+
+    def first_miss(self, keys):
+        """Index of the first code cell without cached outputs, or None if all are cached."""
+        return next((index for index, key in enumerate(keys) if key is not None and key not in self.cells), None)
+
+    def restore(self, nb, keys):
+        """Put cached outputs into every code cell that has them."""
+        from nbformat import from_dict
+        for cell, key in zip(nb.cells, keys):
+            if key in self.cells:
+                cell.outputs = [from_dict(output) for output in self.cells[key]['outputs']]
+                cell.execution_count = self.cells[key]['execution_count']
+
+    def store(self, nb, keys):
+        for cell, key in zip(nb.cells, keys):
+            if key is not None:
+                self.cells[key] = {'outputs': cell.outputs, 'execution_count': cell.execution_count}
@@ -0,0 +1,55 @@
+import re
+import gzip
+import json
+import hashlib
+
+from pathlib import Path
+from output import write_bytes
+from core import *
+
+FRAGMENT_CACHE_DIR = CACHE_DIR / 'fragments'
+
+# post.html wraps every freshly rendered cell in these markers
+FRAGMENT_MARKER = re.compile(r'<!--fragment:(?P<key>[0-9a-f]+)-->(?P<html>.*?)<!--/fragment-->', re.DOTALL)
+
+
+def fragment_key(cell, version):
+    """Hash of everything in a cell the template reads, plus the pipeline ``version``."""
+    data = json.dumps(cell, sort_keys=True, default=str)
+    return hashlib.sha256(f"{version}\n{data}".encode('utf-8')).hexdigest()[:32]
+
+
+class FragmentCache:
+    """
+    Rendered HTML of a notebook's cells, keyed by ``fragment_key``.
+
+    Kept as one gzipped JSON file per notebook under FRAGMENT_CACHE_DIR and
+    pruned to the cells the notebook still has whenever it is saved.
+    """
+
+    def __init__(self, nb_file, root=FRAGMENT_CACHE_DIR):
+        name = hashlib.sha256(Path(nb_file).as_posix().encode('utf-8')).hexdigest()[:20]
+        self.path = Path(root) / f"{name}.json.gz"
+        self.fragments = {}
+
+    def load(self):
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                self.fragments = json.load(f)
+        except (IOError, ValueError, EOFError):
+            self.fragments = {}
+        return self
+
+    def extract(self, html):
+        """Store the fragments marked in a rendered page and return the page without the markers."""
+        def collect(match):
+            self.fragments[match.group('key')] = match.group('html')
+            return match.group('html')
+        return FRAGMENT_MARKER.sub(collect, html)
+
+    def save(self, keep):
+        keep = set(keep)
+        self.fragments = {key: value for key, value in self.fragments.items() if key in keep}
+        data = json.dumps(self.fragments, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        # mtime=0: an unchanged cache compresses to the same bytes and isn't rewritten
+        write_bytes(self.path, gzip.compress(data, mtime=0))
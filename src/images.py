@@ -0,0 +1,292 @@
+import io
+import os
+import html
+import json
+import hashlib
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from tracing import span
+from core import *
+
+RESPONSIVE_WIDTHS = (480, 960, 1920)
+RESPONSIVE_FORMATS = ('webp', 'fallback')
+WEBP_QUALITY = 80
+WEBP_METHOD = 4  # libwebp effort: 6 is ~2x slower for files only 5-7% smaller
+JPEG_QUALITY = 85
+DERIVATIVE_CACHE_DIR = CACHE_DIR / 'derivatives'
+FIGURE_CACHE_DIR = CACHE_DIR / 'figures'
+FIGURE_MAX_WIDTH = 800  # CSS px of the post column figures are shown in
+FIGURE_PIXEL_RATIO = 2  # device pixels per CSS px figures keep
+RESPONSIVE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+# `sizes` hints for the two places authored images are shown
+CARD_SIZES = '(max-width: 720px) 100vw, 400px'
+POST_SIZES = '(max-width: 900px) 100vw, 800px'
+
+
+def load_pillow():
+    """Pillow is optional: without it images are published at full size."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+
+def encode_derivative(src_path, width, fmt, cache_path):
+    """Resize ``src_path`` to ``width`` and encode it to ``cache_path``."""
+    Image = load_pillow()
+    with span('encode image variant', 'assets', path=str(src_path), width=width, format=fmt), \
+            Image.open(src_path) as image:
+        image.load()
+        if image.width > width:
+            height = round(image.height * width / image.width)
+            image = image.resize((width, height), Image.LANCZOS)
+
+        has_alpha = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        if fmt == 'webp':
+            image.save(tmp_path, 'WEBP', quality=WEBP_QUALITY, method=WEBP_METHOD)
+        elif has_alpha:
+            image.save(tmp_path, 'PNG', optimize=True)
+        else:
+            image.convert('RGB').save(tmp_path, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    os.replace(tmp_path, cache_path)
+
+
+def gc_cache(cache_dir, asset_store, keep, manifest):
+    """
+    Delete cached encodings (image derivatives, optimized figures) whose
+    published copy no output references any more, and the metadata of
+    removed figures. A cached file is published under its content hash,
+    so it is matched by ``asset_store.name_for`` against ``keep``; the
+    hashes come from ``manifest.file_digest``, one stat per file.
+    """
+    keep = {os.path.basename(str(path)) for path in keep}
+    if not os.path.isdir(cache_dir):
+        return 0
+    removed = []
+    for entry in os.scandir(cache_dir):
+        stem, ext = os.path.splitext(entry.name)
+        if not entry.is_file() or ext in ('.json', '.tmp'):
+            continue
+        if asset_store.name_for(manifest.file_digest(entry.path), ext) not in keep:
+            os.remove(entry.path)
+            manifest.files.pop(entry.path, None)
+            removed.append(stem)
+    for stem in removed:
+        meta_path = os.path.join(cache_dir, f"{stem}.json")
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+    return len(removed)
+
+
+class ResponsiveImages:
+    """
+    Generates resized WebP and JPEG/PNG variants of authored images.
+
+    Encoded derivatives are cached in ``.cache/derivatives`` under a key made
+    of the source hash and the encoding parameters, so an image is only
+    re-encoded when it or the settings change. Variants are then published
+    through the content-addressed ``AssetStore``. Encoding runs on a thread
+    pool; Pillow releases the GIL while resizing and encoding.
+    """
+
+    warned = False
+
+    def __init__(self, asset_store, widths=RESPONSIVE_WIDTHS, cache_dir=DERIVATIVE_CACHE_DIR, workers=None):
+        self.asset_store = asset_store
+        self.widths = tuple(widths)
+        self.cache_dir = Path(cache_dir)
+        self.workers = workers or os.cpu_count() or 1
+        self.enabled = load_pillow() is not None
+        if not self.enabled and not ResponsiveImages.warned:
+            ResponsiveImages.warned = True
+            print("⚠️ Pillow is not installed, images are published without responsive variants")
+
+    def config(self):
+        return {
+            'widths': self.widths,
+            'webp_quality': WEBP_QUALITY,
+            'webp_method': WEBP_METHOD,
+            'jpeg_quality': JPEG_QUALITY,
+            'enabled': self.enabled,
+        }
+
+    def _plan(self, src_path):
+        """Source size plus the (width, fmt, cache_path) derivatives it needs."""
+        Image = load_pillow()
+        with open(src_path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        with Image.open(src_path) as image:
+            size = image.size
+            has_alpha = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+
+        # Never upscale: widths past the source collapse onto the source width
+        widths = sorted({min(width, size[0]) for width in self.widths})
+        fallback_ext = '.png' if has_alpha else '.jpg'
+        params = hashlib.sha256(json.dumps(self.config(), sort_keys=True).encode()).hexdigest()[:8]
+
+        jobs = []
+        for width in widths:
+            for fmt in RESPONSIVE_FORMATS:
+                ext = '.webp' if fmt == 'webp' else fallback_ext
+                cache_path = self.cache_dir / f"{digest[:20]}-{params}-{width}{ext}"
+                jobs.append((width, fmt, cache_path))
+        return size, jobs
+
+    def process_many(self, src_paths):
+        """
+        Build the variants of several images in one parallel batch.
+
+        Returns ``{src_path: variants}`` where variants is None for images
+        that aren't responsive-capable (or when Pillow is missing).
+        """
+        results = {str(path): None for path in src_paths}
+        if not self.enabled:
+            return results
+
+        plans = {}
+        for path in results:
+            if path.lower().endswith(RESPONSIVE_EXTENSIONS) and os.path.isfile(path):
+                plans[path] = self._plan(path)
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        pending = [
+            (path, width, fmt, cache_path)
+            for path, (_, jobs) in plans.items()
+            for width, fmt, cache_path in jobs
+            if not cache_path.exists()
+        ]
+        if pending:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                list(pool.map(lambda job: encode_derivative(*job), pending))
+
+        for path, (size, jobs) in plans.items():
+            variants = {'width': size[0], 'height': size[1], 'webp': [], 'fallback': []}
+            for width, fmt, cache_path in jobs:
+                variants[fmt].append((width, self.asset_store.add_file(cache_path)))
+            results[path] = variants
+        return results
+
+    def process(self, src_path):
+        return self.process_many([src_path])[str(src_path)]
+
+    def outputs(self, variants):
+        """Published files of a variant set, for the build manifest."""
+        return [str(self.asset_store.path(name)) for fmt in RESPONSIVE_FORMATS for _, name in variants[fmt]]
+
+
+def srcset(asset_store, entries, prefix=''):
+    return ', '.join(f"{asset_store.url(name, prefix)} {width}w" for width, name in entries)
+
+
+def default_variant(asset_store, variants, prefix=''):
+    """The fallback variant closest to 960px, used as the plain ``src``."""
+    _, name = min(variants['fallback'], key=lambda entry: abs(entry[0] - 960))
+    return asset_store.url(name, prefix)
+
+
+def picture_html(asset_store, variants, alt, sizes, prefix='', title=None):
+    """``<picture>`` markup for a variant set, WebP first with a JPEG/PNG fallback."""
+    title_attr = f' title="{html.escape(title)}"' if title else ''
+    return (
+        f'<picture>'
+        f'<source type="image/webp" srcset="{srcset(asset_store, variants["webp"], prefix)}" sizes="{sizes}">'
+        f'<img src="{default_variant(asset_store, variants, prefix)}" '
+        f'srcset="{srcset(asset_store, variants["fallback"], prefix)}" sizes="{sizes}" '
+        f'width="{variants["width"]}" height="{variants["height"]}" '
+        f'alt="{html.escape(alt)}"{title_attr} loading="lazy" decoding="async">'
+        f'</picture>'
+    )
+
+
+def fit_width(size, max_width):
+    """``size`` scaled down (never up) to at most ``max_width`` wide."""
+    width, height = size
+    if width <= max_width:
+        return width, height
+    return max_width, max(1, round(height * max_width / width))
+
+
+class FigureOptimizer:
+    """
+    Shrinks the PNG and JPEG figures of notebook outputs.
+
+    A figure is downscaled to ``max_width * pixel_ratio`` pixels, then the
+    smallest of a losslessly optimized PNG (or re-encoded JPEG), a WebP and
+    the original is kept; it is shown at most ``max_width`` CSS px wide. SVG and anything Pillow can't read pass through.
+    Results are cached in ``.cache/figures`` by output hash and settings,
+    so a figure is only re-encoded when it or the settings change.
+    """
+
+    def __init__(self, cache_dir=FIGURE_CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.enabled = load_pillow() is not None
+
+    def _encode(self, data, ext, pixel_width):
+        """Candidate encodings ``[(data, ext)]`` of a figure, the original included, and its size."""
+        Image = load_pillow()
+        candidates = [(data, ext)]
+        with Image.open(io.BytesIO(data)) as image:
+            image.load()
+            size = image.size
+            if fit_width(size, pixel_width) != size:
+                image = image.resize(fit_width(size, pixel_width), Image.LANCZOS)
+
+            buffer = io.BytesIO()
+            if ext == '.png':
+                image.save(buffer, 'PNG', optimize=True)
+                candidates.append((buffer.getvalue(), '.png'))
+                # Plots are flat colours and sharp edges: lossless WebP keeps them exact
+                webp_options = {'lossless': True}
+            else:
+                image.convert('RGB').save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+                candidates.append((buffer.getvalue(), '.jpg'))
+                webp_options = {'quality': WEBP_QUALITY}
+            buffer = io.BytesIO()
+            image.save(buffer, 'WEBP', method=WEBP_METHOD, **webp_options)
+            candidates.append((buffer.getvalue(), '.webp'))
+        return candidates, size
+
+    def optimize(self, data, ext, max_width=FIGURE_MAX_WIDTH, pixel_ratio=FIGURE_PIXEL_RATIO):
+        """
+        Returns ``(data, ext, display_size)``; ``display_size`` is the figure's
+        size in CSS px (None if unknown).
+        """
+        if not self.enabled or ext not in ('.png', '.jpg'):
+            return data, ext, None
+
+        pixel_width = max(1, round(max_width * pixel_ratio))
+        params = json.dumps([pixel_width, max_width, WEBP_QUALITY, WEBP_METHOD, JPEG_QUALITY])
+        key = hashlib.sha256(data + params.encode('utf-8')).hexdigest()[:32]
+        meta_path = self.cache_dir / f"{key}.json"
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(self.cache_dir / meta['file'], 'rb') as f:
+                return f.read(), meta['ext'], tuple(meta['display_size'])
+        except (IOError, ValueError, KeyError):
+            pass
+
+        try:
+            with span('optimize figure', 'assets', bytes=len(data)):
+                candidates, size = self._encode(data, ext, pixel_width)
+        except Exception as e:
+            print(f"⚠️ Couldn't optimize a {ext} figure: {e}")
+            return data, ext, None
+        # A downscaled figure can still be bigger in bytes, the original wins then
+        best, best_ext = min(candidates, key=lambda candidate: len(candidate[0]))
+        display_size = fit_width(size, max_width)
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        file_name = f"{key}{best_ext}"
+        tmp_path = self.cache_dir / f"{file_name}.{os.getpid()}.tmp"
+        tmp_path.write_bytes(best)
+        os.replace(tmp_path, self.cache_dir / file_name)
+        meta = {'file': file_name, 'ext': best_ext, 'display_size': display_size}
+        tmp_path = self.cache_dir / f"{key}.json.{os.getpid()}.tmp"
+        tmp_path.write_text(json.dumps(meta), encoding='utf-8')
+        os.replace(tmp_path, meta_path)
+        return best, best_ext, display_size
@@ -0,0 +1,194 @@
+import os
+import re
+import uuid
+import hashlib
+import datetime
+
+from collections import defaultdict
+from pathlib import Path
+from nb_index import git_commit_time
+from core import *
+
+POSTS_PER_PAGE = 12
+FEED_LENGTH = 20  # newest posts in feed.xml
+FEED_PAGE = 'feed.xml'
+
+# Listing kind -> template it is rendered with
+LISTING_TEMPLATES = {
+    'home': 'homepage.html',
+    'category': 'category.html',
+    'tag': 'category.html',
+}
+FEED_TEMPLATE = 'feed.xml'
+
+
+def slugify(text):
+    """URL-safe name of a category or tag: ``Deep Learning`` -> ``deep-learning``."""
+    return re.sub(r'[^\w]+', '-', str(text).lower()).strip('-') or 'untitled'
+
+
+def unique_slugs(names, kind):
+    """
+    Slug of every name in ``names``. Names sharing a slug (``C++`` and ``C#``
+    are both ``c``) each get a short hash of the name appended, so neither
+    listing overwrites the other.
+    """
+    by_slug = defaultdict(list)
+    for name in sorted(names, key=str):
+        by_slug[slugify(name)].append(name)
+    slugs = {}
+    for slug, group in by_slug.items():
+        if len(group) == 1:
+            slugs[group[0]] = slug
+            continue
+        print(f"⚠️ The {kind}s {', '.join(repr(name) for name in group)} share the URL '{slug}', telling them apart by a suffix")
+        for name in group:
+            slugs[name] = f"{slug}-{hashlib.sha256(str(name).encode('utf-8')).hexdigest()[:6]}"
+    return slugs
+
+
+def paginate(items, per_page=POSTS_PER_PAGE):
+    """Split ``items`` into pages; an empty listing still has one (empty) page."""
+    return [items[i:i + per_page] for i in range(0, len(items), per_page)] or [[]]
+
+
+def page_path(base, number):
+    """Site-relative path of page ``number`` (1-based) of the listing at ``base``."""
+    name = 'index.html' if number == 1 else f'page/{number}.html'
+    return f'{base}/{name}' if base else name
+
+
+def relocate(url, prefix):
+    return url if not url or '://' in url else prefix + url
+
+
+def relocate_srcset(value, prefix):
+    return ', '.join(relocate(candidate, prefix) for candidate in value.split(', ')) if value else value
+
+
+def relocate_card(card, prefix, tag_slugs):
+    """A copy of a homepage card with its site-relative URLs made relative to a page ``prefix`` deep."""
+    card = dict(card, url=relocate(card['url'], prefix), image=relocate(card.get('image'), prefix))
+    for field in ('image_srcset', 'image_webp_srcset'):
+        if field in card:
+            card[field] = relocate_srcset(card[field], prefix)
+    card['tag_links'] = [(tag, f"{prefix}tag/{tag_slugs[tag]}/index.html") for tag in card.get('tags', [])]
+    return card
+
+
+def feed_timestamp(value):
+    """RFC 3339 timestamp for a ``date`` setting (``2024-05-01``) or an mtime."""
+    if isinstance(value, (int, float)):
+        moment = datetime.datetime.fromtimestamp(value, datetime.timezone.utc)
+    else:
+        moment = datetime.datetime.fromisoformat(str(value))
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.astimezone(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def post_date(settings, nb_file, commit_time=git_commit_time):
+    """
+    When a post was last updated: its ``date`` setting, else the last git
+    commit of the notebook (``commit_time``). Returns ``(value, source)``;
+    the file's mtime is only a last resort, it changes with every checkout.
+    A ``date`` ``feed_timestamp`` can't read is reported and skipped.
+    """
+    if settings.get('date'):
+        try:
+            feed_timestamp(settings['date'])
+            return settings['date'], 'date'
+        except (ValueError, OverflowError, OSError):
+            print(f"ERROR: {nb_file} has an invalid 'date' in POST_SETTINGS: {settings['date']!r} (expected YYYY-MM-DD)")
+    committed = commit_time(nb_file)
+    if committed is not None:
+        return committed, 'git'
+    return os.path.getmtime(nb_file), 'mtime'
+
+
+class ListingPage:
+    """One page of a listing: where it goes, what renders it and with what."""
+
+    def __init__(self, path, template, context):
+        self.path = path
+        self.template = template
+        self.context = context
+        self.depth = len(Path(path).parent.parts)
+
+    @property
+    def key(self):
+        return f'page:{self.path}'
+
+
+class PostIndex:
+    """
+    Every post's homepage card, grouped by category (notebook directory) and
+    by tag, kept in memory for one build.
+
+    The homepage, category and tag listings and the feed are all rendered
+    from it, so none of them needs to look at a notebook. ``commit_time``
+    looks up the last commit of a notebook without a ``date`` setting.
+    """
+
+    def __init__(self, posts, cards, commit_time=git_commit_time):
+        self.posts = list(cards)
+        self.updated = {}  # post url -> feed timestamp, only the feed shows it
+        self.categories = defaultdict(list)
+        self.tags = defaultdict(list)
+        undated = []
+        for (nb_path, nb_file, settings), card in zip(posts, cards):
+            date, source = post_date(settings, nb_file, commit_time)
+            if source != 'date':
+                undated.append(f"{nb_file} ({'last commit' if source == 'git' else 'file mtime'})")
+            self.updated[card['url']] = feed_timestamp(date)
+            category = Path(nb_path).as_posix()
+            if category != '.':
+                self.categories[category].append(card)
+            for tag in settings.get('tags', []):
+                self.tags[tag].append(card)
+        if undated:
+            print(f"⚠️ No 'date' in POST_SETTINGS, the feed dates these by: {', '.join(undated)}")
+        self.category_slugs = unique_slugs(self.categories, 'category')
+        self.tag_slugs = unique_slugs(self.tags, 'tag')
+
+    def listings(self):
+        """``(kind, base directory, title, posts)`` of every listing."""
+        yield 'home', '', 'Home', self.posts
+        for category, posts in sorted(self.categories.items()):
+            yield 'category', f'category/{self.category_slugs[category]}', Path(category).name.replace('_', ' ').title(), posts
+        for tag, posts in sorted(self.tags.items()):
+            yield 'tag', f'tag/{self.tag_slugs[tag]}', tag, posts
+
+    def pages(self, per_page=POSTS_PER_PAGE):
+        """Every listing page with the exact slice of posts it shows."""
+        for kind, base, title, posts in self.listings():
+            chunks = paginate(posts, per_page)
+            for number, chunk in enumerate(chunks, 1):
+                path = page_path(base, number)
+                prefix = page_prefix(Path(path).parent)
+                yield ListingPage(path, LISTING_TEMPLATES[kind], {
+                    'listing_title': title,
+                    'posts': [relocate_card(post, prefix, self.tag_slugs) for post in chunk],
+                    'pagination': {
+                        'number': number,
+                        'count': len(chunks),
+                        'previous': page_path(base, number - 1) if number > 1 else None,
+                        'next': page_path(base, number + 1) if number < len(chunks) else None,
+                    },
+                    'active_page': 'home' if kind == 'home' else None,
+                })
+
+    def feed_context(self, length=FEED_LENGTH):
+        """Template context of the Atom feed: the ``length`` most recently updated posts."""
+        entries = sorted(self.posts, key=lambda post: self.updated[post['url']], reverse=True)[:length]
+        return {
+            'site_url': SITE_URL,
+            'feed_id': uuid.uuid5(uuid.NAMESPACE_URL, SITE_URL + FEED_PAGE).urn,
+            'updated': max((self.updated[post['url']] for post in entries), default=feed_timestamp(0)),
+            'entries': [
+                dict(post,
+                     id=uuid.uuid5(uuid.NAMESPACE_URL, SITE_URL + post['url']).urn,
+                     updated=self.updated[post['url']])
+                for post in entries
+            ],
+        }
@@ -0,0 +1,137 @@
+import os
+import json
+import hashlib
+
+from pathlib import Path
+from core import *
+
+MANIFEST_FILE = CACHE_DIR / 'build-manifest.json'
+MANIFEST_VERSION = 1
+
+
+def hash_bytes(data):
+    """Return the hex digest used for every content hash in the build."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_text(text):
+    return hash_bytes(text.encode('utf-8'))
+
+
+def hash_json(value):
+    """Hash a JSON-serialisable value independent of dict ordering."""
+    return hash_text(json.dumps(value, sort_keys=True, default=str))
+
+
+class BuildManifest:
+    """
+    Persistent record of what every build step consumed and produced.
+
+    Each entry is keyed by a step name (``notebook:<path>``, ``resource:<path>``,
+    ``page:index.html`` ...) and stores:
+
+    - ``inputs``: digests computed by the caller before running the step
+    - ``deps``: extra files discovered while running it (images, ...)
+    - ``outputs``: files the step wrote
+    - ``data``: anything the step needs to hand back when it is skipped
+
+    File digests are cached by (mtime, size) so an unchanged tree is checked
+    with one ``stat`` per file instead of re-reading it.
+    """
+
+    def __init__(self, path=MANIFEST_FILE):
+        self.path = Path(path)
+        self.entries = {}
+        self.files = {}
+        self.touched = set()
+        self.written = []
+        self.dropped = []  # outputs a re-recorded entry no longer produces
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return self
+        if data.get('version') != MANIFEST_VERSION:
+            return self
+        self.entries = data.get('entries', {})
+        self.files = data.get('files', {})
+        return self
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': MANIFEST_VERSION,
+                'entries': self.entries,
+                'files': self.files,
+            }, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def file_digest(self, path):
+        """Content hash of a file, or None if it doesn't exist."""
+        path = str(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.files.pop(path, None)
+            return None
+        cached = self.files.get(path)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+        with open(path, 'rb') as f:
+            digest = hash_bytes(f.read())
+        self.files[path] = [st.st_mtime_ns, st.st_size, digest]
+        return digest
+
+    def dir_digest(self, directory, extensions=None):
+        """Combined hash of every file below a directory."""
+        parts = []
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            for filename in sorted(files):
+                if extensions and not filename.endswith(tuple(extensions)):
+                    continue
+                path = os.path.join(root, filename)
+                parts.append(f"{path}:{self.file_digest(path)}")
+        return hash_text('\n'.join(parts))
+
+    def is_fresh(self, key, inputs):
+        """True if ``key`` was built from the same inputs and its outputs still exist."""
+        self.touched.add(key)
+        entry = self.entries.get(key)
+        if entry is None or entry['inputs'] != inputs:
+            return False
+        for dep, digest in entry['deps'].items():
+            if self.file_digest(dep) != digest:
+                return False
+        return all(os.path.exists(output) for output in entry['outputs'])
+
+    def record(self, key, inputs, outputs, deps=(), data=None):
+        self.touched.add(key)
+        outputs = [str(output) for output in outputs]
+        self.written.extend(outputs)
+        # e.g. a page that moved to another category directory
+        previous = self.entries.get(key)
+        if previous:
+            self.dropped.extend(output for output in previous['outputs'] if output not in outputs)
+        self.entries[key] = {
+            'inputs': inputs,
+            'deps': {str(dep): self.file_digest(dep) for dep in deps},
+            'outputs': outputs,
+            'data': data,
+        }
+
+    def get_data(self, key):
+        entry = self.entries.get(key)
+        return entry['data'] if entry else None
+
+    def prune(self, keep=()):
+        """
+        Drop entries that were not looked at during this build and return
+        them. Entries whose key starts with one of the ``keep`` prefixes stay.
+        """
+        stale = [key for key in self.entries if key not in self.touched and not key.startswith(tuple(keep))]
+        return {key: self.entries.pop(key) for key in stale}
@@ -0,0 +1,269 @@
+import io
+import re
+import json
+import html
+import hashlib
+import xml.etree.ElementTree as ET
+
+from pathlib import Path
+from importlib.metadata import version
+from output import write_text
+from core import *
+
+MATH_CACHE_DIR = CACHE_DIR / 'math'
+MATH_FONT = 'cm'  # matplotlib math_fontfamily, Computer Modern like MathJax
+MATH_FONT_SIZE = 12  # points; SVGs are sized in em relative to this
+DISPLAY_SCALE = 1.2  # display math is drawn a little larger than inline math
+MEASURE_DPI = 720  # mathtext rounds boxes to whole pixels, measure at 10x to keep baselines exact
+
+# Math in a markdown cell. Code spans and fences are matched only so that
+# they are skipped, escaped dollars so that they don't open an expression.
+MATH = re.compile(
+    r'(?P<fence>^(?P<fence_marker>```|~~~).*?^(?P=fence_marker))'
+    r'|(?P<code>`[^`\n]+`)'
+    r'|(?P<escaped>\\\$)'
+    r'|\$\$(?P<display>.+?)\$\$'
+    r'|\$(?P<inline>(?:\\.|[^\\$])+?)\$',
+    re.MULTILINE | re.DOTALL
+)
+# Math MathJax would still typeset in a cell after pre-rendering
+MATHJAX_DELIMITERS = re.compile(r'\$|\\\(|\\begin\{')
+
+# Macros of the MathJax configuration in post.html
+LETTER_MACRO = re.compile(r'\\([A-Z])(?![A-Za-z])')
+SET_MACRO = re.compile(r'\\set(?![A-Za-z])\s*')
+# TeX spellings MathJax accepts and mathtext doesn't
+TEX_ALIASES = [
+    (re.compile(r'\\(le|ge)(?![A-Za-z])'), r'\\\1q'),
+    (re.compile(r'(?<!\\)"'), r'\\text{"}'),
+    (re.compile(r'(?<!\\)\\\s*$'), ''),  # a trailing "\ " space
+]
+PATH_COMMAND = re.compile(r'\s*([MLQCZz])\s*')
+TRANSLATE = re.compile(r'translate\(([^)]*)\)')
+LONG_DECIMAL = re.compile(r'(\.\d{2})\d+')
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+XLINK_NS = 'http://www.w3.org/1999/xlink'
+GLYPH_PREFIX = 'math-'
+
+
+def load_mathtext():
+    """matplotlib is optional: without it every page keeps MathJax."""
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        from matplotlib import figure, mathtext
+        from matplotlib.font_manager import FontProperties
+    except ImportError:
+        return None
+    return figure, mathtext, FontProperties
+
+
+def renderer_version():
+    """Everything besides the TeX source that shapes an expression's SVG."""
+    try:
+        matplotlib_version = version('matplotlib')
+    except Exception:
+        matplotlib_version = None
+    return {
+        'matplotlib': matplotlib_version,
+        'font': MATH_FONT,
+        'size': MATH_FONT_SIZE,
+        'display_scale': DISPLAY_SCALE,
+    }
+
+
+def closing_brace(text, start):
+    """Index of the brace closing the group that opens at ``text[start]``."""
+    depth, index = 0, start
+    while index < len(text):
+        char = text[index]
+        if char == '\\':
+            index += 2  # \{ and \} are literal braces
+            continue
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return index
+        index += 1
+    return None
+
+
+def expand_macros(tex):
+    """Expand the site's MathJax macros, which mathtext doesn't know."""
+    for pattern, replacement in TEX_ALIASES:
+        tex = pattern.sub(replacement, tex)
+    tex = LETTER_MACRO.sub(lambda m: r'\mathit{I}' if m.group(1) == 'I' else rf'\mathbb{{{m.group(1)}}}', tex)
+    while True:
+        match = SET_MACRO.search(tex)
+        if not match or not tex.startswith('{', match.end()):
+            return tex
+        end = closing_brace(tex, match.end())
+        if end is None:
+            return tex
+        tex = tex[:match.start()] + r'\left\{' + tex[match.end() + 1:end] + r'\right\}' + tex[end + 1:]
+
+
+def expression_key(tex, display, renderer):
+    data = json.dumps([renderer, display, tex], sort_keys=True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()[:32]
+
+
+def svg_tag(tag):
+    return f'{{{SVG_NS}}}{tag}'
+
+
+def render_expression(tex, display, mathtext_modules):
+    """
+    Render one expression with matplotlib mathtext.
+
+    Returns ``{'body', 'glyphs', 'viewbox', 'width', 'height', 'depth'}``: the drawing
+    without its glyph outlines, the outlines by id (shared by every
+    expression on a page) and the box in em. Raises ValueError for TeX that
+    mathtext can't parse.
+    """
+    figure, mathtext, FontProperties = mathtext_modules
+    size = MATH_FONT_SIZE * (DISPLAY_SCALE if display else 1)
+    prop = FontProperties(size=size, math_fontfamily=MATH_FONT)
+    source = f'${expand_macros(tex.strip())}$'
+    width, height, depth, _, _ = mathtext.MathTextParser('path').parse(source, dpi=MEASURE_DPI, prop=prop)
+
+    fig = figure.Figure(figsize=(width / MEASURE_DPI, height / MEASURE_DPI))
+    fig.text(0, depth / height, source, fontproperties=prop)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='svg', dpi=72, transparent=True, metadata={'Date': None, 'Creator': None})
+
+    root = ET.fromstring(buffer.getvalue())
+    glyphs = {}
+    drawing = root.find(f"{svg_tag('g')}/{svg_tag('g')}[@id='text_1']/{svg_tag('g')}")
+    for path in drawing.iter(svg_tag('path')):
+        path.set('d', PATH_COMMAND.sub(r'\1', path.get('d')).strip())
+    for defs in drawing.findall(svg_tag('defs')):
+        for path in defs:
+            path.set('id', GLYPH_PREFIX + path.get('id'))
+            glyphs[path.get('id')] = compact_svg(path)
+        drawing.remove(defs)
+    for use in drawing.iter(svg_tag('use')):
+        use.set(f'{{{XLINK_NS}}}href', '#' + GLYPH_PREFIX + use.get(f'{{{XLINK_NS}}}href').lstrip('#'))
+
+    # Sizes in em of the surrounding text, so math scales with it
+    em = MATH_FONT_SIZE * MEASURE_DPI / 72
+    return {
+        'body': compact_svg(drawing),
+        'glyphs': glyphs,
+        'viewbox': root.get('viewBox'),
+        'width': round(width / em, 3),
+        'height': round(height / em, 3),
+        'depth': round(depth / em, 3),
+    }
+
+
+def compact_svg(element):
+    ET.register_namespace('', SVG_NS)
+    ET.register_namespace('xlink', XLINK_NS)
+    markup = ET.tostring(element, encoding='unicode', short_empty_elements=True)
+    # ElementTree declares the namespaces on every fragment; the page's <svg> does that
+    markup = re.sub(r' xmlns(?::\w+)?="[^"]*"', '', markup)
+    # Offsets are in font units, hundredths of one are far below a pixel
+    markup = TRANSLATE.sub(lambda m: 'translate(' + LONG_DECIMAL.sub(r'\1', m.group(1)) + ')', markup)
+    return re.sub(r'>\s+<', '><', markup)
+
+
+def svg_html(tex, display, rendered):
+    """Inline ``<svg>`` for a rendered expression, the TeX as its accessible name."""
+    label = html.escape(' '.join(tex.split()), quote=True)
+    kind = 'display' if display else 'inline'
+    align = '' if display else f' style="vertical-align: -{rendered["depth"]}em"'
+    return (
+        f'<span class="math-svg math-svg-{kind}">'
+        f'<svg xmlns="{SVG_NS}" xmlns:xlink="{XLINK_NS}" role="img" aria-label="{label}"'
+        f' width="{rendered["width"]}em" height="{rendered["height"]}em" viewBox="{rendered["viewbox"]}"{align}>'
+        f'{rendered["body"]}</svg></span>'
+    )
+
+
+def glyph_sprite(glyphs):
+    """Hidden ``<svg>`` holding the glyph outlines the page's expressions ``<use>``."""
+    if not glyphs:
+        return ''
+    paths = ''.join(glyphs[name] for name in sorted(glyphs))
+    return (
+        f'<svg xmlns="{SVG_NS}" class="math-svg-glyphs" width="0" height="0" aria-hidden="true">'
+        f'<defs>{paths}</defs></svg>'
+    )
+
+
+class MathCache:
+    """
+    Rendered expressions, one JSON file per ``expression_key`` under
+    MATH_CACHE_DIR, shared by every notebook. TeX mathtext can't render is
+    cached too (as an error), so it isn't retried on every build.
+    """
+
+    def __init__(self, root=MATH_CACHE_DIR):
+        self.root = Path(root)
+        self.renderer = renderer_version()
+        self.mathtext = None
+
+    def path(self, key):
+        return self.root / f"{key}.json"
+
+    def render(self, tex, display):
+        """The rendered expression, or None if it has to be left to MathJax."""
+        key = expression_key(tex, display, self.renderer)
+        try:
+            with open(self.path(key), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            entry = None
+        if entry is None:
+            if self.mathtext is None:
+                self.mathtext = load_mathtext()
+                if self.mathtext is None:
+                    return None
+            try:
+                entry = render_expression(tex, display, self.mathtext)
+            except ValueError as e:
+                entry = {'error': str(e).strip().splitlines()[-1] if str(e).strip() else 'ValueError'}
+            write_text(self.path(key), json.dumps(entry, sort_keys=True))
+        return None if 'error' in entry else entry
+
+
+def has_math(text):
+    """Whether MathJax would find math to typeset in ``text``."""
+    return any(
+        match.group('display') is not None or match.group('inline') is not None
+        for match in MATH.finditer(text)
+    ) or MATHJAX_DELIMITERS.search(text.replace('$', '')) is not None
+
+
+def prerender_markdown(source, cache):
+    """
+    Replace the ``$...$`` and ``$$...$$`` math in a markdown cell with SVG.
+
+    Returns ``(source, glyphs, unrendered)``; ``unrendered`` tells whether
+    math MathJax would typeset is left in the cell.
+    """
+    glyphs = {}
+    unrendered = False
+
+    def replace(match):
+        nonlocal unrendered
+        display = match.group('display') is not None
+        tex = match.group('display') if display else match.group('inline')
+        if tex is None:
+            return match.group(0)
+        rendered = cache.render(tex, display) if '\n\n' not in tex else None
+        if rendered is None:
+            unrendered = True
+            return match.group(0)
+        glyphs.update(rendered['glyphs'])
+        return svg_html(tex, display, rendered)
+
+    source = MATH.sub(replace, source)
+    if not unrendered:
+        leftover = MATH.sub(lambda m: '' if m.group('fence') or m.group('code') or m.group('escaped') else m.group(0), source)
+        unrendered = MATHJAX_DELIMITERS.search(leftover) is not None
+    return source, glyphs, unrendered
@@ -0,0 +1,255 @@
+import os
+import re
+import base64
+import mimetypes
+from urllib.parse import unquote, urlsplit
+
+from nbconvert.preprocessors import Preprocessor
+from core import page_prefix
+from images import POST_SIZES, picture_html, default_variant, srcset
+from nb_index import read_post_settings, post_url
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.svg', '.avif')
+
+# One tokenizer for every asset reference in a markdown/HTML cell. Code
+# spans and fences are matched too, only so that they are skipped.
+ASSET_REFERENCE = re.compile(
+    r'(?P<fence>^(?P<fence_marker>```|~~~).*?^(?P=fence_marker))'
+    r'|(?P<code>`[^`\n]+`)'
+    r'|!\[(?P<img_alt>[^\]]*)\]\((?P<img_url>[^)\s]+)(?:\s+"(?P<img_title>[^"]*)")?\)'
+    r'|(?<!!)\[(?P<link_text>[^\]]*)\]\((?P<link_url>[^)\s]+)(?P<link_title>\s+"[^"]*")?\)'
+    r'|<(?P<tag>img|video|audio|source|a|embed|iframe)\b(?P<attrs>[^>]*)>',
+    re.MULTILINE | re.DOTALL | re.IGNORECASE
+)
+TAG_URL_ATTRIBUTE = re.compile(r'''\b(?P<name>src|href|poster)\s*=\s*(?P<quote>["'])(?P<url>.*?)(?P=quote)''', re.IGNORECASE)
+REMOTE_SCHEMES = ('http', 'https', 'ftp', 'mailto', 'data', 'javascript', 'tel')
+
+
+class AssetResolver:
+    """
+    Turns a reference found in a cell into the URL it should have on the site.
+
+    Local images and files are published through the content-addressed
+    stores, ``attachment:`` URIs are decoded from the cell's attachments and
+    links to other notebooks point at their generated pages. Remote URLs,
+    anchors and missing files are left untouched (resolve returns None).
+    Results are memoized per notebook, so a path is only hashed once.
+    """
+
+    def __init__(self, image_store, file_store, responsive=None, log=None):
+        self.image_store = image_store
+        self.file_store = file_store
+        self.responsive = responsive
+        self.log = log
+        self.variants = {}
+        self.reset({})
+
+    def reset(self, resources):
+        self.resources = resources
+        self.notebook_dir = resources.get('metadata', {}).get('path') or None
+        self.prefix = page_prefix(resources.get('post_settings', {}).get('category', ''))
+        self.cache = {}
+        self.variants = {}
+
+    def prefetch(self, urls):
+        """
+        Build the responsive variants of every local image in ``urls`` in
+        one batch, so a notebook's images are encoded in parallel.
+        """
+        if self.responsive is None:
+            return
+        paths = set()
+        for url in urls:
+            parts = urlsplit(url)
+            if parts.scheme or parts.netloc or not parts.path or parts.path.startswith('/'):
+                continue
+            local_path = self._local_path(unquote(parts.path))
+            if local_path.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(local_path):
+                paths.add(local_path)
+        if paths:
+            self.variants.update(self.responsive.process_many(sorted(paths)))
+
+    def _record(self, source, store, name):
+        if source is not None:
+            self.resources.setdefault('asset_sources', []).append(source)
+        self.resources.setdefault('asset_outputs', []).append(str(store.path(name)))
+
+    def _local_path(self, path):
+        if self.notebook_dir and not os.path.isabs(path):
+            path = os.path.join(self.notebook_dir, path)
+        return os.path.normpath(path)
+
+    def _attachment(self, name, attachments):
+        bundle = (attachments or {}).get(name)
+        if not bundle:
+            return None
+        mimetype, data = next(iter(bundle.items()))
+        if isinstance(data, list):
+            data = ''.join(data)
+        payload = data.encode('utf-8') if mimetype == 'image/svg+xml' else base64.b64decode(data)
+        ext = mimetypes.guess_extension(mimetype) or ''
+        name = self.image_store.add_bytes(payload, ext)
+        self._record(None, self.image_store, name)
+        return {'url': self.image_store.url(name, self.prefix), 'variants': None}
+
+    def _notebook_link(self, local_path):
+        settings = read_post_settings(local_path)
+        if not settings:
+            return None
+        return {'url': self.prefix + post_url(settings, local_path), 'variants': None}
+
+    def _publish(self, local_path):
+        is_image = local_path.lower().endswith(IMAGE_EXTENSIONS)
+        store = self.image_store if is_image else self.file_store
+        name = store.add_file(local_path)
+        self._record(local_path, store, name)
+
+        variants = None
+        if is_image and self.responsive is not None:
+            if local_path not in self.variants:
+                self.variants.update(self.responsive.process_many([local_path]))
+            variants = self.variants[local_path]
+            if variants:
+                self.resources.setdefault('asset_outputs', []).extend(self.responsive.outputs(variants))
+        return {'url': store.url(name, self.prefix), 'variants': variants}
+
+    def resolve(self, url, attachments=None):
+        """Return ``{'url', 'variants'}`` for a local reference, or None to leave it alone."""
+        if url in self.cache:
+            return self.cache[url]
+
+        parts = urlsplit(url)
+        result = None
+        if parts.scheme == 'attachment':
+            result = self._attachment(unquote(parts.path), attachments)
+        elif parts.scheme or parts.netloc or not parts.path or parts.path.startswith('/'):
+            result = None
+        else:
+            local_path = self._local_path(unquote(parts.path))
+            if not os.path.isfile(local_path):
+                if self.log:
+                    self.log.warning(f"Asset file not found: {local_path}")
+            elif local_path.endswith('.ipynb'):
+                result = self._notebook_link(local_path)
+            else:
+                result = self._publish(local_path)
+            if result and parts.fragment:
+                result = dict(result, url=f"{result['url']}#{parts.fragment}")
+
+        # Attachments are per cell, so only cache file references
+        if parts.scheme != 'attachment':
+            self.cache[url] = result
+        return result
+
+
+class AssetRewritePreprocessor(Preprocessor):
+    """
+    A preprocessor that publishes every local asset a markdown or HTML cell
+    references and rewrites the references in a single pass.
+
+    Handles markdown images and links, ``src``/``href``/``poster`` on
+    ``<img>``, ``<video>``, ``<audio>``, ``<source>``, ``<a>``, ``<embed>`` and
+    ``<iframe>``, and ``attachment:`` URIs. Raster images get responsive
+    ``<picture>``/``srcset`` markup when variants are available.
+    """
+    
+    def __init__(self, image_store, file_store, responsive=None, **kwargs):
+        """
+        Initialize the preprocessor.
+        
+        Parameters:
+        -----------
+        image_store : AssetStore
+            Content-addressed store images are published to.
+        file_store : AssetStore
+            Content-addressed store other linked files are published to.
+        responsive : ResponsiveImages
+            If given, raster images get resized variants.
+        """
+        super().__init__(**kwargs)
+        self.resolver = AssetResolver(image_store, file_store, responsive, self.log)
+
+    @staticmethod
+    def _is_rewritten(cell):
+        is_html_cell = (cell.cell_type == 'raw'
+                        and cell.get('metadata', {}).get('raw_mimetype', '').lower() == 'text/html')
+        return cell.cell_type == 'markdown' or is_html_cell
+
+    def _referenced_urls(self, nb):
+        for cell in filter(self._is_rewritten, nb.cells):
+            for match in ASSET_REFERENCE.finditer(cell.source):
+                if match.group('img_url'):
+                    yield match.group('img_url')
+                elif match.group('tag'):
+                    yield from (attr.group('url') for attr in TAG_URL_ATTRIBUTE.finditer(match.group('attrs')))
+
+    def preprocess(self, nb, resources):
+        self.resolver.reset(resources)
+        self.resolver.prefetch(self._referenced_urls(nb))
+        return super().preprocess(nb, resources)
+
+    def _rewrite_tag(self, match, attachments):
+        tag, attrs = match.group('tag'), match.group('attrs')
+        picture = {}
+
+        def rewrite_attribute(attr):
+            resolved = self.resolver.resolve(attr.group('url'), attachments)
+            if resolved is None:
+                return attr.group(0)
+            if resolved['variants'] and tag.lower() == 'img' and attr.group('name').lower() == 'src':
+                picture['variants'] = resolved['variants']
+                return f'src="{default_variant(self.resolver.image_store, resolved["variants"], self.resolver.prefix)}"'
+            return f'{attr.group("name")}="{resolved["url"]}"'
+
+        attrs = TAG_URL_ATTRIBUTE.sub(rewrite_attribute, attrs)
+        if picture and 'srcset' not in attrs.lower():
+            entries = srcset(self.resolver.image_store, picture['variants']['fallback'], self.resolver.prefix)
+            attrs = f' srcset="{entries}" sizes="{POST_SIZES}"' + attrs
+        return f'<{tag}{attrs}>'
+
+    def _rewrite(self, match, attachments):
+        if match.group('fence') or match.group('code'):
+            return match.group(0)
+
+        if match.group('tag'):
+            return self._rewrite_tag(match, attachments)
+
+        if match.group('img_url'):
+            resolved = self.resolver.resolve(match.group('img_url'), attachments)
+            if resolved is None:
+                return match.group(0)
+            alt, title = match.group('img_alt'), match.group('img_title')
+            if resolved['variants']:
+                return picture_html(self.resolver.image_store, resolved['variants'], alt, POST_SIZES,
+                                    self.resolver.prefix, title)
+            title_part = f' "{title}"' if title else ''
+            return f'![{alt}]({resolved["url"]}{title_part})'
+
+        resolved = self.resolver.resolve(match.group('link_url'), attachments)
+        if resolved is None:
+            return match.group(0)
+        return f'[{match.group("link_text")}]({resolved["url"]}{match.group("link_title") or ""})'
+
+    def preprocess_cell(self, cell, resources, index):
+        """
+        Preprocess a notebook cell.
+        
+        Parameters:
+        -----------
+        cell : dict
+            Notebook cell.
+        resources : dict
+            Resources dict.
+        index : int
+            Cell index.
+            
+        Returns:
+        --------
+        tuple
+            Processed cell and resources.
+        """
+        if self._is_rewritten(cell):
+            attachments = cell.get('attachments')
+            cell.source = ASSET_REFERENCE.sub(lambda m: self._rewrite(m, attachments), cell.source)
+        
+        return cell, resources
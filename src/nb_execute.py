@@ -0,0 +1,53 @@
+import math
+import time
+
+from nbclient.exceptions import CellTimeoutError
+from nbconvert.preprocessors import ExecutePreprocessor
+from execution import ExecutionCache, cell_keys
+
+
+class CachedExecutePreprocessor(ExecutePreprocessor):
+    """
+    ExecutePreprocessor backed by a per-cell output cache.
+
+    Cells whose key (see ``execution.cell_keys``) is cached get their stored
+    outputs back without a kernel being started, so a notebook whose code
+    hasn't changed - a markdown edit included - costs nothing. A single miss
+    re-runs every cell: the kernel has to rebuild its state anyway, so the
+    cached outputs of the cells before it aren't reused.
+
+    ``notebook_timeout`` bounds the whole notebook, not each cell: once it
+    has passed the next cell fails with a CellTimeoutError.
+    """
+
+    def __init__(self, nb_file, notebook_timeout=None, **kwargs):
+        super().__init__(**kwargs)
+        self.nb_file = nb_file
+        self.notebook_timeout = notebook_timeout
+        self.deadline = None
+        self.executed = False
+
+    def _get_timeout(self, cell):
+        if self.deadline is None:
+            return super()._get_timeout(cell)
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise CellTimeoutError.error_from_timeout_and_cell(
+                "Notebook execution timed out", self.notebook_timeout, cell
+            )
+        return math.ceil(remaining)
+
+    def preprocess(self, nb, resources=None, km=None):
+        cache = ExecutionCache(self.nb_file).load()
+        keys = cell_keys(nb)
+        if cache.first_miss(keys) is None:
+            cache.restore(nb, keys)
+            return nb, resources
+
+        if self.notebook_timeout:
+            self.deadline = time.monotonic() + self.notebook_timeout
+        nb, resources = super().preprocess(nb, resources, km)
+        self.executed = True
+        cache.store(nb, keys)
+        cache.save(keep=keys)
+        return nb, resources
@@ -0,0 +1,206 @@
+import os
+import re
+import ast
+import json
+import subprocess
+
+from pathlib import Path
+from core import *
+
+NB_INDEX_FILE = CACHE_DIR / 'nb_index.json'
+READ_CHUNK_SIZE = 16 * 1024
+
+# nbformat writes keys sorted, so "cells" opens every notebook file
+CELLS_START = re.compile(r'\s*\{\s*"cells"\s*:\s*\[\s*')
+
+
+def read_first_cell(nb_file):
+    """
+    Return the first cell of a notebook without parsing the rest of the file.
+
+    The file is read in growing chunks until the first cell object decodes,
+    so the heavy outputs further down are never read. Falls back to a full
+    ``json.load`` for files that don't start with the cell list.
+    """
+    decoder = json.JSONDecoder()
+    with open(nb_file, 'r', encoding='utf-8') as f:
+        buffer = f.read(READ_CHUNK_SIZE)
+        match = CELLS_START.match(buffer)
+        if match is None:
+            f.seek(0)
+            cells = json.load(f).get('cells', [])
+            return cells[0] if cells else None
+
+        chunk_size = READ_CHUNK_SIZE
+        while True:
+            if buffer[match.end():match.end() + 1] == ']':
+                return None
+            try:
+                cell, _ = decoder.raw_decode(buffer, match.end())
+                return cell
+            except json.JSONDecodeError:
+                chunk_size *= 2
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    raise
+                buffer += chunk
+
+
+def _settings_from_lines(source):
+    """Brace-matching extraction for cells that aren't valid Python as a whole."""
+    settings_str = ''
+    started = False
+    for line in source.strip().split('\n'):
+        if line.strip().startswith('POST_SETTINGS'):
+            started = True
+            settings_str += line.split('=', 1)[1].strip()
+        elif started and not line.strip().endswith('}'):
+            settings_str += line.strip()
+        elif started:
+            settings_str += line.strip()
+            break
+    return ast.literal_eval(settings_str)
+
+
+def parse_post_settings(source):
+    """
+    Parse the ``POST_SETTINGS = {...}`` literal out of a cell's source.
+
+    Only Python literals are accepted (``ast.literal_eval``), nothing in the
+    notebook is executed. IPython magics and shell escapes are ignored.
+    Returns None if the cell has no valid settings dict.
+    """
+    if isinstance(source, list):
+        source = ''.join(source)
+    if 'POST_SETTINGS' not in source:
+        return None
+
+    lines = [line for line in source.split('\n') if not line.lstrip().startswith(('%', '!'))]
+    try:
+        tree = ast.parse('\n'.join(lines))
+    except SyntaxError:
+        tree = None
+
+    settings = None
+    if tree is not None:
+        for node in tree.body:
+            if (isinstance(node, ast.Assign)
+                    and any(isinstance(t, ast.Name) and t.id == 'POST_SETTINGS' for t in node.targets)):
+                try:
+                    settings = ast.literal_eval(node.value)
+                except ValueError:
+                    return None
+    else:
+        try:
+            settings = _settings_from_lines(source)
+        except (ValueError, SyntaxError):
+            return None
+
+    return settings if isinstance(settings, dict) else None
+
+
+def post_url(post_settings, nb_file):
+    """Site-relative URL of a notebook's page."""
+    stem = Path(nb_file).stem
+    return f"{post_settings['category']}/{stem}.html" if post_settings.get('category') else f"{stem}.html"
+
+
+def git_head():
+    """Commit checked out in the working directory, or None outside git."""
+    try:
+        result = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def git_commit_time(nb_file):
+    """Unix author time of the last commit touching ``nb_file``, or None outside git / for uncommitted files."""
+    try:
+        result = subprocess.run(
+            ['git', 'log', '-1', '--format=%at', '--', str(nb_file)],
+            capture_output=True, text=True, check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return int(result.stdout) if result.stdout.strip() else None
+
+
+def read_post_settings(nb_file):
+    """POST_SETTINGS of a notebook, read from its first code cell."""
+    cell = read_first_cell(nb_file)
+    if not cell or cell.get('cell_type') != 'code':
+        return None
+    return parse_post_settings(cell.get('source', ''))
+
+
+class NotebookIndex:
+    """
+    Cache of every notebook's POST_SETTINGS (and last commit time), keyed
+    by file mtime and size.
+
+    Lets the homepage and other listing pages be generated without reading
+    (let alone converting) the notebooks themselves.
+    """
+
+    def __init__(self, path=NB_INDEX_FILE):
+        self.path = Path(path)
+        self.entries = {}
+        self.dirty = False
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (IOError, ValueError):
+            self.entries = {}
+        return self
+
+    def save(self, keep=None):
+        if keep is not None:
+            keep = {str(path) for path in keep}
+            for path in [path for path in self.entries if path not in keep]:
+                del self.entries[path]
+                self.dirty = True
+        if not self.dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+    def get(self, nb_file):
+        """POST_SETTINGS of ``nb_file``, re-read only if the file changed."""
+        key = str(nb_file)
+        st = os.stat(nb_file)
+        entry = self.entries.get(key)
+        if entry and entry['mtime_ns'] == st.st_mtime_ns and entry['size'] == st.st_size:
+            return entry['settings']
+
+        try:
+            settings = read_post_settings(nb_file)
+        except (IOError, ValueError) as e:
+            print(f"Error reading POST_SETTINGS from {nb_file}: {e}")
+            settings = None
+        self.entries[key] = {'mtime_ns': st.st_mtime_ns, 'size': st.st_size, 'settings': settings}
+        self.dirty = True
+        return settings
+
+    def commit_time(self, nb_file, head):
+        """
+        ``git_commit_time`` of ``nb_file``, kept until the notebook (see
+        ``get``) or the checked out commit ``head`` changes, so a build
+        doesn't run git once per notebook.
+        """
+        if head is None:
+            return None
+        entry = self.entries.get(str(nb_file))
+        if entry is None:
+            return git_commit_time(nb_file)
+        if entry.get('head') != head:
+            entry['head'] = head
+            entry['committed'] = git_commit_time(nb_file)
+            self.dirty = True
+        return entry['committed']
@@ -0,0 +1,44 @@
+from nbconvert.preprocessors import Preprocessor
+from math_svg import MathCache, prerender_markdown, glyph_sprite, has_math
+from nb_processors import output_text
+
+
+def output_has_math(output):
+    """Whether MathJax would typeset something in a code cell output."""
+    data = output.get('data', {})
+    return 'text/latex' in data or any(has_math(output_text(data.get(mimetype, ''))) for mimetype in ('text/markdown', 'text/html'))
+
+
+class MathPrerenderPreprocessor(Preprocessor):
+    """
+    A preprocessor that renders the math of markdown cells to inline SVG.
+
+    Only runs with ``resources['prerender_math']``; expressions come from
+    the shared MathCache. The glyph outlines every expression uses are
+    collected in ``resources['math_glyphs']`` (one hidden ``<svg>`` per
+    page) and ``resources['needs_mathjax']`` tells post.html whether the
+    page still has math for MathJax: TeX mathtext can't render, ``\\(...\\)``
+    and environments, LaTeX outputs.
+    """
+
+    def __init__(self, cache=None, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache or MathCache()
+
+    def preprocess(self, nb, resources):
+        if not resources.get('prerender_math'):
+            resources['needs_mathjax'] = True
+            return nb, resources
+
+        glyphs = {}
+        needs_mathjax = False
+        for cell in nb.cells:
+            if cell.cell_type == 'markdown':
+                cell.source, cell_glyphs, unrendered = prerender_markdown(cell.source, self.cache)
+                glyphs.update(cell_glyphs)
+                needs_mathjax = needs_mathjax or unrendered
+            elif cell.cell_type == 'code' and not needs_mathjax:
+                needs_mathjax = any(output_has_math(output) for output in cell.get('outputs', []))
+        resources['math_glyphs'] = glyph_sprite(glyphs)
+        resources['needs_mathjax'] = needs_mathjax
+        return nb, resources
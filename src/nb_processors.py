@@ -1,7 +1,24 @@
+import re
+import html
 import base64
+import struct
+
 from nbconvert.preprocessors import Preprocessor
-import matplotlib.pyplot as plt
-import numpy as np
+from nbconvert.filters.ansi import ansi2html
+from nbformat.v4 import new_output, new_raw_cell
+from core import page_prefix
+from images import FIGURE_MAX_WIDTH, FIGURE_PIXEL_RATIO, FigureOptimizer
+from nb_index import parse_post_settings
+from fragments import fragment_key
+
+# Output mimetypes written out as files, and the extension each one gets
+EXTRACTED_IMAGE_TYPES = {
+    'image/png': '.png',
+    'image/jpeg': '.jpg',
+    'image/svg+xml': '.svg',
+}
+PREVIEW_LINES = 20  # lines and characters of a lazy-loaded text output shown up front
+PREVIEW_CHARS = 2000
 
 
 class PostSettingsPreprocessor(Preprocessor):
@@ -14,188 +31,244 @@ class PostSettingsPreprocessor(Preprocessor):
         """
         # We only want to process the first code cell
         if index == 0 and cell.cell_type == 'code':
-            # Check if the cell contains SETTINGS
-            if 'POST_SETTINGS' in cell.source:
-                try:
-                    # Extract the SETTINGS dictionary from the code
-                    cell_lines = cell.source.strip().split('\n')
-                    settings_str = ''
-                    started = False
-                    
-                    for line in cell_lines:
-                        if line.strip().startswith('POST_SETTINGS'):
-                            started = True
-                            settings_str += line.split('=', 1)[1].strip()
-                        elif started and not line.strip().endswith('}'):
-                            settings_str += line.strip()
-                        elif started:
-                            settings_str += line.strip()
-                            break
-
-                    
-                    # Safely evaluate the settings dictionary
-                    settings = eval(settings_str)
-                    resources['post_settings'] = settings
-                    
-                except Exception as e:
-                    print(f"Error processing POST_SETTINGS: {e}")
+            # Parse the SETTINGS literal (never executed)
+            settings = parse_post_settings(cell.source)
+            if settings is not None:
+                resources['post_settings'] = settings
+            elif 'POST_SETTINGS' in cell.source:
+                print("Error processing POST_SETTINGS: not a literal dict")
         
         return cell, resources
 
 
-import os
-import re
-import shutil
-from pathlib import Path
-from urllib.parse import unquote, urlparse
+def image_size(data, ext):
+    """
+    Read (width, height) from PNG/JPEG headers or SVG attributes.
 
-from nbconvert.preprocessors import Preprocessor
+    Returns None if the size can't be determined cheaply.
+    """
+    if ext == '.png' and data[:8] == b'\x89PNG\r\n\x1a\n':
+        return struct.unpack('>II', data[16:24])
+
+    if ext == '.jpg':
+        offset = 2
+        while offset + 9 < len(data):
+            if data[offset] != 0xFF:
+                return None
+            marker = data[offset + 1]
+            length = struct.unpack('>H', data[offset + 2:offset + 4])[0]
+            # Start-of-frame markers carry the image size
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack('>HH', data[offset + 5:offset + 9])
+                return width, height
+            offset += 2 + length
+        return None
+
+    if ext == '.svg':
+        head = data[:2048].decode('utf-8', 'ignore')
+        svg_tag = re.search(r'<svg\b[^>]*>', head)
+        if not svg_tag:
+            return None
+        size = []
+        for attr in ('width', 'height'):
+            match = re.search(rf'\b{attr}="([\d.]+)(pt|px)?"', svg_tag.group(0))
+            if not match:
+                return None
+            value = float(match.group(1))
+            # matplotlib writes SVG sizes in points
+            size.append(round(value * 4 / 3 if match.group(2) == 'pt' else value))
+        return tuple(size)
+
+    return None
 
-class ImageCopyPreprocessor(Preprocessor):
+
+# An object repr standing in for the figure, e.g. "<Figure size 640x480 with 1 Axes>"
+OBJECT_REPR = re.compile(r'^<.*>$', re.DOTALL)
+
+
+def figure_alt(output, cell):
     """
-    A preprocessor that finds all image references in markdown cells and
-    copies the referenced images to a specified static directory.
+    Alt text of an output figure: its ``text/plain`` unless that is only an
+    object repr, else the cell's ``caption`` metadata, else nothing.
     """
-    
-    def __init__(self, static_dir=None, **kwargs):
-        """
-        Initialize the preprocessor.
-        
-        Parameters:
-        -----------
-        static_dir : str
-            Path to the directory where images should be copied.
-            If None, the environment variable STATIC_DIR will be used.
-        """
+    text = output.data.get('text/plain', '')
+    if isinstance(text, list):
+        text = ''.join(text)
+    text = text.strip()
+    if text and not OBJECT_REPR.match(text):
+        return text
+    return str(cell.get('metadata', {}).get('caption', ''))
+
+
+class OutputImagePreprocessor(Preprocessor):
+    """
+    A preprocessor that moves image outputs out of the page.
+
+    PNG, JPEG and SVG outputs are written to ``static/img/<contenthash>.<ext>``
+    and replaced by a lazily loaded ``<img>`` with explicit dimensions, so
+    pages don't carry base64 blobs and identical figures are stored once.
+
+    PNG and JPEG figures go through the ``FigureOptimizer`` first, sized for
+    ``resources['figure_width']`` CSS px at ``resources['pixel_ratio']``.
+    ``resources['figure_report']`` counts the bytes that saved.
+    """
+
+    def __init__(self, asset_store, optimizer=None, **kwargs):
         super().__init__(**kwargs)
-        self.static_dir = static_dir or os.environ.get('STATIC_DIR', 'static')
-        # Create the static directory if it doesn't exist
-        os.makedirs(self.static_dir, exist_ok=True)
-        self.image_count = 0
-    
-    def _extract_image_paths(self, cell_text):
-        """
-        Extract image paths from markdown cell text.
-        
-        Returns a list of file paths.
-        """
-        # Match markdown image syntax: ![alt text](path/to/image.png)
-        md_pattern = r'!\[.*?\]\(([^)]+)\)'
-        
-        # Match HTML image syntax: <img src="path/to/image.png" ... />
-        html_pattern = r'<img\s+[^>]*src=["\'](.*?)["\'][^>]*>'
-        
-        image_paths = []
-        
-        # Find all markdown image references
-        for match in re.finditer(md_pattern, cell_text):
-            path = match.group(1)
-            # Remove query parameters if present
-            path = path.split('?')[0].split('#')[0]
-            image_paths.append(path)
-        
-        # Find all HTML image references
-        for match in re.finditer(html_pattern, cell_text):
-            path = match.group(1)
-            # Remove query parameters if present
-            path = path.split('?')[0].split('#')[0]
-            image_paths.append(path)
-        
-        return image_paths
-    
-    def _copy_image(self, image_path, notebook_dir=None):
-        
-        print(image_path)
-        # Parse the image path
-        parsed_path = urlparse(unquote(image_path))
-        
-        # Skip images with remote URLs
-        if parsed_path.scheme in ('http', 'https', 'ftp'):
-            return image_path
-            
-        # Get the local file path
-        if parsed_path.path:
-            local_path = parsed_path.path
-        else:
-            local_path = image_path
-            
-        # Make the path absolute if it's relative
-        if notebook_dir and not os.path.isabs(local_path):
-            local_path = os.path.join(notebook_dir, local_path)
-            
-        # Check if the file exists
-        if not os.path.isfile(local_path):
-            self.log.warning(f"Image file not found: {local_path}")
-            return image_path
-            
-        # Determine the destination file path
-        file_name = os.path.basename(local_path)
-        base, ext = os.path.splitext(file_name)
-        
-        # Ensure unique filenames with a counter
-        self.image_count += 1
-        unique_name = f"{base}_{self.image_count}{ext}"
-        dest_path = os.path.join(self.static_dir, unique_name)
-        
-        # Copy the file
-        shutil.copy2(local_path, dest_path)
-        self.log.info(f"Copied image: {local_path} -> {dest_path}")
-        
-        # Return the new path (relative to the static directory)
-        return os.path.join(self.static_dir, unique_name)
-    
-    def _replace_image_paths(self, cell_text, old_path, new_path):
-        # Replace in markdown format
-        md_pattern = f'!\\[.*?\\]\\({re.escape(old_path)}([^)]*)\\)'
-        md_replacement = f'![\\1]({new_path}\\1)'
-        cell_text = re.sub(md_pattern, md_replacement, cell_text)
-        
-        # Replace in HTML format
-        html_pattern = f'<img\\s+([^>]*)src=["\']({re.escape(old_path)})(["\'][^>]*)>'
-        html_replacement = f'<img \\1src="{new_path}"\\3>'
-        cell_text = re.sub(html_pattern, html_replacement, cell_text)
-        
-        return cell_text
-    
+        self.asset_store = asset_store
+        self.optimizer = optimizer or FigureOptimizer()
+
+    def _write_image(self, data, ext, resources):
+        file_name = self.asset_store.add_bytes(data, ext)
+        resources.setdefault('asset_outputs', []).append(str(self.asset_store.path(file_name)))
+        return file_name
+
+    def _image_tag(self, src, size, alt):
+        attrs = [f'src="{src}"', 'loading="lazy"', 'decoding="async"', f'alt="{html.escape(alt)}"']
+        if size:
+            attrs += [f'width="{size[0]}"', f'height="{size[1]}"']
+        return f"<img {' '.join(attrs)}>"
+
     def preprocess_cell(self, cell, resources, index):
-        """
-        Preprocess a notebook cell.
-        
-        Parameters:
-        -----------
-        cell : dict
-            Notebook cell.
-        resources : dict
-            Resources dict.
-        index : int
-            Cell index.
-            
-        Returns:
-        --------
-        tuple
-            Processed cell and resources.
-        """
-        if cell.cell_type == 'markdown':
-            # Get the notebook directory
-            notebook_path = resources.get('metadata', {}).get('path', '')
-            notebook_dir = os.path.dirname(notebook_path) if notebook_path else None
-            
-            # Extract image paths from the cell text
-            image_paths = self._extract_image_paths(cell.source)
-            
-            # Copy each image and update the cell text
-            for old_path in image_paths:
-                new_path = self._copy_image(old_path, notebook_dir)
-                
-                # img_id = str(uuid.uuid4())
-                # src_path = os.path.join(NOTEBOOK_DIR,nb_path, Path(settings['image']))
-                # dest_path = os.path.join(OUTPUT_IMG_DIR, img_id)
-                # shutil.copy2(src_path, dest_path) 
-                # settings['image'] = f'static/{img_id}'
-
-                print(os.path.join(str(notebook_path),str(old_path)))
-
-                if new_path != old_path:
-                    cell.source = self._replace_image_paths(cell.source, old_path, new_path)
-        
-        return cell, resources 
\ No newline at end of file
+        if cell.cell_type != 'code':
+            return cell, resources
+
+        # Pages live in <category>/, images in static/img/
+        prefix = page_prefix(resources.get('post_settings', {}).get('category', ''))
+
+        for output in cell.get('outputs', []):
+            # text/html outranks images in the display priority, leave those alone
+            if output.output_type not in ('display_data', 'execute_result') or 'text/html' in output.data:
+                continue
+            for mimetype, ext in EXTRACTED_IMAGE_TYPES.items():
+                if mimetype not in output.data:
+                    continue
+                value = output.data[mimetype]
+                if isinstance(value, list):
+                    value = ''.join(value)
+                if mimetype == 'image/svg+xml':
+                    data = value.encode('utf-8')
+                else:
+                    data = base64.b64decode(value)
+
+                original_size = len(data)
+                data, ext, display_size = self.optimizer.optimize(
+                    data, ext,
+                    resources.get('figure_width', FIGURE_MAX_WIDTH), resources.get('pixel_ratio', FIGURE_PIXEL_RATIO),
+                )
+                report = resources.setdefault('figure_report', {'figures': 0, 'original_bytes': 0, 'bytes': 0})
+                report['figures'] += 1
+                report['original_bytes'] += original_size
+                report['bytes'] += len(data)
+                file_name = self._write_image(data, ext, resources)
+
+                # Prefer the display size the notebook asked for
+                meta = output.get('metadata', {}).get(mimetype, {})
+                if 'width' in meta and 'height' in meta:
+                    size = (meta['width'], meta['height'])
+                else:
+                    size = display_size or image_size(data, ext)
+
+                alt = figure_alt(output, cell)
+                del output.data[mimetype]
+                output.data['text/html'] = self._image_tag(self.asset_store.url(file_name, prefix), size, alt)
+                break
+
+        return cell, resources
+
+
+def output_text(value):
+    return ''.join(value) if isinstance(value, list) else value
+
+
+class LargeOutputPreprocessor(Preprocessor):
+    """
+    A preprocessor that moves outputs over the size budget out of the page.
+
+    HTML, plain text and stream outputs bigger than
+    ``resources['output_budget']`` bytes are written to
+    ``static/fragments/<contenthash>.html`` and replaced by a placeholder
+    that ``scripts/fragments.js`` fills in once it scrolls into view. Text
+    placeholders show the first lines as a preview.
+    """
+
+    def __init__(self, fragment_store, **kwargs):
+        super().__init__(**kwargs)
+        self.fragment_store = fragment_store
+
+    def _placeholder(self, html_data, preview, resources):
+        data = html_data.encode('utf-8')
+        name = self.fragment_store.add_bytes(data, '.html')
+        resources.setdefault('asset_outputs', []).append(str(self.fragment_store.path(name)))
+
+        prefix = page_prefix(resources.get('post_settings', {}).get('category', ''))
+        preview_html = f'<pre class="lazy-output-preview">{preview}</pre>' if preview else ''
+        return (
+            f'<div class="lazy-output" data-src="{self.fragment_store.url(name, prefix)}">'
+            f'{preview_html}<button type="button" class="lazy-output-load">'
+            f'Load output ({len(data) / 1024:.0f} KB)</button></div>'
+        )
+
+    def _text_preview(self, text):
+        lines = text.splitlines()
+        preview = '\n'.join(lines[:PREVIEW_LINES])[:PREVIEW_CHARS]
+        return ansi2html(preview) + ('\n…' if len(preview) < len(text.rstrip('\n')) else '')
+
+    def preprocess_cell(self, cell, resources, index):
+        budget = resources.get('output_budget')
+        if not budget or cell.cell_type != 'code':
+            return cell, resources
+
+        for i, output in enumerate(cell.get('outputs', [])):
+            if output.output_type == 'stream':
+                text = output_text(output.text)
+                html_data, preview = f'<pre>{ansi2html(text)}</pre>', True
+            elif output.output_type in ('display_data', 'execute_result') and 'text/html' in output.data:
+                html_data, preview = output_text(output.data['text/html']), False
+            elif output.output_type in ('display_data', 'execute_result') and list(output.data) == ['text/plain']:
+                text = output_text(output.data['text/plain'])
+                html_data, preview = f'<pre>{ansi2html(text)}</pre>', True
+            else:
+                continue
+
+            if len(html_data.encode('utf-8')) <= budget:
+                continue
+            placeholder = self._placeholder(html_data, self._text_preview(text) if preview else '', resources)
+            cell.outputs[i] = new_output('display_data', data={'text/html': placeholder})
+
+        return cell, resources
+
+
+class FragmentCachePreprocessor(Preprocessor):
+    """
+    A preprocessor that swaps cells with an already rendered fragment for
+    empty placeholder cells.
+
+    It runs after every other preprocessor, so the key covers the cell
+    exactly as the template would see it (rewritten asset URLs included).
+    post.html emits the cached HTML for placeholders and marks the cells it
+    renders, so their HTML can be stored for the next build.
+
+    ``resources['fragment_cache']`` is the notebook's FragmentCache and
+    ``resources['fragment_version']`` the exporter/template version.
+    """
+
+    def preprocess(self, nb, resources):
+        if resources.get('fragment_cache') is None:
+            return nb, resources
+        fragments = resources['fragment_cache'].fragments
+        version = resources.get('fragment_version', '')
+        keys, seen = [], {}
+        for index, cell in enumerate(nb.cells):
+            key = fragment_key(cell, version)
+            # Identical cells get their own fragment (and element ids)
+            seen[key] = seen.get(key, 0) + 1
+            if seen[key] > 1:
+                key = fragment_key(cell, f"{version}#{seen[key]}")
+            keys.append(key)
+            if key in fragments:
+                nb.cells[index] = new_raw_cell(metadata={'fragment': key})
+            else:
+                cell.metadata['fragment'] = key
+        resources['fragment_keys'] = keys
+        return nb, resources
@@ -0,0 +1,24 @@
+from nbconvert.preprocessors import Preprocessor
+from search import postings, searchable_text
+
+
+class SearchTextPreprocessor(Preprocessor):
+    """
+    A preprocessor that collects the searchable text of a notebook.
+
+    The title, description and tags come first, then every markdown and code
+    cell in order. The result is stored as ``resources['search_postings']``
+    (token -> positions) for the build's search index.
+    """
+
+    def preprocess(self, nb, resources):
+        settings = resources.get('post_settings') or {}
+        texts = [settings.get('title', ''), settings.get('description', ''), ' '.join(settings.get('tags', []))]
+        for index, cell in enumerate(nb.cells):
+            # The POST_SETTINGS cell is configuration, not content
+            if index == 0 and 'post_settings' in resources:
+                continue
+            if cell.cell_type in ('markdown', 'code'):
+                texts.append(searchable_text(cell))
+        resources['search_postings'] = postings(texts)
+        return nb, resources
@@ -1,88 +1,343 @@
 
-import base64
-import io
 import os
-import re
-import ast
-import matplotlib as mpl
-import matplotlib.pyplot as plt
+import json
+import uuid
+import hashlib
+import itertools
 
+from importlib.metadata import version
 from pathlib import Path
 from collections import defaultdict
 from core import *
 
-import nbformat
-from nbconvert.exporters.html import HTMLExporter
-
 from jinja2 import FileSystemLoader
-from traitlets.config import Config
 
-from nb_processors import * 
+from assets import *
+from images import *
+from nb_index import *
+from tracing import *
+from output import write_text
+from static_assets import load_static_manifest
+from execution import DEFAULT_EXECUTE_TIMEOUT
+from fragments import FragmentCache
 
 TEMPLATE_FILE = 'post.html'
+SRC_DIR = Path(os.path.dirname(__file__))
+NB_TEMPLATES_DIR = SRC_DIR / 'templates'
+
+# Source files whose changes invalidate every converted notebook
+PIPELINE_SOURCES = [
+    Path(__file__),
+    SRC_DIR / 'nb_processors.py',
+    SRC_DIR / 'nb_assets.py',
+    SRC_DIR / 'nb_search.py',
+    SRC_DIR / 'nb_math.py',
+    SRC_DIR / 'nb_execute.py',
+    SRC_DIR / 'assets.py',
+    SRC_DIR / 'images.py',
+    SRC_DIR / 'nb_index.py',
+    SRC_DIR / 'search.py',
+    SRC_DIR / 'execution.py',
+    SRC_DIR / 'fragments.py',
+    SRC_DIR / 'math_svg.py',
+]
+
+
+
+MATHJAX_URL = "https://cdnjs.cloudflare.com/ajax/libs/mathjax/2.7.7/MathJax.js?config=TeX-AMS_HTML"
+
+
+def create_exporter():
+    """Build a fully configured HTMLExporter (one per process)."""
+    # nbconvert is slow to import and only needed once a notebook is stale
+    with startup_timer('import nbconvert'):
+        from nbconvert.exporters.html import HTMLExporter
+        from traitlets.config import Config
+        from nb_processors import (
+            PostSettingsPreprocessor, OutputImagePreprocessor, LargeOutputPreprocessor, FragmentCachePreprocessor,
+        )
+        from nb_assets import AssetRewritePreprocessor
+        from nb_search import SearchTextPreprocessor
+        from nb_math import MathPrerenderPreprocessor
+
+    class TracedHTMLExporter(HTMLExporter):
+        """Every preprocessor, ours and nbconvert's defaults, gets its own trace span."""
+
+        def register_preprocessor(self, preprocessor, enabled=False):
+            # Names and classes come back here once nbconvert has built them
+            if callable(preprocessor) and not isinstance(preprocessor, (type, str)):
+                preprocessor = TracedPreprocessor(preprocessor)
+            return super().register_preprocessor(preprocessor, enabled)
+
+    c = Config()
+    nb_loader = FileSystemLoader(NB_TEMPLATES_DIR)
+
+    exporter = TracedHTMLExporter(
+        config=c, 
+        extra_loaders=[nb_loader]
+        )
+    exporter.template_file = TEMPLATE_FILE
+    exporter.exclude_input_prompt = True  
+    exporter.exclude_output_prompt = True  
+    exporter.register_preprocessor(PostSettingsPreprocessor(), enabled=True)
+    exporter.register_preprocessor(SearchTextPreprocessor(), enabled=True)
+    image_store = AssetStore()
+    file_store = AssetStore(OUTPUT_FILES_DIR, 'static/files')
+    rewriter = AssetRewritePreprocessor(image_store, file_store, ResponsiveImages(image_store))
+    exporter.register_preprocessor(rewriter, enabled=True)
+    exporter.register_preprocessor(MathPrerenderPreprocessor(), enabled=True)
+    exporter.register_preprocessor(OutputImagePreprocessor(image_store), enabled=True)
+    exporter.register_preprocessor(LargeOutputPreprocessor(AssetStore(OUTPUT_FRAGMENTS_DIR, 'static/fragments')), enabled=True)
+    # Last, so fragments are keyed on the cells exactly as the template sees them
+    exporter.register_preprocessor(FragmentCachePreprocessor(), enabled=True)
+    exporter.mathjax_url = MATHJAX_URL
+
+    exporter.environment.bytecode_cache = bytecode_cache()
+    with startup_timer('load nbconvert templates'):
+        template = exporter.template
+    template.render = traced('render post template', 'render')(with_fragment_cache(template.render))
+    return exporter
+
+
+def with_fragment_cache(render):
+    """
+    Wrap the post template's ``render`` so fragments are stored straight
+    from the template output: HTMLExporter re-serializes the page with
+    BeautifulSoup afterwards, which isn't idempotent on its own output.
+    """
+    def render_page(*args, **kwargs):
+        html = render(*args, **kwargs)
+        cache = kwargs.get('resources', {}).get('fragment_cache')
+        return cache.extract(html) if cache is not None else html
+    return render_page
+
+
+html_exporter = None
+html_exporter_version = None
+
+
+def get_exporter():
+    """
+    The exporter of this process and the ``fragment_version`` it renders.
+
+    Created on first use, and again whenever that version changes: the
+    exporter keeps its compiled templates for as long as it lives, so a
+    long-lived process would otherwise render an edited post.html with the
+    old one.
+    """
+    global html_exporter, html_exporter_version
+    current = fragment_version()
+    if html_exporter is None or current != html_exporter_version:
+        if html_exporter is not None and html_exporter.environment.cache is not None:
+            html_exporter.environment.cache.clear()
+        html_exporter = create_exporter()
+        html_exporter_version = current
+    return html_exporter, html_exporter_version
 
 
+def init_worker(trace=False):
+    """Process pool initializer: give each worker its own exporter."""
+    if trace:
+        tracer.enable()
+    tracer.drain()  # forked workers inherit the parent's events
+    get_exporter()
 
-c = Config()
-nb_loader = FileSystemLoader(os.path.join(os.path.dirname(__file__), 'templates'))
 
-html_exporter = HTMLExporter(
-    config=c, 
-    extra_loaders=[nb_loader]
-    )
-html_exporter.template_file = TEMPLATE_FILE
-html_exporter.exclude_input_prompt = True  
-html_exporter.exclude_output_prompt = True  
-html_exporter.register_preprocessor(PostSettingsPreprocessor(), enabled=True)
-html_exporter.register_preprocessor(ImageCopyPreprocessor(OUTPUT_DIR / 'static'), enabled=True)
-html_exporter.mathjax_url = "https://cdnjs.cloudflare.com/ajax/libs/mathjax/2.7.7/MathJax.js?config=TeX-AMS_HTML"
+def pipeline_config():
+    """
+    Exporter settings that affect the generated HTML, for build fingerprinting.
+
+    Read from constants and package metadata rather than a live exporter, so
+    a build with nothing to convert never imports nbconvert. The rest of
+    create_exporter is covered by PIPELINE_SOURCES.
+    """
+    return {
+        'nbconvert': version('nbconvert'),
+        'template_file': TEMPLATE_FILE,
+        'mathjax_url': MATHJAX_URL,
+        'responsive_images': {'widths': RESPONSIVE_WIDTHS, 'pillow': load_pillow() is not None},
+    }
 
 
 def search_notebooks(root_dir):
     """Recursively search for .ipynb files in the root directory."""
     notebooks = defaultdict(list)  # Maps category (directory) to a list of notebook paths
-    for root, dirs, files in os.walk(NOTEBOOK_DIR):
-        for file in files:
+    for root, dirs, files in os.walk(root_dir):
+        dirs.sort()  # Walk in a stable order so builds are reproducible
+        for file in sorted(files):
             if file.endswith('.ipynb'):
                 notebook_path = Path(root) / file
                 # Use the relative path to the root directory as the category
-                category = Path(root).relative_to(NOTEBOOK_DIR)
+                category = Path(root).relative_to(root_dir)
                 notebooks[category].append(notebook_path)
     return notebooks
 
 
-def generate_notebook_page(n_src_file):
-    """Convert a notebook to HTML using nbconvert."""
+class StableUUIDs:
+    """
+    Stand-in for the templates' ``uuid4`` that gives the same ids on every
+    build of a notebook, so unchanged pages render to identical bytes.
+
+    Ids are numbered per cell (``scope``), so a cell renders the same
+    whether or not the cells around it come from the fragment cache.
+    """
+
+    def __init__(self, n_src_file):
+        self.namespace = Path(n_src_file).as_posix()
+        self.scope(None)
+
+    def scope(self, name):
+        self.prefix = f"{self.namespace}#{name}"
+        self.counter = itertools.count()
+        return ''
+
+    def __call__(self):
+        return uuid.uuid5(uuid.NAMESPACE_URL, f"{self.prefix}#{next(self.counter)}")
+
+
+def fragment_version():
+    """
+    Version of everything besides a cell's content that shapes its HTML:
+    the exporter settings, the notebook templates and the pipeline sources.
+    Files are named relative to ``src/``, so the version (and the element
+    ids derived from it) is the same in every checkout.
+    """
+    files = sorted(path for path in NB_TEMPLATES_DIR.rglob('*') if path.is_file()) + list(PIPELINE_SOURCES)
+    names, digests = [], []
+    for path in files:
+        names.append(path.relative_to(SRC_DIR).as_posix())
+        with open(path, 'rb') as f:
+            digests.append(hashlib.sha256(f.read()).hexdigest())
+    return hashlib.sha256(json.dumps([pipeline_config(), names, digests]).encode('utf-8')).hexdigest()
+
+
+def read_notebook(n_src_file):
+    import nbformat
+    with span('read notebook', 'io'), open(n_src_file, "r", encoding="utf-8") as f:
+        return nbformat.read(f, as_version=4)
+
+
+def execute_notebook(notebook_content, n_src_file, timeout=DEFAULT_EXECUTE_TIMEOUT):
+    """
+    Run a notebook's code through the cached execution preprocessor.
+
+    Returns the executed notebook, or None if execution failed (an error in
+    a cell, a timeout, a missing kernel ...).
+    """
+    from nb_execute import CachedExecutePreprocessor
+    executor = CachedExecutePreprocessor(n_src_file, notebook_timeout=timeout)
+    try:
+        with span('execute notebook', 'execute', path=str(n_src_file)):
+            notebook_content, _ = executor.preprocess(notebook_content, {'metadata': {'path': str(n_src_file.parent)}})
+    except Exception as e:
+        # CellExecutionError carries the exception raised inside the kernel
+        print(f"ERROR: executing {n_src_file} failed: {getattr(e, 'ename', type(e).__name__)}: {getattr(e, 'evalue', e)}")
+        return None
+    if executor.executed:
+        print(f"Executed notebook: {n_src_file}")
+    return notebook_content
+
+
+def generate_notebook_page(n_src_file, exporter=None, execute=False, execute_timeout=DEFAULT_EXECUTE_TIMEOUT,
+                           output_budget=DEFAULT_OUTPUT_BUDGET, prerender_math=False,
+                           figure_width=FIGURE_MAX_WIDTH, pixel_ratio=FIGURE_PIXEL_RATIO):
+    """
+    Convert a notebook to HTML using nbconvert.
+
+    With ``execute`` the notebook is run first (see ``execute_notebook``); if
+    that fails the page is rendered from the outputs saved in the file and
+    ``resources['execution_failed']`` is set. Outputs bigger than
+    ``output_budget`` bytes are lazy-loaded (0 keeps everything inline).
+    With ``prerender_math`` markdown math is rendered to SVG at build time
+    and MathJax is only loaded by pages with math it couldn't render.
+    Output figures are sized for ``figure_width`` CSS px at ``pixel_ratio``.
+    """
+    if exporter is None:
+        exporter, version = get_exporter()
+    else:
+        version = fragment_version()
 
      # Load the notebook
-    with open(n_src_file, "r", encoding="utf-8") as f:
-        notebook_content = nbformat.read(f, as_version=4)
+    notebook_content = read_notebook(n_src_file)
+    execution_failed = False
+    if execute:
+        executed = execute_notebook(notebook_content, n_src_file, execute_timeout)
+        execution_failed = executed is None
+        # A failed run leaves the cells half-updated, start again from the file
+        notebook_content = read_notebook(n_src_file) if execution_failed else executed
  
     
-    html_exporter.environment.globals['url'] = '../'
+    exporter.environment.globals['url'] = '../'
+    static_manifest = load_static_manifest()
+    exporter.environment.globals['url_static'] = lambda path: '../' + static_manifest.get(path, path)
+    uuids = StableUUIDs(n_src_file)
+    exporter.environment.globals['uuid4'] = uuids
+    exporter.environment.globals['uuid_scope'] = uuids.scope
 
-    notebook_html, resources = html_exporter.from_notebook_node(notebook_content)
+    fragment_cache = FragmentCache(n_src_file).load()
+    resources = {
+        'metadata': {'path': str(n_src_file.parent), 'name': n_src_file.stem},
+        'execution_failed': execution_failed,
+        'fragment_cache': fragment_cache,
+        'fragment_version': version,
+        'output_budget': output_budget,
+        'prerender_math': prerender_math,
+        'figure_width': figure_width,
+        'pixel_ratio': pixel_ratio,
+    }
+    with span('export notebook', 'render'):
+        notebook_html, resources = exporter.from_notebook_node(notebook_content, resources)
+    # nbconvert preprocesses (and renders) a deep copy of the resources
+    with span('save fragment cache', 'io'):
+        resources.get('fragment_cache', fragment_cache).save(keep=resources.get('fragment_keys', []))
     
-    post_settings = resources['post_settings']
+    post_settings = resources.get('post_settings')
     
 
     
 
     if not isinstance(post_settings, dict):
         print(f"ERROR: {n_src_file} doesn't have valid POST_SETTINGS dict")
-        return ""
+        return None, None, resources
     
 
     output_file = Path( f"{n_src_file.stem}.html")
-    post_settings['url'] = f"{post_settings['category']}/{output_file.stem}.html" if post_settings['category'] else f"{output_file.stem}.html"
+    post_settings['url'] = post_url(post_settings, n_src_file)
 
     output_dir = Path(os.path.join( OUTPUT_DIR, post_settings['category']))
     if not output_dir .exists():
         output_dir.mkdir(parents=True, exist_ok=True)
     
     print(f"Writing NoteBook file: {output_dir / output_file}")
-    # Save the rendered HTML
-    with open(output_dir / output_file, "w", encoding="utf-8") as f:
-        f.write(notebook_html)
+    # Save the rendered HTML, leaving an identical page untouched
+    with span('write page', 'io'):
+        resources['output_changed'] = write_text(output_dir / output_file, notebook_html)
+
+    return output_dir / output_file, post_settings, resources
+
+
+def convert_notebook(n_src_file, execute=False, execute_timeout=DEFAULT_EXECUTE_TIMEOUT,
+                     output_budget=DEFAULT_OUTPUT_BUDGET, prerender_math=False,
+                     figure_width=FIGURE_MAX_WIDTH, pixel_ratio=FIGURE_PIXEL_RATIO):
+    """
+    Process pool entry point around ``generate_notebook_page``.
 
-    return output_file, post_settings
+    Only the picklable parts of the nbconvert resources are sent back to the
+    parent process.
+    """
+    with span(f'notebook {n_src_file}', 'notebook', path=str(n_src_file)):
+        output_path, post_settings, resources = generate_notebook_page(
+            n_src_file, None, execute, execute_timeout, output_budget, prerender_math, figure_width, pixel_ratio
+        )
+    return {
+        'output_path': output_path,
+        'post_settings': post_settings,
+        'asset_sources': resources.get('asset_sources', []),
+        'asset_outputs': resources.get('asset_outputs', []),
+        'output_changed': resources.get('output_changed', False),
+        'search_postings': resources.get('search_postings', {}),
+        'execution_failed': resources.get('execution_failed', False),
+        'figure_report': resources.get('figure_report'),
+        # Spans recorded in a pool worker travel back with its result
+        'trace_events': tracer.drain(),
+    }
@@ -0,0 +1,115 @@
+import os
+import shutil
+
+from pathlib import Path
+from core import *
+
+
+def _same_bytes(path, data):
+    try:
+        if os.path.getsize(path) != len(data):
+            return False
+        with open(path, 'rb') as f:
+            return f.read() == data
+    except OSError:
+        return False
+
+
+def _same_file(src_path, dest_path):
+    try:
+        if os.path.getsize(src_path) != os.path.getsize(dest_path):
+            return False
+        with open(src_path, 'rb') as src, open(dest_path, 'rb') as dest:
+            while True:
+                a, b = src.read(1 << 20), dest.read(1 << 20)
+                if a != b:
+                    return False
+                if not a:
+                    return True
+    except OSError:
+        return False
+
+
+def replace_from_temp(tmp_path, path, write):
+    """Run ``write(tmp_path)`` and rename the result over ``path``; a failed write leaves no temp file behind."""
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _write_file(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def write_bytes(path, data):
+    """
+    Atomically write ``data`` to ``path`` unless it already holds exactly that.
+
+    The content goes to a temp file next to ``path`` and is renamed over it,
+    so readers (the dev server, a deploy) never see a half-written file.
+    Returns True if the file was written.
+    """
+    if _same_bytes(path, data):
+        return False
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    replace_from_temp(f"{path}.{os.getpid()}.tmp", path, lambda tmp_path: _write_file(tmp_path, data))
+    return True
+
+
+def write_text(path, text, encoding='utf-8'):
+    return write_bytes(path, text.encode(encoding))
+
+
+def copy_file(src_path, dest_path):
+    """``shutil.copy2`` with the same skip-if-identical and atomic rename."""
+    if _same_file(src_path, dest_path):
+        return False
+    Path(dest_path).parent.mkdir(parents=True, exist_ok=True)
+    replace_from_temp(f"{dest_path}.{os.getpid()}.tmp", dest_path, lambda tmp_path: shutil.copy2(src_path, tmp_path))
+    return True
+
+
+def remove_output(path):
+    """Delete a generated file, and its directory if that leaves it empty."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    parent = Path(path).parent
+    if parent != OUTPUT_DIR and parent.is_dir() and not any(parent.iterdir()):
+        parent.rmdir()
+    return True
+
+
+class OutputReport:
+    """Which outputs a build wrote, found unchanged or deleted."""
+
+    def __init__(self):
+        self.written = []
+        self.unchanged = []
+        self.deleted = []
+
+    def record(self, path, changed):
+        (self.written if changed else self.unchanged).append(str(path))
+
+    def write_text(self, path, text):
+        self.record(path, write_text(path, text))
+
+    def copy_file(self, src_path, dest_path):
+        changed = copy_file(src_path, dest_path)
+        self.record(dest_path, changed)
+        return changed
+
+    def remove(self, path):
+        if remove_output(path):
+            self.deleted.append(str(path))
+
+    def summary(self):
+        return f"{len(self.written)} written, {len(self.unchanged)} unchanged, {len(self.deleted)} deleted"
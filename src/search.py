@@ -0,0 +1,74 @@
+import re
+import json
+
+from collections import defaultdict
+from core import *
+
+SEARCH_DIR = OUTPUT_DIR / 'search'
+SEARCH_INDEX_FILE = SEARCH_DIR / 'index.json'
+SHARD_PREFIX_LENGTH = 2  # search.js uses the same value
+MAX_POSITIONS = 16  # per token and post, enough to rank and match phrases
+MIN_TOKEN_LENGTH = 2
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+STOPWORDS = frozenset('''
+    a an and are as at be but by for from has have if in into is it its of on or that the their then there
+    these this to was we were which will with you your
+'''.split())
+
+# Markdown/HTML syntax that isn't searchable text
+MARKDOWN_NOISE = re.compile(
+    r'!\[([^\]]*)\]\([^)]*\)'   # images: keep the alt text
+    r'|\]\([^)]*\)'             # link targets
+    r'|<[^>]+>'                 # tags
+    r'|attachment:\S+'
+)
+
+
+def tokenize(text):
+    """Lower-cased word tokens of ``text``, stop words and 1-letter words dropped."""
+    return [
+        token for token in (match.group(0).lower() for match in TOKEN.finditer(text))
+        if len(token) >= MIN_TOKEN_LENGTH and token not in STOPWORDS and not token.isdigit()
+    ]
+
+
+def searchable_text(cell):
+    """Text of a markdown or code cell as a reader would search for it."""
+    source = cell.source if isinstance(cell.source, str) else ''.join(cell.source)
+    if cell.cell_type == 'markdown':
+        return MARKDOWN_NOISE.sub(lambda m: m.group(1) or ' ', source)
+    return source
+
+
+def postings(texts):
+    """``{token: [positions]}`` over ``texts`` read as one document."""
+    result = defaultdict(list)
+    for position, token in enumerate(token for text in texts for token in tokenize(text)):
+        if len(result[token]) < MAX_POSITIONS:
+            result[token].append(position)
+    return dict(result)
+
+
+def shard_key(token):
+    return token[:SHARD_PREFIX_LENGTH]
+
+
+def build_shards(doc_postings):
+    """
+    Invert per-post postings into prefix shards.
+
+    ``doc_postings`` is a list indexed by post id. Each shard maps a token to
+    ``[[post_id, first_position, delta, delta, ...], ...]``; positions are
+    delta-encoded to keep the JSON small.
+    """
+    shards = defaultdict(dict)
+    for doc_id, doc in enumerate(doc_postings):
+        for token, positions in doc.items():
+            deltas = [positions[0]] + [b - a for a, b in zip(positions, positions[1:])]
+            shards[shard_key(token)].setdefault(token, []).append([doc_id] + deltas)
+    return {prefix: dict(sorted(tokens.items())) for prefix, tokens in sorted(shards.items())}
+
+
+def compact_json(value):
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False, sort_keys=True)
@@ -0,0 +1,131 @@
+import json
+import asyncio
+import mimetypes
+
+from urllib.parse import unquote, urlsplit
+from assets import ASSET_NAME_PATTERN
+from static_assets import FINGERPRINT_PATTERN
+from core import *
+
+HTTP_PORT = 8000
+WS_PORT = 8765  # main.js connects here
+
+clients = set()  # Store connected WebSocket clients
+
+
+async def websocket_handler(websocket, path=None):
+    """ Handle WebSocket connections """
+    print("Client connected")
+    clients.add(websocket)
+    try:
+        async for message in websocket:
+            pass  # Keep connection open
+    finally:
+        clients.discard(websocket)
+        print("Client disconnected")
+
+
+def reload_message(changed_outputs):
+    """
+    Pick the cheapest update that shows ``changed_outputs`` in open pages.
+
+    If only stylesheets changed the pages swap their ``<link>`` tags,
+    anything else needs a full reload.
+    """
+    if changed_outputs and all(path.endswith('.css') for path in changed_outputs):
+        return {'type': 'css', 'paths': sorted(changed_outputs)}
+    return {'type': 'reload'}
+
+
+async def notify_clients(changed_outputs=None):
+    """ Notify all connected clients to reload specific file types """
+    if not clients:
+        return
+    message = json.dumps(reload_message(changed_outputs or []))
+    results = await asyncio.gather(
+        *(client.send(message) for client in list(clients)),
+        return_exceptions=True
+    )
+    failed = sum(isinstance(result, Exception) for result in results)
+    print(f"📡 Sent {message} to {len(results) - failed} client(s)")
+
+
+def resolve_request_path(target):
+    """Map a request target onto a file inside OUTPUT_DIR, or None."""
+    root = OUTPUT_DIR.resolve()
+    relative = unquote(urlsplit(target).path).lstrip('/')
+    path = (root / relative).resolve()
+    if path != root and root not in path.parents:
+        return None
+    if path.is_dir():
+        path = path / 'index.html'
+    return path if path.is_file() else None
+
+
+def cache_control_for(filename):
+    """
+    Content-hashed files never change under their name, so they can be
+    cached for a year; everything else is always revalidated.
+    """
+    if FINGERPRINT_PATTERN.search(filename) or ASSET_NAME_PATTERN.match(filename):
+        return 'public, max-age=31536000, immutable'
+    return 'no-store'
+
+
+async def http_handler(reader, writer):
+    """Serve files from OUTPUT_DIR, caching only content-hashed files."""
+    try:
+        request_line = await reader.readline()
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+
+        parts = request_line.decode('latin-1').split()
+        if len(parts) != 3:
+            return
+        method, target, _ = parts
+
+        path = resolve_request_path(target)
+        if method not in ('GET', 'HEAD'):
+            status, body, content_type = '405 Method Not Allowed', b'', 'text/plain'
+            cache_control = 'no-store'
+        elif path is None:
+            status, body, content_type = '404 Not Found', b'Not found', 'text/plain'
+            cache_control = 'no-store'
+        else:
+            loop = asyncio.get_running_loop()
+            body = await loop.run_in_executor(None, path.read_bytes)
+            status = '200 OK'
+            content_type = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+            cache_control = cache_control_for(path.name)
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Cache-Control: {cache_control}\r\n"
+            "Connection: close\r\n\r\n".encode('latin-1')
+        )
+        if method != 'HEAD':
+            writer.write(body)
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_http_server(port=HTTP_PORT):
+    server = await asyncio.start_server(http_handler, 'localhost', port)
+    print(f"🌐 Serving {OUTPUT_DIR} at http://localhost:{port}/")
+    return server
+
+
+async def start_websocket_server(port=WS_PORT):
+    # Only the dev server needs websockets, plain builds don't import it
+    import websockets
+
+    server = await websockets.serve(websocket_handler, 'localhost', port)
+    print(f"🔌 Live reload on ws://localhost:{port}")
+    return server
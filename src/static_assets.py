@@ -0,0 +1,170 @@
+import os
+import re
+import json
+
+from pathlib import Path
+from core import *
+
+STATIC_MANIFEST_FILE = CACHE_DIR / 'static-manifest.json'
+STATIC_ASSETS_SOURCE = Path(__file__)
+FINGERPRINT_LENGTH = 10
+FINGERPRINT_PATTERN = re.compile(rf'\.[0-9a-f]{{{FINGERPRINT_LENGTH}}}\.(css|js)$')
+
+# Logical name -> sources, all relative to RESOURCES_DIR. Bundles keep the
+# order the <link>/<script> tags used to have.
+STATIC_BUNDLES = {
+    'styles/site.css': ['styles/style.css', 'styles/colors.css'],
+    'styles/post.css': ['styles/colors.css', 'styles/style.css', 'styles/posts.css', 'styles/syntax.css'],
+    'scripts/post.js': ['scripts/main.js', 'scripts/posts.js', 'scripts/fragments.js'],
+}
+STATIC_DIRECTORIES = ('styles', 'scripts')
+STATIC_EXTENSIONS = ('.css', '.js')
+
+# Strings are kept verbatim, comments dropped, everything else tightened
+CSS_STRING_OR_COMMENT = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|/\*.*?\*/''', re.DOTALL)
+CSS_TIGHT = re.compile(r'\s*([{};,>])\s*|:\s+')
+
+
+def _tighten_css(code):
+    code = re.sub(r'\s+', ' ', code)
+    return CSS_TIGHT.sub(lambda m: m.group(1) or ':', code)
+
+
+def minify_css(css):
+    """
+    Strip comments and collapse whitespace.
+
+    Whitespace is only removed around ``{ } ; , >`` and after ``:``, where it
+    can never change meaning (``calc(1px + 2px)`` keeps its spaces).
+    """
+    parts, code, last = [], [], 0
+    for match in CSS_STRING_OR_COMMENT.finditer(css):
+        code.append(css[last:match.start()])
+        if match.group(1):
+            parts += [_tighten_css(''.join(code)), match.group(1)]
+            code = []
+        last = match.end()
+    code.append(css[last:])
+    parts.append(_tighten_css(''.join(code)))
+    return ''.join(parts).replace(';}', '}').strip()
+
+
+# Keywords after which a ``/`` starts a regex literal rather than a division
+REGEX_KEYWORDS = ('return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete', 'void', 'throw', 'yield', 'await')
+
+
+def _regex_allowed(out):
+    """A ``/`` starts a regex literal unless it follows a value."""
+    code = ''.join(out[-20:]).rstrip()
+    if not code or code[-1] in '(,=:[!&|?{};+-*%<>~^':
+        return True
+    return re.search(r'(?<![\w$.])(' + '|'.join(REGEX_KEYWORDS) + r')$', code) is not None
+
+
+def _literal_end(js, i):
+    """Index just past the string, template or regex literal starting at ``i``."""
+    quote, end, in_class = js[i], i + 1, False
+    while end < len(js):
+        c = js[end]
+        if c == '\\':
+            end += 2
+            continue
+        if quote == '/':
+            if c == '\n':
+                break
+            if c == '[':
+                in_class = True
+            elif c == ']':
+                in_class = False
+            elif c == '/' and not in_class:
+                break
+        elif c == quote:
+            break
+        end += 1
+    return end + 1
+
+
+def minify_js(js):
+    """
+    Strip comments, indentation, trailing spaces and blank lines.
+
+    Line breaks are kept so automatic semicolon insertion behaves exactly as
+    in the source; strings, template literals and regex literals are copied
+    verbatim.
+    """
+    out = []
+    line_start = True
+    i, n = 0, len(js)
+    while i < n:
+        c = js[i]
+        if js.startswith('//', i):
+            i = js.find('\n', i)
+            i = n if i == -1 else i
+        elif js.startswith('/*', i):
+            end = js.find('*/', i + 2)
+            i = n if end == -1 else end + 2
+        elif c in '"\'`' or (c == '/' and _regex_allowed(out)):
+            end = _literal_end(js, i)
+            out.append(js[i:end])
+            line_start = False
+            i = end
+        elif c == '\n':
+            while out and out[-1] in (' ', '\t', '\r'):
+                out.pop()
+            if not line_start:
+                out.append('\n')
+            line_start = True
+            i += 1
+        elif c in ' \t\r' and line_start:
+            i += 1
+        else:
+            out.append(c)
+            line_start = False
+            i += 1
+    return ''.join(out).strip()
+
+
+def minify(logical_name, text):
+    return minify_css(text) if logical_name.endswith('.css') else minify_js(text)
+
+
+def static_sources():
+    """
+    Every published CSS/JS asset and its sources: the bundles plus each file
+    under ``styles``/``scripts`` on its own (for pages that use it directly).
+    """
+    assets = {}
+    for directory in STATIC_DIRECTORIES:
+        for root, dirs, files in os.walk(RESOURCES_DIR / directory):
+            dirs.sort()
+            for filename in sorted(files):
+                if filename.endswith(STATIC_EXTENSIONS):
+                    logical = Path(os.path.relpath(os.path.join(root, filename), RESOURCES_DIR)).as_posix()
+                    assets[logical] = [logical]
+    assets.update(STATIC_BUNDLES)
+    return assets
+
+
+def fingerprinted_name(logical_name, digest):
+    stem, ext = os.path.splitext(logical_name)
+    return f"{stem}.{digest[:FINGERPRINT_LENGTH]}{ext}"
+
+
+def build_static_asset(logical_name, sources, minified=True):
+    """Concatenate and minify ``sources``, returning the published text."""
+    parts = []
+    for source in sources:
+        with open(RESOURCES_DIR / source, 'r', encoding='utf-8') as f:
+            text = f.read()
+        parts.append(minify(logical_name, text) if minified else text)
+    # A newline keeps JS statements apart when a file lacks a final semicolon
+    return '\n'.join(parts) + '\n'
+
+
+def load_static_manifest(path=STATIC_MANIFEST_FILE):
+    """Logical name -> published path, as written by the last build."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import threading
+import functools
+import tracemalloc
+
+from contextlib import contextmanager, nullcontext
+
+
+def now_us():
+    # perf_counter is CLOCK_MONOTONIC on Linux, so worker timestamps line up
+    return time.perf_counter() * 1e6
+
+
+class Tracer:
+    """
+    Records build stages as Chrome trace events (open in Perfetto or
+    chrome://tracing).
+
+    Every span stores its wall time and, through tracemalloc, the peak
+    memory allocated while it ran (including nested spans). Tracing is off
+    until ``enable`` is called, and ``span`` is then nearly free;
+    ``disable`` turns it off again.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.started_tracemalloc = False
+        self.events = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def enable(self, memory=True):
+        self.enabled = True
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracemalloc = True
+
+    def disable(self):
+        """Stop tracing (and the tracemalloc ``enable`` started) and drop unsaved events."""
+        self.enabled = False
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+        self.drain()
+
+    def _stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def _peak(self):
+        return tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+
+    @contextmanager
+    def _span(self, name, cat, args):
+        stack = self._stack()
+        if stack:
+            # Resetting the peak below would lose what the parent saw so far
+            stack[-1]['peak'] = max(stack[-1]['peak'], self._peak())
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        frame = {'peak': 0}
+        stack.append(frame)
+        started = now_us()
+        try:
+            yield
+        finally:
+            duration = now_us() - started
+            stack.pop()
+            peak = max(frame['peak'], self._peak())
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            event = {
+                'name': name, 'cat': cat, 'ph': 'X',
+                'ts': started, 'dur': duration,
+                'pid': os.getpid(), 'tid': threading.get_ident(),
+                'args': dict(args, peak_memory_kb=round(peak / 1024, 1)),
+            }
+            with self.lock:
+                self.events.append(event)
+
+    def span(self, name, cat='build', **args):
+        """Context manager timing one stage, a no-op while tracing is off."""
+        if not self.enabled:
+            return nullcontext()
+        return self._span(name, cat, args)
+
+    def drain(self):
+        """Hand over the recorded events, e.g. to send them back from a worker."""
+        with self.lock:
+            events, self.events = self.events, []
+        return events
+
+    def extend(self, events):
+        with self.lock:
+            self.events.extend(events)
+
+    def save(self, path):
+        events = sorted(self.drain(), key=lambda event: event['ts'])
+        names = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+                  'args': {'name': 'build' if pid == os.getpid() else f'worker {pid}'}}
+                 for pid in sorted({event['pid'] for event in events})]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': names + events, 'displayTimeUnit': 'ms'}, f)
+        print(f"🔍 Wrote {len(events)} trace events to {path}")
+
+
+tracer = Tracer()
+
+
+def span(name, cat='build', **args):
+    return tracer.span(name, cat, **args)
+
+
+def traced(name, cat='build'):
+    """Decorator form of ``span``."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name, cat):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TracedPreprocessor:
+    """
+    Wraps an nbconvert preprocessor so each run shows up as its own span.
+    ``enabled`` is the wrapped preprocessor's, which is what nbconvert sets
+    when registering it.
+    """
+
+    def __init__(self, preprocessor):
+        self.preprocessor = preprocessor
+        self.name = type(preprocessor).__name__
+
+    @property
+    def enabled(self):
+        return getattr(self.preprocessor, 'enabled', True)
+
+    @enabled.setter
+    def enabled(self, value):
+        self.preprocessor.enabled = value
+
+    def __call__(self, nb, resources):
+        with tracer.span(self.name, 'preprocess'):
+            return self.preprocessor(nb, resources)
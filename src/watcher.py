@@ -0,0 +1,282 @@
+import os
+import sys
+import errno
+import struct
+import asyncio
+import hashlib
+import ctypes
+import ctypes.util
+
+DEBOUNCE_DELAY = 0.2  # seconds of quiet before a burst of saves is reported
+POLL_INTERVAL = 1  # seconds between stat() sweeps of the polling backend
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class Watcher:
+    """
+    Base class for the file watcher backends.
+
+    Backends only report *candidate* paths. The base class debounces bursts
+    of candidates into one batch and confirms each candidate against the
+    last known (mtime, size) and content hash, so files are only read when
+    their stat actually changed and touch-only saves don't trigger builds.
+    """
+
+    def __init__(self, root='.', extensions=None, ignored=(), debounce=DEBOUNCE_DELAY):
+        self.root = root
+        self.extensions = tuple(extensions) if extensions else None
+        self.ignored = [os.path.normpath(path) for path in ignored]
+        self.debounce = debounce
+        self.file_stats = {}
+        self.file_hashes = {}
+        self.candidates = None
+
+    def is_ignored_dir(self, path):
+        path = os.path.normpath(path)
+        return any(path == ignored or path.startswith(ignored + os.sep) for ignored in self.ignored)
+
+    def is_watched_file(self, path):
+        name = os.path.basename(path)
+        if name.startswith('.'):
+            return False
+        if self.extensions and not name.endswith(self.extensions):
+            return False
+        return not self.is_ignored_dir(os.path.dirname(path))
+
+    def walk(self, top=None):
+        """Yield (directory, files) for every directory that isn't ignored."""
+        for root, dirs, files in os.walk(top or self.root):
+            dirs[:] = [d for d in dirs if not self.is_ignored_dir(os.path.join(root, d))]
+            yield root, files
+
+    def scan(self):
+        """Record the stat of every watched file without reading any of them."""
+        for root, files in self.walk():
+            for file in files:
+                path = os.path.join(root, file)
+                if self.is_watched_file(path):
+                    self.file_stats[path] = self.stat(path)
+
+    @staticmethod
+    def stat(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    @staticmethod
+    def hash_file(path):
+        try:
+            with open(path, 'rb') as f:
+                return hashlib.md5(f.read()).hexdigest()
+        except (IOError, PermissionError):
+            return None
+
+    def confirm(self, paths):
+        """Filter candidate paths down to files whose content really changed."""
+        changed = set()
+        for path in paths:
+            stat = self.stat(path)
+            if stat == self.file_stats.get(path):
+                continue
+            self.file_stats[path] = stat
+            if stat is None:
+                self.file_stats.pop(path, None)
+                self.file_hashes.pop(path, None)
+                changed.add(path)
+                continue
+            digest = self.hash_file(path)
+            if digest is None or digest != self.file_hashes.get(path):
+                self.file_hashes[path] = digest
+                changed.add(path)
+        return changed
+
+    def add_candidates(self, paths):
+        self.candidates.put_nowait(set(paths))
+
+    async def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    async def changes(self):
+        """Yield sets of changed file paths, one set per debounced burst."""
+        self.candidates = asyncio.Queue()
+        self.scan()
+        await self.start()
+        try:
+            while True:
+                pending = await self.candidates.get()
+                while True:
+                    try:
+                        pending |= await asyncio.wait_for(self.candidates.get(), self.debounce)
+                    except asyncio.TimeoutError:
+                        break
+                changed = self.confirm(pending)
+                if changed:
+                    yield changed
+        finally:
+            self.stop()
+
+
+class PollingWatcher(Watcher):
+    """Portable backend: compares (mtime, size) of every watched file on an interval."""
+
+    def __init__(self, *args, interval=POLL_INTERVAL, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.interval = interval
+        self.last_seen = {}
+        self.task = None
+
+    async def start(self):
+        self.last_seen = dict(self.file_stats)
+        self.task = asyncio.create_task(self.poll())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    async def poll(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            # Compare against the previous sweep (not the confirmed state), so a
+            # file that keeps changing doesn't hold the debounce open forever
+            current = {}
+            for root, files in self.walk():
+                for file in files:
+                    path = os.path.join(root, file)
+                    if self.is_watched_file(path):
+                        current[path] = self.stat(path)
+            candidates = [path for path, stat in current.items() if stat != self.last_seen.get(path)]
+            candidates.extend(path for path in self.last_seen if path not in current)
+            self.last_seen = current
+            if candidates:
+                self.add_candidates(candidates)
+
+
+class InotifyWatcher(Watcher):
+    """Linux backend: the kernel tells us which files changed, so idle cost is zero."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.libc = load_libc()
+        self.fd = None
+        self.watches = {}
+
+    async def start(self):
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        for root, _ in self.walk():
+            self.add_watch(root)
+        asyncio.get_running_loop().add_reader(self.fd, self.read_events)
+
+    def stop(self):
+        if self.fd is not None:
+            asyncio.get_running_loop().remove_reader(self.fd)
+            os.close(self.fd)
+            self.fd = None
+
+    def add_watch(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                print("⚠️ inotify watch limit reached, raise fs.inotify.max_user_watches")
+            return
+        self.watches[wd] = directory
+
+    def add_tree(self, directory):
+        """Watch a newly created directory and report the files already inside it."""
+        candidates = []
+        for root, files in self.walk(directory):
+            self.add_watch(root)
+            candidates.extend(os.path.join(root, file) for file in files)
+        return [path for path in candidates if self.is_watched_file(path)]
+
+    def read_events(self):
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        candidates = []
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(buffer[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # The kernel dropped events: fall back to one full stat sweep
+                candidates.extend(self.file_stats)
+                for root, files in self.walk():
+                    candidates.extend(os.path.join(root, file) for file in files)
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+
+            directory = self.watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+
+            if mask & IN_ISDIR:
+                if self.is_ignored_dir(path):
+                    continue
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    candidates.extend(self.add_tree(path))
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    prefix = path + os.sep
+                    candidates.extend(p for p in self.file_stats if p.startswith(prefix))
+            elif self.is_watched_file(path):
+                candidates.append(path)
+
+        candidates = [path for path in candidates if self.is_watched_file(path)]
+        if candidates:
+            self.add_candidates(candidates)
+
+
+def load_libc():
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+
+def inotify_available():
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        return hasattr(load_libc(), 'inotify_init1')
+    except OSError:
+        return False
+
+
+def create_watcher(root='.', extensions=None, ignored=(), backend='auto', **kwargs):
+    """Pick the inotify backend on Linux and stat polling everywhere else."""
+    if backend == 'inotify' or (backend == 'auto' and inotify_available()):
+        return InotifyWatcher(root, extensions, ignored, **kwargs)
+    return PollingWatcher(root, extensions, ignored, **kwargs)
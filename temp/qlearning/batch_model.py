@@ -0,0 +1,129 @@
+import time
+import argparse
+import numpy as np
+
+from cartpole import BatchCartPole
+
+# Same hyperparameters and discretization as model.py
+LEARNING_RATE = 0.1
+DISCOUNT = 0.95
+EPISODES = 60000
+
+Observation = [30, 30, 50, 50]
+np_array_win_size = np.array([0.25, 0.25, 0.01, 0.1])
+np_array_offset = np.array([15, 10, 1, 10])
+
+EPSILON_DECAY_VALUE = 0.99995
+EPSILON_DECAY_START = 10000  # episodes of pure exploration
+EPSILON_MIN = 0.05
+
+
+def discretize(states):
+    """
+    Flat Q-table row of every state in a batch.
+
+    Bins like model.py's get_discrete_state, including its negative bins,
+    which index from the end of the table the way NumPy indexing did
+    there. Bins past the end of the table (model.py's IndexError) are
+    clipped to the last one.
+    """
+    size = np.array(Observation)
+    bins = (states / np_array_win_size + np_array_offset).astype(np.int64)
+    bins = np.clip(np.where(bins < 0, bins + size, bins), 0, size - 1)
+    return np.ravel_multi_index(bins.T, Observation)
+
+
+class BatchQLearner:
+    """
+    Tabular Q-learning on N CartPoles at once.
+
+    Every ``step`` picks actions, steps the environments and updates the
+    Q-table for the whole batch with array operations. Environments that
+    hit the same state/action in one step share one update with their mean
+    TD error (scattered with ``np.add.at``), computed from the table as it
+    was before the step.
+    """
+
+    def __init__(self, n_envs=1024, seed=82, learning_rate=LEARNING_RATE, discount=DISCOUNT):
+        self.rng = np.random.default_rng(seed)
+        self.env = BatchCartPole(n_envs, seed=seed)
+        self.learning_rate = learning_rate
+        self.discount = discount
+        # One row per discrete state, one column per action
+        self.q_table = self.rng.uniform(low=0, high=1, size=(int(np.prod(Observation)), self.env.n_actions))
+        # Scratch space for scattering one step's updates, zero between steps
+        self.error_sums = np.zeros(self.q_table.size)
+        self.update_counts = np.zeros(self.q_table.size)
+        self.states = discretize(self.env.states)
+        self.episode_rewards = np.zeros(n_envs)
+        self.episodes = 0
+        self.epsilon = 1.0
+        self.finished_rewards = []
+
+    def step(self):
+        n = self.env.n
+        explore = self.rng.random(n) < self.epsilon
+        actions = np.where(explore, self.rng.integers(0, self.env.n_actions, n), self.q_table[self.states].argmax(axis=1))
+
+        next_states, rewards, terminated, truncated = self.env.step(actions)
+        done = terminated | truncated
+        next_rows = discretize(next_states)
+        self.episode_rewards += rewards
+
+        # Like model.py, the last transition of an episode isn't learned from
+        learn = ~done
+        rows, cols = self.states[learn], actions[learn]
+        targets = rewards[learn] + self.discount * self.q_table[next_rows[learn]].max(axis=1)
+        errors = targets - self.q_table[rows, cols]
+        # Scatter the mean error of each state/action, a plain sum would
+        # overshoot where many environments share a state
+        cells = rows * self.env.n_actions + cols
+        np.add.at(self.error_sums, cells, errors)
+        np.add.at(self.update_counts, cells, 1)
+        q_values = self.q_table.reshape(-1)
+        # Repeated cells all write the same value
+        q_values[cells] += self.learning_rate * self.error_sums[cells] / self.update_counts[cells]
+        self.error_sums[cells] = 0
+        self.update_counts[cells] = 0
+
+        # Finished environments were reset, their next row is the new episode's first state
+        self.states = np.where(done, discretize(self.env.states), next_rows)
+        if done.any():
+            self.finished_rewards.extend(self.episode_rewards[done].tolist())
+            self.episode_rewards[done] = 0
+            self.episodes += int(done.sum())
+            if self.episodes > EPSILON_DECAY_START:
+                self.epsilon = max(EPSILON_MIN, EPSILON_DECAY_VALUE ** (self.episodes - EPSILON_DECAY_START))
+        return n
+
+    def train(self, episodes=EPISODES, report_every=2000):
+        """Step until ``episodes`` episodes have finished, printing progress along the way."""
+        next_report = report_every
+        steps = 0
+        started = time.perf_counter()
+        while self.episodes < episodes:
+            steps += self.step()
+            if self.episodes >= next_report:
+                mean_reward = np.mean(self.finished_rewards) if self.finished_rewards else 0.0
+                elapsed = time.perf_counter() - started
+                print(f"Episode: {self.episodes}  Mean Reward: {mean_reward:.1f}  "
+                      f"Epsilon: {self.epsilon:.3f}  Steps/s: {steps / elapsed:,.0f}")
+                self.finished_rewards = []
+                next_report += report_every
+        return self.q_table.reshape(Observation + [self.env.n_actions])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Train CartPole Q-learning on a batch of environments.')
+    parser.add_argument('--envs', type=int, default=1024, help='environments stepped together')
+    parser.add_argument('--episodes', type=int, default=EPISODES)
+    parser.add_argument('--learning-rate', type=float, default=LEARNING_RATE)
+    parser.add_argument('--discount', type=float, default=DISCOUNT)
+    parser.add_argument('--seed', type=int, default=82)
+    parser.add_argument('--save', metavar='Q_TABLE.npy', help='write the trained Q-table')
+    cfg = parser.parse_args()
+
+    learner = BatchQLearner(cfg.envs, cfg.seed, cfg.learning_rate, cfg.discount)
+    q_table = learner.train(cfg.episodes)
+    if cfg.save:
+        np.save(cfg.save, q_table)
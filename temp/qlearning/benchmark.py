@@ -0,0 +1,83 @@
+"""
+Steps/second of model.py's one-environment training loop against
+BatchQLearner at a few batch sizes.
+
+The loop runs on gym's CartPole-v1 when gym is installed (without
+rendering) and on the equivalent pure Python CartPole otherwise.
+"""
+import time
+import argparse
+import numpy as np
+
+from cartpole import CartPole
+from batch_model import BatchQLearner, Observation, np_array_win_size, np_array_offset, LEARNING_RATE, DISCOUNT
+
+
+def make_env():
+    try:
+        import gym
+    except ImportError:
+        return CartPole(seed=82), 'pure Python CartPole'
+    return gym.make("CartPole-v1"), 'gym CartPole-v1'
+
+
+def get_discrete_state(state):
+    discrete_state = state / np_array_win_size + np_array_offset
+    # Clipped like batch_model.discretize, so fast carts don't raise IndexError
+    return tuple(np.minimum(discrete_state.astype(int), np.array(Observation) - 1))
+
+
+def loop_steps_per_second(steps):
+    """model.py's training loop, for ``steps`` environment steps."""
+    env, name = make_env()
+    q_table = np.random.uniform(low=0, high=1, size=(Observation + [env.action_space.n]))
+    epsilon = 1
+
+    started = time.perf_counter()
+    done_steps = 0
+    while done_steps < steps:
+        state, _ = env.reset()
+        discrete_state = get_discrete_state(state)
+        done = False
+        while not done and done_steps < steps:
+            if np.random.random() > epsilon:
+                action = np.argmax(q_table[discrete_state])
+            else:
+                action = np.random.randint(0, env.action_space.n)
+
+            new_state, reward, terminated, truncated, _ = env.step(action)
+            done = terminated or truncated
+            done_steps += 1
+            new_discrete_state = get_discrete_state(new_state)
+
+            if not done:
+                max_future_q = np.max(q_table[new_discrete_state])
+                current_q = q_table[discrete_state + (action,)]
+                new_q = (1 - LEARNING_RATE) * current_q + LEARNING_RATE * (reward + DISCOUNT * max_future_q)
+                q_table[discrete_state + (action,)] = new_q
+
+            discrete_state = new_discrete_state
+    return done_steps / (time.perf_counter() - started), name
+
+
+def batch_steps_per_second(n_envs, steps):
+    learner = BatchQLearner(n_envs)
+    learner.step()  # first-touch of the Q-table isn't part of the rate
+    started = time.perf_counter()
+    done_steps = 0
+    while done_steps < steps:
+        done_steps += learner.step()
+    return done_steps / (time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--steps', type=int, default=200_000, help='environment steps per measurement')
+    parser.add_argument('--envs', type=int, nargs='+', default=[1, 64, 1024, 8192], help='batch sizes to measure')
+    cfg = parser.parse_args()
+
+    baseline, name = loop_steps_per_second(min(cfg.steps, 50_000))
+    print(f"{'model.py loop (' + name + ')':<40} {baseline:>12,.0f} steps/s")
+    for n_envs in cfg.envs:
+        rate = batch_steps_per_second(n_envs, cfg.steps)
+        print(f"{f'BatchQLearner, {n_envs} envs':<40} {rate:>12,.0f} steps/s  {rate / baseline:>7.1f}x")
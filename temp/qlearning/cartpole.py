@@ -0,0 +1,117 @@
+import math
+import numpy as np
+
+# Constants of gym's CartPole-v1
+GRAVITY = 9.8
+MASS_CART = 1.0
+MASS_POLE = 0.1
+TOTAL_MASS = MASS_CART + MASS_POLE
+LENGTH = 0.5  # half the pole's length
+POLE_MASS_LENGTH = MASS_POLE * LENGTH
+FORCE_MAG = 10.0
+TAU = 0.02  # seconds between state updates
+THETA_THRESHOLD = 12 * 2 * math.pi / 360
+X_THRESHOLD = 2.4
+MAX_EPISODE_STEPS = 500
+
+
+class BatchCartPole:
+    """
+    N CartPole-v1 environments stepped together with NumPy.
+
+    Same dynamics (Euler integration), termination and 500 step limit as
+    gym's CartPole-v1. Finished environments are reset automatically; step
+    returns the state each one ended in before that reset.
+    """
+
+    n_actions = 2
+
+    def __init__(self, n, seed=None):
+        self.n = n
+        self.rng = np.random.default_rng(seed)
+        self.states = np.zeros((n, 4))
+        self.steps = np.zeros(n, dtype=np.int64)
+        self.reset()
+
+    def reset(self, mask=None):
+        if mask is None:
+            mask = np.ones(self.n, dtype=bool)
+        self.states[mask] = self.rng.uniform(-0.05, 0.05, size=(int(mask.sum()), 4))
+        self.steps[mask] = 0
+        return self.states
+
+    def step(self, actions):
+        """Returns ``(next_states, rewards, terminated, truncated)``, resetting finished environments."""
+        x, x_dot, theta, theta_dot = self.states.T
+        force = np.where(actions == 1, FORCE_MAG, -FORCE_MAG)
+        cos_theta = np.cos(theta)
+        sin_theta = np.sin(theta)
+
+        temp = (force + POLE_MASS_LENGTH * theta_dot ** 2 * sin_theta) / TOTAL_MASS
+        theta_acc = (GRAVITY * sin_theta - cos_theta * temp) / (
+            LENGTH * (4.0 / 3.0 - MASS_POLE * cos_theta ** 2 / TOTAL_MASS)
+        )
+        x_acc = temp - POLE_MASS_LENGTH * theta_acc * cos_theta / TOTAL_MASS
+
+        next_states = np.stack([
+            x + TAU * x_dot,
+            x_dot + TAU * x_acc,
+            theta + TAU * theta_dot,
+            theta_dot + TAU * theta_acc,
+        ], axis=1)
+        self.steps += 1
+
+        terminated = (np.abs(next_states[:, 0]) > X_THRESHOLD) | (np.abs(next_states[:, 2]) > THETA_THRESHOLD)
+        truncated = ~terminated & (self.steps >= MAX_EPISODE_STEPS)
+        rewards = np.ones(self.n)
+
+        self.states = next_states.copy()
+        self.reset(terminated | truncated)
+        return next_states, rewards, terminated, truncated
+
+
+class CartPole:
+    """
+    One CartPole-v1 in plain Python, with gym's ``reset``/``step`` API.
+
+    Stands in for ``gym.make("CartPole-v1")`` when timing the original
+    training loop without gym.
+    """
+
+    class action_space:
+        n = 2
+
+    def __init__(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.state = None
+        self.steps = 0
+
+    def reset(self, seed=None):
+        if seed is not None:
+            self.rng = np.random.default_rng(seed)
+        self.state = self.rng.uniform(-0.05, 0.05, size=4)
+        self.steps = 0
+        return np.array(self.state), {}
+
+    def step(self, action):
+        x, x_dot, theta, theta_dot = self.state
+        force = FORCE_MAG if action == 1 else -FORCE_MAG
+        cos_theta = math.cos(theta)
+        sin_theta = math.sin(theta)
+
+        temp = (force + POLE_MASS_LENGTH * theta_dot ** 2 * sin_theta) / TOTAL_MASS
+        theta_acc = (GRAVITY * sin_theta - cos_theta * temp) / (
+            LENGTH * (4.0 / 3.0 - MASS_POLE * cos_theta ** 2 / TOTAL_MASS)
+        )
+        x_acc = temp - POLE_MASS_LENGTH * theta_acc * cos_theta / TOTAL_MASS
+
+        self.state = (
+            x + TAU * x_dot,
+            x_dot + TAU * x_acc,
+            theta + TAU * theta_dot,
+            theta_dot + TAU * theta_acc,
+        )
+        self.steps += 1
+        terminated = abs(self.state[0]) > X_THRESHOLD or abs(self.state[2]) > THETA_THRESHOLD
+        truncated = not terminated and self.steps >= MAX_EPISODE_STEPS
+        return np.array(self.state), 1.0, terminated, truncated, {}
@@ -28,11 +28,11 @@ q_table.shape
 
 def get_discrete_state(state):
     discrete_state = state/np_array_win_size+ np.array([15,10,1,10])
-    return tuple(discrete_state.astype(np.int))
+    return tuple(discrete_state.astype(int))
 
 for episode in range(EPISODES + 1): 
     t0 = time.time()
-    discrete_state = get_discrete_state(env.reset()) 
+    discrete_state = get_discrete_state(env.reset()[0]) 
     done = False
     episode_reward = 0 
 
@@ -48,7 +48,8 @@ for episode in range(EPISODES + 1):
 
             action = np.random.randint(0, env.action_space.n) 
 
-        new_state, reward, done, _ = env.step(action) 
+        new_state, reward, terminated, truncated, _ = env.step(action) 
+        done = terminated or truncated
 
         episode_reward += reward 
 